@@ -72,6 +72,7 @@ def set_config(cmonkey_run, config):
         cmonkey_run['scan_distances'][seqtype] = tuple(
             map(int, config.get(cat, 'scan_distance').split(',')))
 
+    cmonkey_run['vectorized_row_scoring'] = config.getboolean('Rows', 'vectorized')
     cmonkey_run['row_schedule'] = make_schedule(config.get("Rows", "schedule"))
     cmonkey_run['column_schedule'] = make_schedule(config.get("Columns", "schedule"))
     cmonkey_run['meme_schedule'] = make_schedule(config.get("MEME", "schedule"))
@@ -80,12 +81,23 @@ def set_config(cmonkey_run, config):
 
     cmonkey_run['stats_freq'] = config.getint('General', 'stats_frequency')
     cmonkey_run['result_freq'] = config.getint('General', 'result_frequency')
+    cmonkey_run['result_store'] = config.get('General', 'result_store')
 
     # parse the scalings
     set_scaling('Motifs', 'motif_')
     set_scaling('Rows', 'row_')
     set_scaling('Networks', 'network_')
 
+    cmonkey_run['meme_cache'] = config.getboolean('MEME', 'cache')
+    cmonkey_run['meme_cache_size'] = config.getint('MEME', 'cache_size')
+    cmonkey_run['motif_scanner'] = config.get('MEME', 'scanner')
+    try:
+        cmonkey_run['motif_max_jobs'] = config.getint('MEME', 'max_jobs')
+    except:
+        cmonkey_run['motif_max_jobs'] = None
+    cmonkey_run['motif_job_timeout'] = config.getint('MEME', 'job_timeout')
+    cmonkey_run['motif_job_retries'] = config.getint('MEME', 'job_retries')
+
     try:
         cmonkey_run['nmotifs_rvec'] = config.get('MEME', 'nmotifs_rvec')
     except:
@@ -0,0 +1,137 @@
+# vi: sw=4 ts=4 et:
+"""checkpoint.py - versioned binary checkpoints of a cMonkey run
+
+A checkpoint is a single uncompressed NumPy .npz file. The memberships
+and the cached score matrices are stored as arrays, the configuration
+and the motif results as one JSON document in the entry '__json__'.
+A score matrix <key> is stored in the arrays <key>.values,
+<key>.row_names and <key>.column_names.
+
+The file is written to a temporary file that is renamed when it is
+complete, so a run that is interrupted while it writes a checkpoint
+leaves the previous checkpoints intact.
+
+This file is part of cMonkey Python. Please see README and LICENSE for
+more information and licensing details.
+"""
+import json
+import zipfile
+import numpy as np
+import datamatrix as dm
+import resultstore
+
+
+CHECKPOINT_VERSION = 1
+JSON_KEY = '__json__'
+
+
+def to_json(obj):
+    """converts the NumPy values that the json module can not encode"""
+    if isinstance(obj, (np.ndarray, np.generic)):
+        return obj.tolist()
+    raise TypeError("%s is not JSON serializable" % repr(obj))
+
+
+def int_keys(adict):
+    """JSON object keys are strings, this restores integer keys"""
+    return {int(key): value for key, value in adict.items()}
+
+
+def json_values(adict):
+    """returns the entries of adict whose values are unchanged by encoding
+    and decoding them as JSON, e.g. functions and tuples are left out"""
+    result = {}
+    for key, value in adict.items():
+        try:
+            if json.loads(json.dumps(value)) == value:
+                result[key] = value
+        except (TypeError, ValueError):
+            pass
+    return result
+
+
+class Checkpoint:
+    """the data of a checkpoint, NumPy arrays and JSON values by key"""
+
+    def __init__(self, iteration, arrays=None, values=None):
+        """creates a checkpoint for the iteration"""
+        self.iteration = iteration
+        self.__arrays = arrays if arrays is not None else {}
+        self.__values = values if values is not None else {}
+
+    def __contains__(self, key):
+        return key in self.__values or key in self.__arrays
+
+    def put_array(self, key, array):
+        """stores a NumPy array"""
+        self.__arrays[key] = np.asarray(array)
+
+    def get_array(self, key):
+        """returns the array that was stored with the key"""
+        return self.__arrays[key]
+
+    def put_names(self, key, names):
+        """stores a list of names as a string array"""
+        self.__arrays[key] = resultstore.string_array(names)
+
+    def get_names(self, key):
+        """returns the list of names that was stored with the key"""
+        return self.__arrays[key].tolist()
+
+    def put_value(self, key, value):
+        """stores a value that can be encoded as JSON"""
+        self.__values[key] = value
+
+    def get_value(self, key, default=None):
+        """returns the value that was stored with the key"""
+        return self.__values.get(key, default)
+
+    def put_matrix(self, key, matrix):
+        """stores a DataMatrix"""
+        self.put_array(key + '.values', matrix.values)
+        self.put_names(key + '.row_names', matrix.row_names)
+        self.put_names(key + '.column_names', matrix.column_names)
+
+    def get_matrix(self, key):
+        """returns the DataMatrix that was stored with the key or None"""
+        if key + '.values' not in self.__arrays:
+            return None
+        values = self.__arrays[key + '.values']
+        return dm.DataMatrix(values.shape[0], values.shape[1],
+                             self.get_names(key + '.row_names'),
+                             self.get_names(key + '.column_names'),
+                             values=values)
+
+    def save(self, path):
+        """writes the checkpoint to path"""
+        document = dict(self.__values)
+        document['version'] = CHECKPOINT_VERSION
+        document['iteration'] = self.iteration
+        arrays = dict(self.__arrays)
+        arrays[JSON_KEY] = np.array(json.dumps(document, default=to_json,
+                                               separators=(',', ':')))
+        resultstore.write_atomic(path,
+                                 lambda outfile: np.savez(outfile, **arrays))
+
+
+def load(path):
+    """reads the checkpoint at path"""
+    with open(path, 'rb') as infile:
+        try:
+            npz = np.load(infile)
+            arrays = {key: npz[key] for key in npz.files}
+        except (IOError, OSError, ValueError, AttributeError,
+                zipfile.BadZipfile):
+            raise Exception("'%s' is not a checkpoint file" % path)
+    if JSON_KEY not in arrays:
+        raise Exception("'%s' is not a checkpoint file" % path)
+
+    values = json.loads(arrays.pop(JSON_KEY).tolist())
+    version = values.pop('version', None)
+    if version != CHECKPOINT_VERSION:
+        raise Exception("checkpoint '%s' has version %s, expected %d" %
+                        (path, str(version), CHECKPOINT_VERSION))
+    return Checkpoint(values.pop('iteration'), arrays, values)
+
+
+__all__ = ['Checkpoint', 'load']
@@ -13,14 +13,18 @@ import scoring
 import network as nw
 import stringdb
 import debug
+import resultdb
+import resultstore
+import checkpoint as ckpt
+import workerpool
 import os
+import shutil
 from datetime import date, datetime
 import json
 import numpy as np
 import gc
 import sizes
 import gzip
-import sqlite3
 from decimal import Decimal
 import cPickle
 import bz2
@@ -38,6 +42,45 @@ STRING_URL_PATTERN = "http://networks.systemsbiology.net/string9/%s.gz"
 LOG_FORMAT = '%(asctime)s %(levelname)-8s %(message)s'
 
 
+class ClusterStats:
+    """the member indexes and residuals of the clusters in an iteration,
+    the lists are indexed by cluster - 1. Members that are not in the
+    ratio matrix have the index -1. Clusters with less than 2 rows or
+    columns have the residual 1.0, clusters without values NaN"""
+
+    def __init__(self, iteration, ratio_matrix, membership, num_clusters):
+        """computes the residuals of all clusters in one call"""
+        start_time = util.current_millis()
+        self.iteration = iteration
+        self.row_indexes = []
+        self.column_indexes = []
+        row_masks = np.zeros((num_clusters, ratio_matrix.num_rows), dtype=bool)
+        column_masks = np.zeros((num_clusters, ratio_matrix.num_columns),
+                                dtype=bool)
+        for cluster in range(1, num_clusters + 1):
+            row_indexes = ratio_matrix.row_indexes_for(
+                membership.rows_for_cluster(cluster))
+            column_indexes = ratio_matrix.column_indexes_for(
+                membership.columns_for_cluster(cluster))
+            self.row_indexes.append(row_indexes)
+            self.column_indexes.append(column_indexes)
+            row_masks[cluster - 1, [index for index in row_indexes
+                                    if index >= 0]] = True
+            column_masks[cluster - 1, [index for index in column_indexes
+                                       if index >= 0]] = True
+
+        small = np.array([len(self.row_indexes[i]) <= 1 or
+                          len(self.column_indexes[i]) <= 1
+                          for i in xrange(num_clusters)], dtype=bool)
+        residuals = np.ones(num_clusters)
+        if not small.all():
+            residuals[~small] = ratio_matrix.residuals(row_masks[~small],
+                                                       column_masks[~small])
+        self.residuals = residuals.tolist()
+        logging.info("computed cluster statistics in %f s.",
+                     (util.current_millis() - start_time) / 1000.0)
+
+
 class CMonkeyRun:
     def __init__(self, organism_code, ratio_matrix,
                  string_file=None,
@@ -54,6 +97,11 @@ class CMonkeyRun:
                             filename=log_filename)
         self.__membership = None
         self.__organism = None
+        self.__result_writer = None
+        self.__result_store = None
+        self.__cluster_stats = None
+        # the iteration of the checkpoint the run was continued from
+        self.__checkpoint_iteration = None
         self.config_params = {}
         self.ratio_matrix = ratio_matrix
 
@@ -75,6 +123,10 @@ class CMonkeyRun:
         self['use_operons'] = True
         self['use_string'] = True
         self['global_background'] = True
+        self['meme_cache'] = False
+        self['meme_cache_size'] = 1024
+        self['motif_scanner'] = 'mast'
+        self['result_store'] = 'sqlite'
         self['ncbi_code'] = ncbi_code
         self['remap_network_nodes'] = remap_network_nodes
         logging.info("# CLUSTERS: %d", self['num_clusters'])
@@ -108,14 +160,44 @@ class CMonkeyRun:
             with open(USER_DEFAULT_PIPELINE_PATH) as infile:
                 self['pipeline'] = json.load(infile)
 
-    def __dbconn(self, isolation_level='DEFERRED'):
-        """returns an autocommit database connection"""
-        conn = sqlite3.connect(self['out_database'])
-        conn.isolation_level = isolation_level
-        return conn
+    def result_writer(self):
+        """returns the writer for the output database, it holds the
+        database connection of the run"""
+        if self.__result_writer is None:
+            self.__result_writer = resultdb.ResultWriter(self['out_database'])
+        return self.__result_writer
+
+    def result_store(self):
+        """returns the writer for the columnar result store, its files are
+        written in the thread of the result writer"""
+        if self.__result_store is None:
+            self.__result_store = resultstore.ColumnarResultWriter(
+                os.path.join(self['output_dir'], resultstore.STORE_DIR),
+                self.ratio_matrix.row_names, self.ratio_matrix.column_names,
+                submit=self.result_writer().submit)
+        return self.__result_store
+
+    def __close_result_writer(self):
+        """writes the pending results and closes the database connection"""
+        self.__result_store = None
+        if self.__result_writer is not None:
+            self.__result_writer.close()
+            self.__result_writer = None
+
+    def write_debug_iteration(self, iteration, filename, meme_outs=None):
+        """write complete result of the iteration into a cmresults.tsv,
+        meme_outs are the MEME outputs, by default they are read now"""
+        if meme_outs is None:
+            meme_outs = debug.read_meme_outs(self['output_dir'],
+                                             self['num_clusters'])
+        path = os.path.join(self['output_dir'], filename)
+        with bz2.BZ2File(path, 'w') as outfile:
+            debug.write_iteration(self.result_writer().connection(), outfile,
+                                  iteration, self['num_clusters'],
+                                  self['output_dir'], meme_outs)
 
     def __create_output_database(self):
-        conn = self.__dbconn()
+        conn = self.result_writer().connection()
         # these are the tables for storing cmonkey run information.
         # run information
         conn.execute('''create table run_infos (start_time timestamp,
@@ -177,17 +259,13 @@ class CMonkeyRun:
         logging.info("created output database schema")
 
         # all cluster members are stored relative to the base ratio matrix
-        with conn:
-            for index in xrange(len(self.ratio_matrix.row_names)):
-                conn.execute('''insert into row_names (order_num, name) values
-                                (?,?)''',
-                             (index, self.ratio_matrix.row_names[index]))
-            for index in xrange(len(self.ratio_matrix.column_names)):
-                conn.execute('''insert into column_names (order_num, name) values
-                                (?,?)''',
-                             (index, self.ratio_matrix.column_names[index]))
+        writer = self.result_writer()
+        writer.insert_many('row_names', ['order_num', 'name'],
+                           enumerate(self.ratio_matrix.row_names))
+        writer.insert_many('column_names', ['order_num', 'name'],
+                           enumerate(self.ratio_matrix.column_names))
+        writer.flush()
         logging.info("added row and column names to output database")
-        conn.close()
 
     def report_params(self):
         logging.info('cmonkey_run config_params:')
@@ -233,16 +311,28 @@ class CMonkeyRun:
         if self['domotifs']:
             background_file = None
             if self['global_background']:
+                seqtype = self['sequence_types'][0]
                 background_file = meme.global_background_file(
-                    self.organism(), self.ratio_matrix.row_names,
-                    self['sequence_types'][0])
+                    self.organism(), self.ratio_matrix.row_names, seqtype,
+                    cache_dir=self['cache_dir'])
+
+            result_cache = None
+            if self['meme_cache']:
+                result_cache = meme.MemeResultCache(
+                    os.path.join(self['cache_dir'], 'meme-results'),
+                    self['meme_cache_size'] * 1024 * 1024,
+                    self['meme_version'])
 
             if self['meme_version'] == '4.3.0':
-                meme_suite = meme.MemeSuite430(background_file=background_file)
+                meme_suite = meme.MemeSuite430(background_file=background_file,
+                                               result_cache=result_cache,
+                                               scanner=self['motif_scanner'])
             elif (self['meme_version'] and
                   (self['meme_version'].startswith('4.8') or
                    self['meme_version'].startswith('4.9'))):
-                meme_suite = meme.MemeSuite481(background_file=background_file)
+                meme_suite = meme.MemeSuite481(background_file=background_file,
+                                               result_cache=result_cache,
+                                               scanner=self['motif_scanner'])
             else:
                 logging.error("MEME version %s currently not supported !", self['meme_version'])
                 raise Exception("unsupported MEME version")
@@ -289,15 +379,9 @@ class CMonkeyRun:
 
             # debug: write seed into an analytical file for iteration 0
             if self['debug']:
-                conn = self.__dbconn()
-                with conn:
-                    self.write_memberships(conn, 0)
-                # write complete result into a cmresults.tsv
-                path =  os.path.join(self['output_dir'], 'cmresults-0000.tsv.bz2')
-                with bz2.BZ2File(path, 'w') as outfile:
-                    debug.write_iteration(conn, outfile, 0,
-                                          self['num_clusters'], self['output_dir'])
-                conn.close()
+                self.write_results({'iteration': 0})
+                self.result_writer().flush()
+                self.write_debug_iteration(0, 'cmresults-0000.tsv.bz2')
 
         return self.__membership
 
@@ -307,6 +391,9 @@ class CMonkeyRun:
             self.__organism = org.DummyOrganism()
         elif self.__organism is None:
             self.__organism = self.make_microbe()
+            if self['domotifs']:
+                self.__organism.precompute_sequences(self.ratio_matrix.row_names,
+                                                     self['sequence_types'])
         return self.__organism
 
     def make_microbe(self):
@@ -331,7 +418,8 @@ class CMonkeyRun:
             if not self['rsat_organism']:
                 raise Exception('override RSAT loading: please specify --rsat_organism')
             logging.info("using RSAT files for '%s'", self['rsat_organism'])
-            rsatdb = rsat.RsatFiles(self['rsat_dir'], self['rsat_organism'], self['ncbi_code'])
+            rsatdb = rsat.RsatFiles(self['rsat_dir'], self['rsat_organism'], self['ncbi_code'],
+                                    cache_dir=self['cache_dir'])
         else:
             rsatdb = rsat.RsatDatabase(rsat.RSAT_BASE_URL, self['cache_dir'])
 
@@ -368,7 +456,8 @@ class CMonkeyRun:
 
             # create and add network
             nw_factories.append(stringdb.get_network_factory2(
-                self['organism_code'], stringfile, 0.5))
+                self['organism_code'], stringfile, 0.5,
+                cache_dir=self['cache_dir']))
 
         # do we use operons ?
         if self['donetworks'] and self['use_operons']:
@@ -382,7 +471,8 @@ class CMonkeyRun:
                                          org.make_go_taxonomy_mapper(gofile),
                                          mo_db,
                                          nw_factories,
-                                         self['ncbi_code'])
+                                         self['ncbi_code'],
+                                         cache_dir=self['cache_dir'])
         return org_factory.create(self['organism_code'],
                                   self['search_distances'],
                                   self['scan_distances'],
@@ -405,7 +495,11 @@ class CMonkeyRun:
         if os.path.exists(output_dir):
             outfiles = os.listdir(output_dir)
             for filename in outfiles:
-                os.remove('/'.join([output_dir, filename]))
+                path = '/'.join([output_dir, filename])
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
 
     def __check_parameters(self):
         """ensure that we all required parameters before we start running"""
@@ -436,111 +530,120 @@ class CMonkeyRun:
         if not os.path.exists(output_dir + '/ratios.tsv'):
             self.ratio_matrix.write_tsv_file(output_dir + '/ratios.tsv')
 
-        # gene index map is used for writing statistics
+        self.__init_gene_indexes()
+        row_scoring = self.make_row_scoring()
+        col_scoring = self.make_column_scoring()
+        return row_scoring, col_scoring
+
+    def __init_gene_indexes(self):
+        """gene index map is used for writing statistics"""
         thesaurus = self.organism().thesaurus()
         genes = [thesaurus[row_name] if row_name in thesaurus else row_name
                  for row_name in self.ratio_matrix.row_names]
         self.gene_indexes = {genes[index]: index
                              for index in xrange(len(genes))}
 
-        row_scoring = self.make_row_scoring()
-        col_scoring = self.make_column_scoring()
-        return row_scoring, col_scoring
-
     def run(self):
         row_scoring, col_scoring = self.prepare_run()
         self.run_iterations(row_scoring, col_scoring)
 
     def run_from_checkpoint(self, checkpoint_filename):
-        row_scoring = self.make_row_scoring()
-        col_scoring = self.make_column_scoring()
-        self.__make_dirs_if_needed()
-        self.init_from_checkpoint(checkpoint_filename, row_scoring,
-                                  col_scoring)
+        """continues a run with the iteration after the checkpoint"""
+        row_scoring, col_scoring = self.init_from_checkpoint(checkpoint_filename)
         self.run_iterations(row_scoring, col_scoring)
 
-    def residual_for(self, row_names, column_names):
-        if len(column_names) <= 1 or len(row_names) <= 1:
-            return 1.0
-        else:
-            matrix = self.ratio_matrix.submatrix_by_name(row_names,
-                                                         column_names)
-            return matrix.residual()
-
-    def write_memberships(self, conn, iteration):
+    def cluster_stats(self, iteration):
+        """returns the members and residuals of the clusters in the iteration.
+        They are computed once for each iteration and shared by the result
+        and statistics writers"""
+        if (self.__cluster_stats is None or
+            self.__cluster_stats.iteration != iteration):
+            self.__cluster_stats = ClusterStats(iteration, self.ratio_matrix,
+                                                self.membership(),
+                                                self['num_clusters'])
+        return self.__cluster_stats
+
+    def write_memberships(self, iteration):
+        writer = self.result_writer()
+        stats = self.cluster_stats(iteration)
         for cluster in range(1, self['num_clusters'] + 1):
-            column_names = self.membership().columns_for_cluster(cluster)
-            for order_num in self.ratio_matrix.column_indexes_for(column_names):
-                conn.execute('''insert into column_members (iteration,cluster,order_num)
-                                values (?,?,?)''', (iteration, cluster, order_num))
-
-            row_names = self.membership().rows_for_cluster(cluster)
-            for order_num in self.ratio_matrix.row_indexes_for(row_names):
-                conn.execute('''insert into row_members (iteration,cluster,order_num)
-                                values (?,?,?)''', (iteration, cluster, order_num))
-            try:
-                residual = self.residual_for(row_names, column_names)
-                conn.execute('''insert into cluster_residuals (iteration,cluster,residual)
-                           values (?,?,?)''', (iteration, cluster, residual))
-            except:
-                # apparently computing the mean residual led to a numpy masked
-                # value. We set it to 1.0 to avoid crashing out
-                conn.execute('''insert into cluster_residuals (iteration,cluster,residual)
-                           values (?,?,?)''', (iteration, cluster, 1.0))
+            writer.insert_many('column_members', ['iteration', 'cluster', 'order_num'],
+                               [(iteration, cluster, order_num) for order_num
+                                in stats.column_indexes[cluster - 1]])
+            writer.insert_many('row_members', ['iteration', 'cluster', 'order_num'],
+                               [(iteration, cluster, order_num) for order_num
+                                in stats.row_indexes[cluster - 1]])
+            # the residual of a cluster without values is NaN, which can not
+            # be stored. We set it to 1.0 to avoid crashing out
+            residual = resultdb.number_or_default(stats.residuals[cluster - 1], 1.0)
+            writer.insert('cluster_residuals', ['iteration', 'cluster', 'residual'],
+                          (iteration, cluster, residual))
+
+    def write_columnar_results(self, iteration_result):
+        """write iteration results to the columnar result store"""
+        stats = self.cluster_stats(iteration_result['iteration'])
+        residuals = [resultdb.number_or_default(residual, 1.0)
+                     for residual in stats.residuals]
+        self.result_store().write_iteration(iteration_result['iteration'],
+                                            stats.row_indexes, stats.column_indexes,
+                                            residuals,
+                                            iteration_result.get('motifs'),
+                                            self.gene_indexes)
 
     def write_results(self, iteration_result):
         """write iteration results to database"""
+        if self['result_store'] == 'columnar':
+            self.write_columnar_results(iteration_result)
+            return
+
         iteration = iteration_result['iteration']
-        conn = self.__dbconn()
-        with conn:
-            self.write_memberships(conn, iteration)
+        writer = self.result_writer()
+        self.write_memberships(iteration)
 
         if 'motifs' in iteration_result:
             motifs = iteration_result['motifs']
-            with conn:
-                for seqtype in motifs:
-                    for cluster in motifs[seqtype]:
-                        motif_infos = motifs[seqtype][cluster]['motif-info']
-                        for motif_info in motif_infos:
-                            c = conn.cursor()
-                            c.execute('''insert into motif_infos (iteration,cluster,seqtype,motif_num,evalue)
-                                        values (?,?,?,?,?)''',
-                                      (iteration, cluster, seqtype, motif_info['motif_num'],
-                                       motif_info['evalue']))
-                            motif_info_id = c.lastrowid
-                            c.close()
-                            pssm_rows = motif_info['pssm']
-                            for row in xrange(len(pssm_rows)):
-                                pssm_row = pssm_rows[row]
-                                conn.execute('''insert into motif_pssm_rows (motif_info_id,iteration,row,a,c,g,t)
-                                                values (?,?,?,?,?,?,?)''',
-                                             (motif_info_id, iteration, row, pssm_row[0], pssm_row[1],
-                                              pssm_row[2], pssm_row[3]))
-                            annotations = motif_info['annotations']
-                            for annotation in annotations:
-                                gene_num = self.gene_indexes[annotation['gene']]
-                                conn.execute('''insert into motif_annotations (motif_info_id,
-                                                iteration,gene_num,
-                                                position,reverse,pvalue) values (?,?,?,?,?,?)''',
-                                             (motif_info_id, iteration, gene_num,
-                                              annotation['position'],
-                                              annotation['reverse'], annotation['pvalue']))
-
-                            sites = motif_info['sites']
-                            for seqname, strand, start, pval, flank_left, seq, flank_right in sites:
-                                conn.execute('''insert into meme_motif_sites (motif_info_id, seq_name, reverse, start, pvalue, flank_left, seq, flank_right)
-                                                values (?,?,?,?,?,?,?,?)''',
-                                             (motif_info_id, seqname, strand == '-',
-                                              start, pval, flank_left, seq,
-                                              flank_right))
-
-                        pvalues = motifs[seqtype][cluster]['pvalues']
-                        for gene in pvalues:
-                            gene_num = self.gene_indexes[gene]
-                            conn.execute('''insert into motif_pvalues (iteration,cluster,gene_num,pvalue)
-                                            values (?,?,?,?)''',
-                                        (iteration, cluster, gene_num, pvalues[gene]))
-            conn.close()
+            for seqtype in motifs:
+                for cluster in motifs[seqtype]:
+                    motif_infos = motifs[seqtype][cluster]['motif-info']
+                    for motif_info in motif_infos:
+                        motif_info_id = writer.next_id('motif_infos')
+                        writer.insert('motif_infos', ['rowid', 'iteration', 'cluster',
+                                                      'seqtype', 'motif_num', 'evalue'],
+                                      (motif_info_id, iteration, cluster, seqtype,
+                                       motif_info['motif_num'], motif_info['evalue']))
+                        pssm_rows = motif_info['pssm']
+                        writer.insert_many('motif_pssm_rows',
+                                           ['motif_info_id', 'iteration', 'row',
+                                            'a', 'c', 'g', 't'],
+                                           [(motif_info_id, iteration, row,
+                                             pssm_row[0], pssm_row[1],
+                                             pssm_row[2], pssm_row[3])
+                                            for row, pssm_row in enumerate(pssm_rows)])
+                        annotations = motif_info['annotations']
+                        writer.insert_many('motif_annotations',
+                                           ['motif_info_id', 'iteration', 'gene_num',
+                                            'position', 'reverse', 'pvalue'],
+                                           [(motif_info_id, iteration,
+                                             self.gene_indexes[annotation['gene']],
+                                             annotation['position'],
+                                             annotation['reverse'], annotation['pvalue'])
+                                            for annotation in annotations])
+
+                        sites = motif_info['sites']
+                        writer.insert_many('meme_motif_sites',
+                                           ['motif_info_id', 'seq_name', 'reverse',
+                                            'start', 'pvalue', 'flank_left', 'seq',
+                                            'flank_right'],
+                                           [(motif_info_id, seqname, strand == '-',
+                                             start, pval, flank_left, seq, flank_right)
+                                            for seqname, strand, start, pval, flank_left,
+                                            seq, flank_right in sites])
+
+                    pvalues = motifs[seqtype][cluster]['pvalues']
+                    writer.insert_many('motif_pvalues',
+                                       ['iteration', 'cluster', 'gene_num', 'pvalue'],
+                                       [(iteration, cluster, self.gene_indexes[gene],
+                                         pvalues[gene]) for gene in pvalues])
 
     def write_stats(self, iteration_result):
         # write stats for this iteration
@@ -550,70 +653,50 @@ class CMonkeyRun:
         motif_pvalues = iteration_result['motif-pvalue'] if 'motif-pvalue' in iteration_result else {}
         fuzzy_coeff = iteration_result['fuzzy-coeff'] if 'fuzzy-coeff' in iteration_result else 0.0
 
-        residuals = []
-        conn = self.__dbconn()
-        with conn:
-            for cluster in range(1, self['num_clusters'] + 1):
-                row_names = self.membership().rows_for_cluster(cluster)
-                column_names = self.membership().columns_for_cluster(cluster)
-                residual = self.residual_for(row_names, column_names)
-                residuals.append(residual)
-                try:
-                    conn.execute('''insert into cluster_stats (iteration, cluster, num_rows,
-                                    num_cols, residual) values (?,?,?,?,?)''',
-                                 (iteration, cluster, len(row_names), len(column_names),
-                                  residual))
-                except:
-                    # residual is messed up, insert with 1.0
-                    logging.warn('STATS: residual was messed up, insert with 1.0')
-                    conn.execute('''insert into cluster_stats (iteration, cluster, num_rows,
-                                    num_cols, residual) values (?,?,?,?,?)''',
-                                 (iteration, cluster, len(row_names), len(column_names),
-                                  1.0))
-
-            median_residual = np.median(residuals)
-            try:
-                conn.execute('''insert into iteration_stats (iteration, median_residual,
-                                fuzzy_coeff) values (?,?,?)''',
-                             (iteration, median_residual, fuzzy_coeff))
-            except:
-                logging.warn('STATS: median was messed up, insert with 1.0')
-                conn.execute('''insert into iteration_stats (iteration, median_residual,
-                                fuzzy_coeff) values (?,?,?)''',
-                             (iteration, 1.0, fuzzy_coeff))
-
-        with conn:
-            for network, score in network_scores.items():
-                conn.execute('''insert into network_stats (iteration, network, score)
-                                values (?,?,?)''', (iteration, network, score))
-
-        with conn:
-            for seqtype, pval in motif_pvalues.items():
-                conn.execute('''insert into motif_stats (iteration, seqtype, pval)
-                                values (?,?,?)''', (iteration, seqtype, pval))
-        conn.close()
+        writer = self.result_writer()
+        stats = self.cluster_stats(iteration)
+        for cluster in range(1, self['num_clusters'] + 1):
+            residual = stats.residuals[cluster - 1]
+            if resultdb.number_or_default(residual, None) is None:
+                # residual is messed up, insert with 1.0
+                logging.warn('STATS: residual was messed up, insert with 1.0')
+                residual = 1.0
+            writer.insert('cluster_stats', ['iteration', 'cluster', 'num_rows',
+                                            'num_cols', 'residual'],
+                          (iteration, cluster, len(stats.row_indexes[cluster - 1]),
+                           len(stats.column_indexes[cluster - 1]), residual))
+
+        median_residual = util.median(stats.residuals)
+        if resultdb.number_or_default(median_residual, None) is None:
+            logging.warn('STATS: median was messed up, insert with 1.0')
+            median_residual = 1.0
+        writer.insert('iteration_stats', ['iteration', 'median_residual', 'fuzzy_coeff'],
+                      (iteration, median_residual, fuzzy_coeff))
+        writer.insert_many('network_stats', ['iteration', 'network', 'score'],
+                           [(iteration, network, score)
+                            for network, score in network_scores.items()])
+        writer.insert_many('motif_stats', ['iteration', 'seqtype', 'pval'],
+                           [(iteration, seqtype, pval)
+                            for seqtype, pval in motif_pvalues.items()])
 
     def write_start_info(self):
-        conn = self.__dbconn()
-        with conn:
-            conn.execute('''insert into run_infos (start_time, num_iterations, organism,
-                            species, num_rows, num_columns, num_clusters) values (?,?,?,?,?,?,?)''',
-                         (datetime.now(), self['num_iterations'], self.organism().code,
-                          self.organism().species(), self.ratio_matrix.num_rows,
-                          self.ratio_matrix.num_columns, self['num_clusters']))
-        conn.close()
+        writer = self.result_writer()
+        writer.insert('run_infos', ['start_time', 'num_iterations', 'organism',
+                                    'species', 'num_rows', 'num_columns',
+                                    'num_clusters'],
+                      (datetime.now(), self['num_iterations'], self.organism().code,
+                       self.organism().species(), self.ratio_matrix.num_rows,
+                       self.ratio_matrix.num_columns, self['num_clusters']))
+        writer.flush()
 
     def update_iteration(self, iteration):
-        conn = self.__dbconn()
-        with conn:
-            conn.execute('''update run_infos set last_iteration = ?''', (iteration,))
-        conn.close()
+        self.result_writer().add('''update run_infos set last_iteration = ?''',
+                                 (iteration,))
 
     def write_finish_info(self):
-        conn = self.__dbconn()
-        with conn:
-            conn.execute('''update run_infos set finish_time = ?''', (datetime.now(),))
-        conn.close()
+        writer = self.result_writer()
+        writer.add('''update run_infos set finish_time = ?''', (datetime.now(),))
+        writer.flush()
 
     def combined_rscores_pickle_path(self):
         return "%s/combined_rscores_last.pkl" % self.config_params['output_dir']
@@ -631,8 +714,6 @@ class CMonkeyRun:
         self.membership().update(self.ratio_matrix, rscores, cscores,
                                  self['num_iterations'], iteration_result)
 
-        if (iteration > 0 and self['checkpoint_interval'] and iteration % self['checkpoint_interval'] == 0):
-            self.save_checkpoint_data(iteration, row_scoring, col_scoring)
         mean_net_score = 0.0
         mean_mot_pvalue = 0.0
         if 'networks' in iteration_result.keys():
@@ -654,18 +735,48 @@ class CMonkeyRun:
             self.write_stats(iteration_result)
             self.update_iteration(iteration)
 
+        # all results of the iteration are written in one transaction,
+        # the writer thread does this while the next iteration is scored
+        writer = self.result_writer()
+        writer.flush_async()
+
         if self['debug']:
-            # write complete result into a cmresults.tsv
-            conn = self.__dbconn()
-            path =  os.path.join(self['output_dir'], 'cmresults-%04d.tsv.bz2' % iteration)
-            with bz2.BZ2File(path, 'w') as outfile:
-                debug.write_iteration(conn, outfile, iteration,
-                                      self['num_clusters'], self['output_dir'])
-            conn.close()
+            filename = 'cmresults-%04d.tsv.bz2' % iteration
+            # the MEME outputs are read now, the next iteration's MEME runs
+            # write theirs while the writer thread writes this dump
+            meme_outs = debug.read_meme_outs(self['output_dir'],
+                                             self['num_clusters'])
+            writer.submit(lambda: self.write_debug_iteration(iteration, filename,
+                                                             meme_outs))
+
+        # the checkpoint is saved after the results of the iteration, so
+        # a continued run does not miss any
+        if (iteration > 0 and self['checkpoint_interval'] and iteration % self['checkpoint_interval'] == 0):
+            self.save_checkpoint_data(iteration, row_scoring, col_scoring)
 
     def run_iterations(self, row_scoring, col_scoring):
+        """runs the iterations, the worker processes for parallel
+        computations live for the duration of this call"""
+        pool = None
+        if self['multiprocessing']:
+            pool = workerpool.WorkerPool()
+        row_scoring.set_pool(pool)
+        col_scoring.set_pool(pool)
+        try:
+            self.__run_iterations(row_scoring, col_scoring)
+        finally:
+            row_scoring.set_pool(None)
+            col_scoring.set_pool(None)
+            row_scoring.cleanup()
+            col_scoring.cleanup()
+            if pool is not None:
+                pool.close()
+            self.__close_result_writer()
+
+    def __run_iterations(self, row_scoring, col_scoring):
         self.report_params()
-        self.write_start_info()
+        if self.__checkpoint_iteration is None:
+            self.write_start_info()
         for iteration in range(self['start_iteration'],
                                self['num_iterations'] + 1):
             start_time = util.current_millis()
@@ -697,16 +808,11 @@ class CMonkeyRun:
             self.write_results(iteration_result)
             self.write_stats(iteration_result)
             self.update_iteration(iteration)
+            self.result_writer().flush()
 
             if self['debug']:
-                # write complete result into a cmresults.tsv
-                conn = self.__dbconn()
-                path =  os.path.join(self['output_dir'], 'cmresults-postproc.tsv.bz2')
-                with bz2.BZ2File(path, 'w') as outfile:
-                    debug.write_iteration(conn, outfile,
-                                          self['num_iterations'] + 1,
-                                          self['num_clusters'], self['output_dir'])
-                conn.close()
+                self.write_debug_iteration(self['num_iterations'] + 1,
+                                           'cmresults-postproc.tsv.bz2')
 
 
         self.write_finish_info()
@@ -716,26 +822,69 @@ class CMonkeyRun:
     ###### CHECKPOINTING
     ##############################
 
+    def checkpoint_path(self, iteration):
+        """returns the path of the checkpoint file for the iteration"""
+        return "%s.%04d" % (self.__checkpoint_basename, iteration)
+
     def save_checkpoint_data(self, iteration, row_scoring, col_scoring):
         """save checkpoint data for the specified iteration"""
-        with util.open_shelf("%s.%04d" % (self.__checkpoint_basename,
-                                          iteration)) as shelf:
-            shelf['config'] = self.config_params
-            shelf['iteration'] = iteration
-            self.membership().store_checkpoint_data(shelf)
-            row_scoring.store_checkpoint_data(shelf)
-            col_scoring.store_checkpoint_data(shelf)
-
-    def init_from_checkpoint(self, checkpoint_filename, row_scoring, col_scoring):
-        """initialize this object from a checkpoint file"""
+        start_time = util.current_millis()
+        # the results written so far are complete with the checkpoint
+        self.result_writer().wait()
+        checkpoint = ckpt.Checkpoint(iteration)
+        # the parameters that are not stored, e.g. the schedules, are
+        # set up again when the run is continued
+        checkpoint.put_value('config', ckpt.json_values(self.config_params))
+        self.membership().store_checkpoint_data(checkpoint)
+        row_scoring.store_checkpoint_data(checkpoint)
+        col_scoring.store_checkpoint_data(checkpoint)
+        checkpoint.save(self.checkpoint_path(iteration))
+        logging.info("saved checkpoint for iteration %d in %f s.", iteration,
+                     (util.current_millis() - start_time) / 1000.0)
+
+    def init_from_checkpoint(self, checkpoint_filename):
+        """initialize this object from a checkpoint file, returns the row
+        and column scoring functions with their state restored"""
         logging.info("Continue run using checkpoint file '%s'",
                      checkpoint_filename)
-        with util.open_shelf(checkpoint_filename) as shelf:
-            self.config_params = shelf['config']
-            self['start_iteration'] = shelf['iteration'] + 1
-            self.__membership = memb.ClusterMembership.restore_from_checkpoint(
-                self.config_params, shelf)
-            row_scoring.restore_checkpoint_data(shelf)
-            col_scoring.restore_checkpoint_data(shelf)
-            #return row_scoring, col_scoring necessary??
+        start_time = util.current_millis()
+        checkpoint = ckpt.load(checkpoint_filename)
+        for key, value in checkpoint.get_value('config', {}).items():
+            if key not in self.config_params or self[key] != value:
+                self[key] = value
+        self['start_iteration'] = checkpoint.iteration + 1
+        self.__checkpoint_iteration = checkpoint.iteration
+
+        self.__make_dirs_if_needed()
+        self.__remove_results_after(checkpoint.iteration)
+        self.__init_gene_indexes()
+        self.__membership = memb.OrigMembership.restore_from_checkpoint(
+            checkpoint, self.ratio_matrix, self.config_params)
+        row_scoring = self.make_row_scoring()
+        col_scoring = self.make_column_scoring()
+        row_scoring.restore_checkpoint_data(checkpoint)
+        col_scoring.restore_checkpoint_data(checkpoint)
+        logging.info("restored checkpoint of iteration %d in %f s.",
+                     checkpoint.iteration,
+                     (util.current_millis() - start_time) / 1000.0)
+        return row_scoring, col_scoring
+
+    def __remove_results_after(self, iteration):
+        """removes the results of the iterations after the checkpoint from
+        the output database and the columnar store, they are computed again"""
+        writer = self.result_writer()
+        if os.path.exists(os.path.join(self['output_dir'], resultstore.STORE_DIR)):
+            self.result_store().remove_after(iteration)
+        writer.add('''delete from meme_motif_sites where motif_info_id in
+                      (select rowid from motif_infos where iteration > ?)''',
+                   (iteration,))
+        for table in ['iteration_stats', 'cluster_stats', 'network_stats',
+                      'motif_stats', 'row_members', 'column_members',
+                      'cluster_residuals', 'motif_infos', 'motif_pssm_rows',
+                      'motif_annotations', 'motif_pvalues']:
+            writer.add('delete from %s where iteration > ?' % table,
+                       (iteration,))
+        writer.add('update run_infos set last_iteration = ? where last_iteration > ?',
+                   (iteration, iteration))
+        writer.flush()
 
@@ -10,7 +10,7 @@ import operator
 import util
 import logging
 import gzip
-import multiprocessing as mp
+import workerpool
 import os
 import random
 
@@ -128,22 +128,26 @@ class DataMatrix:
             row_names = self.row_names
             row_indexes = None
         else:
-            row_names = [name for name in sorted(row_names)
-                         if name in set(self.row_names)]
-            row_indexes = self.row_indexes_for(row_names)
+            row_indexes = self.sorted_indexes_for(row_names, self.row_indexes_for)
+            row_names = [self.row_names[index] for index in row_indexes]
 
         if column_names is None:
             column_names = self.column_names
             col_indexes = None
         else:
-            column_names = [name for name in sorted(column_names)
-                            if name in set(self.column_names)]
-            col_indexes = self.column_indexes_for(column_names)
+            col_indexes = self.sorted_indexes_for(column_names,
+                                                  self.column_indexes_for)
+            column_names = [self.column_names[index] for index in col_indexes]
 
         new_values = make_values(row_indexes, col_indexes)
         return DataMatrix(len(row_names), len(column_names), row_names,
                           column_names, values=new_values)
 
+    def sorted_indexes_for(self, names, indexes_for):
+        """returns the indexes of the names that are in the matrix, in the
+        order of the sorted names"""
+        return [index for index in indexes_for(sorted(names)) if index >= 0]
+
     def sorted_by_row_name(self):
         """returns a version of this table, sorted by row name"""
         row_names = self.row_names
@@ -201,11 +205,7 @@ class DataMatrix:
     def residual(self, max_row_variance=None):
         """computes the residual for this matrix, if max_row_variance is given,
         result is normalized by the row variance"""
-        d_rows = util.row_means(self.values)
-        d_cols = util.column_means(self.values)
-        d_all = util.mean(d_rows)
-        tmp = self.values + d_all - util.r_outer(d_rows, d_cols, operator.add)
-        average = util.mean(np.abs(tmp))
+        average = matrix_residual(self.values)
         if max_row_variance is not None:
             row_var = self.row_variance()
             if np.isnan(row_var) or row_var > max_row_variance:
@@ -213,6 +213,12 @@ class DataMatrix:
             average = average / row_var
         return average
 
+    def residuals(self, row_masks, column_masks, max_row_variance=None):
+        """computes the residuals of many submatrices at once, see
+        cluster_residuals()"""
+        return cluster_residuals(self.values, row_masks, column_masks,
+                                 max_row_variance)
+
     def fix_extreme_values(self, min_value=-20.0):
         """replaces values < -20 with the smallest value that is >= -20
         replaces all NA/Inf values with the maximum value in the matrix
@@ -260,6 +266,63 @@ class DataMatrix:
                 outfile.flush()
 
 
+def matrix_residual(values):
+    """computes the mean residual of a matrix of values"""
+    d_rows = util.row_means(values)
+    d_cols = util.column_means(values)
+    d_all = util.mean(d_rows)
+    tmp = values + d_all - util.r_outer(d_rows, d_cols, operator.add)
+    return util.mean(np.abs(tmp))
+
+
+def cluster_residuals(values, row_masks, column_masks, max_row_variance=None):
+    """computes the residuals of the submatrices of values that are selected
+    by the boolean row and column masks, which have a row for each cluster.
+    The results are the same as DataMatrix.residual() of the submatrices,
+    except that the residual of a submatrix without values is NaN"""
+    row_masks = np.asarray(row_masks, dtype=bool)
+    column_masks = np.asarray(column_masks, dtype=bool)
+    if row_masks.shape[0] != column_masks.shape[0]:
+        raise Exception("different numbers of row and column masks")
+    result = np.empty(row_masks.shape[0])
+    for cluster in xrange(row_masks.shape[0]):
+        submatrix = values[np.ix_(np.flatnonzero(row_masks[cluster]),
+                                  np.flatnonzero(column_masks[cluster]))]
+        result[cluster] = nan_residual(submatrix, max_row_variance)
+    return result
+
+
+def nan_residual(values, max_row_variance=None):
+    """computes the residual of a matrix like DataMatrix.residual(), with
+    NaN-aware reductions on the plain array. Returns NaN if the matrix
+    has no values"""
+    defined = ~np.isnan(values)
+    if not defined.any():
+        return np.nan
+    filled = np.where(defined, values, 0.0)
+    row_counts = defined.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d_rows = filled.sum(axis=1) / row_counts
+        d_cols = filled.sum(axis=0) / defined.sum(axis=0)
+    d_all = np.mean(d_rows[row_counts > 0])
+    tmp = values[defined] + d_all - (d_rows[:, np.newaxis] +
+                                     d_cols)[defined]
+    average = np.mean(np.abs(tmp))
+
+    if max_row_variance is not None:
+        # mean of the row variances, rows with less than 2 values are ignored
+        var_rows = row_counts > 1
+        row_var = np.nan
+        if var_rows.any():
+            sq_dev = np.where(defined, values - d_rows[:, np.newaxis], 0.0) ** 2
+            row_var = np.mean(sq_dev[var_rows].sum(axis=1) /
+                              (row_counts[var_rows] - 1))
+        if np.isnan(row_var) or row_var > max_row_variance:
+            row_var = max_row_variance
+        average = average / row_var
+    return average
+
+
 class DataMatrixFactory:
     """Reader class for creating a DataMatrix from a delimited file,
     applying all supplied filters. Currently, the assumption is
@@ -391,7 +454,7 @@ def center_scale_filter(matrix):
     return row_filter(matrix, center_scale)
 
 
-def quantile_normalize_scores(matrices, weights=None):
+def quantile_normalize_scores(matrices, weights=None, pool=None):
     """quantile normalize scores against each other"""
 
     logging.info("COMPUTING WEIGHTED MEANS...")
@@ -420,7 +483,7 @@ def quantile_normalize_scores(matrices, weights=None):
     logging.info("weighted means in %f s.", elapsed / 1000.0)
     start_time = util.current_millis()
 
-    result = qm_result_matrices(matrices, tmp_mean)
+    result = qm_result_matrices(matrices, tmp_mean, pool=pool)
 
     elapsed = util.current_millis() - start_time
     logging.info("result matrices built in %f s.", elapsed / 1000.0)
@@ -450,18 +513,15 @@ def rank_fun(mat_mean):
                       values=values)
 
 
-def qm_result_matrices(matrices, tmp_mean, multiprocessing=True):
+def qm_result_matrices(matrices, tmp_mean, multiprocessing=True, pool=None):
     """builds the resulting matrices by looking at the rank of their
     original values and retrieving the means at the specified position"""
     if multiprocessing:
         # parallelized ranking
-        pool = mp.Pool()
-        results = pool.map(rank_fun,
-                           [(matrix.values, matrix.row_names, matrix.column_names, tmp_mean)
-                            for matrix in matrices])
-        pool.close()
-        pool.join()
-        return results
+        return workerpool.pool_map(pool, rank_fun,
+                                   [(matrix.values, matrix.row_names,
+                                     matrix.column_names, tmp_mean)
+                                    for matrix in matrices])
     else:
         # non-parallelized
         result = []
@@ -1,5 +1,6 @@
 import re
 import os
+import resultstore
 
 
 ############################################################
@@ -32,15 +33,23 @@ def meme_to_str(outdir, iteration, cluster):
     return ''.join(lines)
 
 
-def write_iteration(conn, outfile, iteration, num_clusters, outdir):
-    """writes the iteration into a debug file"""
+def read_meme_outs(outdir, num_clusters):
+    """returns the list of the last MEME outputs of the clusters as
+    strings, call it before the next MEME run can write its outputs"""
+    last_meme_iteration = get_last_meme_iteration(outdir)
+    return [meme_to_str(outdir, last_meme_iteration, cluster)
+            for cluster in range(1, num_clusters + 1)]
+
+
+def write_iteration(conn, outfile, iteration, num_clusters, outdir,
+                    meme_outs):
+    """writes the iteration into a debug file, meme_outs are the MEME
+    outputs from read_meme_outs()"""
     outfile.write('"cols"\t"dens_string"\t"k"\t"meanp_meme"\t"meme_out"\t"resid"\t"rows"\n')
+    results = resultstore.open_results(conn, outdir)
     for cluster in range(1, num_clusters + 1):
-        cursor = conn.cursor()
-        cursor.execute('select name from column_members m join column_names c on m.order_num = c.order_num where m.cluster = ? and iteration = ?', [cluster, iteration])
-        colnames = [row[0] for row in cursor.fetchall()]
+        colnames = results.columns_for_cluster(iteration, cluster)
         cols_out = ",".join(colnames)
-        cursor.close()
 
         cursor = conn.cursor()
         cursor.execute('select score from network_stats where network = \'STRING\' and iteration = ?',
@@ -55,21 +64,14 @@ def write_iteration(conn, outfile, iteration, num_clusters, outdir):
         row = cursor.fetchone()
         meme_pval = row[0] if row != None else 1.0
 
-        last_meme_iteration = get_last_meme_iteration(outdir)
-        meme_out = meme_to_str(outdir, last_meme_iteration, cluster)
+        meme_out = meme_outs[cluster - 1]
         cursor.close()
 
-        cursor = conn.cursor()
-        cursor.execute('select residual from cluster_residuals where cluster = ? and iteration = ?',
-                       [cluster, iteration])
-        row = cursor.fetchone()
-        resid = row[0] if row != None else 1.0
-        cursor.close()
+        resid = results.cluster_residual(iteration, cluster)
+        if resid is None:
+            resid = 1.0
 
-        cursor = conn.cursor()
-        cursor.execute('select name from row_members m join row_names r on m.order_num = r.order_num where m.cluster = ? and iteration = ?', [cluster, iteration])
-        rownames = [row[0] for row in cursor.fetchall()]
+        rownames = results.rows_for_cluster(iteration, cluster)
         rows_out = ",".join(rownames)
-        cursor.close()
         
         outfile.write('"%s"\t%f\t%d\t%f\t"%s"\t%f\t"%s"\n' % (cols_out, string_dens, cluster, meme_pval, meme_out, resid, rows_out))
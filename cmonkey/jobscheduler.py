@@ -0,0 +1,330 @@
+# vi: sw=4 ts=4 et:
+"""jobscheduler.py - runs external tools without blocking
+
+Running MEME, MAST or dust through a process pool means that each
+worker process blocks on its subprocess while holding a copy of the
+memory. Here, a single coordinator starts the external processes
+without blocking and waits for any of them to finish in a select loop.
+
+A job is a generator that describes the steps of a computation:
+it yields a Command to run an external tool and receives its standard
+output, or the error, when the process has finished. A job can also
+yield another job generator, whose result it receives the same way.
+Any other value a job yields is its result.
+
+    def count_lines(path):
+        output = yield Command(['wc', '-l', path])
+        yield int(output.split()[0])
+
+The scheduler runs the jobs concurrently with a limited number of
+processes. Larger jobs are started first, so a long MEME run does not
+end up as the last process in an iteration. Commands that time out or
+fail for a transient reason are retried, if they still fail, the
+error is raised in the job.
+
+This file is part of cMonkey Python. Please see README and LICENSE for
+more information and licensing details.
+"""
+import os
+import sys
+import time
+import types
+import errno
+import heapq
+import select
+import logging
+import subprocess
+import multiprocessing as mp
+
+
+# errors when starting a process that are worth a retry
+TRANSIENT_ERRNOS = [errno.EAGAIN, errno.ENOMEM, errno.EINTR]
+# the interval to poll processes that do not write into a pipe
+POLL_INTERVAL = 0.05
+
+
+class Command:
+    """an external command to be run by the scheduler. The standard output
+    is sent back to the job. If stderr_to_stdout is True, the error output
+    is included in it, otherwise it goes to the error output of cMonkey.
+    If outfile_path is specified, the output is written into that file
+    instead. If check is False, a non-zero exit code is not an error,
+    the exit code is available in returncode after the command ran"""
+
+    def __init__(self, args, stderr_to_stdout=False, outfile_path=None,
+                 check=True):
+        self.args = args
+        self.stderr_to_stdout = stderr_to_stdout
+        self.outfile_path = outfile_path
+        self.check = check
+        self.returncode = None
+
+    def __repr__(self):
+        return "Command: %s" % " ".join(self.args)
+
+
+class JobTimeout(Exception):
+    """raised in a job when its command did not finish in time"""
+
+    def __init__(self, command, timeout):
+        Exception.__init__(self, "'%s' did not finish within %d s." %
+                           (" ".join(command.args), timeout))
+        self.command = command
+        self.timeout = timeout
+
+
+class Job:
+    """the state of a job in the scheduler. stack holds the generator
+    of the job and the ones of the jobs it is currently waiting for"""
+
+    def __init__(self, index, generator, size):
+        self.index = index
+        self.stack = [generator]
+        self.size = size
+        self.command = None
+        self.attempt = 0
+        self.started = False
+        self.result = None
+
+    def close(self):
+        """closes the generators, so they can run their cleanup code"""
+        while len(self.stack) > 0:
+            try:
+                self.stack.pop().close()
+            except Exception, e:
+                logging.warn("error when closing job %d: %s", self.index, str(e))
+
+
+class Process:
+    """a running external process"""
+
+    def __init__(self, job, command):
+        self.job = job
+        self.command = command
+        self.outfile = None
+        self.output = []
+        self.start_time = time.time()
+        self.timed_out = False
+
+        if command.outfile_path is not None:
+            self.outfile = open(command.outfile_path, 'w')
+            stdout = self.outfile
+            stderr = subprocess.STDOUT
+        else:
+            stdout = subprocess.PIPE
+            stderr = subprocess.STDOUT if command.stderr_to_stdout else None
+        self.popen = subprocess.Popen(command.args, stdout=stdout, stderr=stderr,
+                                      close_fds=True)
+        self.stdout = self.popen.stdout
+
+    def read(self):
+        """reads the available output, returns False at the end of it"""
+        data = os.read(self.stdout.fileno(), 65536)
+        if len(data) == 0:
+            self.stdout.close()
+            self.stdout = None
+            return False
+        self.output.append(data)
+        return True
+
+    def poll(self):
+        """returns True if the process has finished and all of its output
+        was read"""
+        return self.stdout is None and self.popen.poll() is not None
+
+    def kill(self):
+        """stops the process"""
+        try:
+            self.popen.kill()
+        except OSError:
+            pass
+        self.popen.wait()
+        self.close()
+
+    def close(self):
+        """releases the files of the process"""
+        if self.stdout is not None:
+            self.stdout.close()
+            self.stdout = None
+        if self.outfile is not None:
+            self.outfile.close()
+            self.outfile = None
+
+
+class JobScheduler:
+    """Runs jobs with at most max_processes external processes at the
+    same time. Commands that run longer than timeout seconds are stopped.
+    Commands that time out, are killed by a signal or can not be started
+    for lack of resources are tried up to max_retries more times"""
+
+    def __init__(self, max_processes=None, timeout=None, max_retries=1):
+        """creates a scheduler, max_processes defaults to the number of
+        CPUs, timeout None means no limit"""
+        if max_processes is None:
+            max_processes = mp.cpu_count()
+        self.max_processes = max(1, max_processes)
+        self.timeout = timeout
+        self.max_retries = max_retries
+
+    def run(self, jobs, sizes=None):
+        """runs the job generators and returns the list of their results.
+        sizes are the expected relative run times of the jobs, larger jobs
+        are started first. If a job raises an exception, the remaining
+        jobs are stopped and the exception is raised from run()"""
+        if sizes is None:
+            sizes = [0] * len(jobs)
+        all_jobs = [Job(index, job, size)
+                    for index, (job, size) in enumerate(zip(jobs, sizes))]
+        # jobs that are waiting for a process, the largest first
+        queue = [(-job.size, job.index, job) for job in all_jobs]
+        heapq.heapify(queue)
+        running = []
+        try:
+            while len(queue) > 0 or len(running) > 0:
+                while len(queue) > 0 and len(running) < self.max_processes:
+                    _, _, job = heapq.heappop(queue)
+                    if not job.started:
+                        job.started = True
+                        self.__resume(job, queue)
+                    else:
+                        self.__start(job, queue, running)
+                if len(running) > 0:
+                    for process in self.__wait(running):
+                        running.remove(process)
+                        self.__finish(process, queue)
+        except:
+            exc_info = sys.exc_info()
+            for process in running:
+                process.kill()
+            for job in all_jobs:
+                job.close()
+            raise exc_info[0], exc_info[1], exc_info[2]
+        return [job.result for job in all_jobs]
+
+    def __resume(self, job, queue, value=None, exc_info=None):
+        """continues the job with the result of its last step. When the job
+        yields its next command, it is queued, otherwise the job is done"""
+        while True:
+            generator = job.stack[-1]
+            try:
+                if exc_info is not None:
+                    item = generator.throw(*exc_info)
+                else:
+                    item = generator.send(value)
+            except StopIteration:
+                item = None
+            except Exception:
+                job.stack.pop()
+                if len(job.stack) == 0:
+                    raise
+                value, exc_info = None, sys.exc_info()
+                continue
+
+            value, exc_info = None, None
+            if isinstance(item, Command):
+                job.command = item
+                job.attempt = 0
+                heapq.heappush(queue, (-job.size, job.index, job))
+                return
+            elif isinstance(item, types.GeneratorType):
+                job.stack.append(item)
+            else:
+                # the result of the generator on top of the stack
+                job.stack.pop().close()
+                if len(job.stack) == 0:
+                    job.result = item
+                    return
+                value = item
+
+    def __start(self, job, queue, running):
+        """starts the current command of the job"""
+        try:
+            running.append(Process(job, job.command))
+        except OSError, e:
+            if e.errno in TRANSIENT_ERRNOS and self.__retry(job, queue, str(e)):
+                return
+            self.__resume(job, queue, exc_info=sys.exc_info())
+
+    def __retry(self, job, queue, reason):
+        """queues the command of the job again if it has retries left"""
+        if job.attempt >= self.max_retries:
+            return False
+        job.attempt += 1
+        logging.warn("%s failed (%s), retry %d of %d", " ".join(job.command.args),
+                     reason, job.attempt, self.max_retries)
+        heapq.heappush(queue, (-job.size, job.index, job))
+        return True
+
+    def __wait(self, running):
+        """waits until at least one of the running processes has finished
+        or timed out and returns these"""
+        while True:
+            readers = [process.stdout for process in running
+                       if process.stdout is not None]
+            wait_time = None
+            if len(readers) < len(running):
+                wait_time = POLL_INTERVAL
+            if self.timeout is not None:
+                now = time.time()
+                for process in running:
+                    remaining = max(0.0, process.start_time + self.timeout - now)
+                    if wait_time is None or remaining < wait_time:
+                        wait_time = remaining
+            try:
+                readable, _, _ = select.select(readers, [], [], wait_time)
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            for stdout in readable:
+                for process in running:
+                    if process.stdout is stdout:
+                        process.read()
+            finished = [process for process in running if process.poll()]
+            if self.timeout is not None:
+                now = time.time()
+                for process in running:
+                    if (process not in finished and
+                        now - process.start_time >= self.timeout):
+                        process.timed_out = True
+                        process.kill()
+                        finished.append(process)
+            if len(finished) > 0:
+                return finished
+
+    def __finish(self, process, queue):
+        """sends the outcome of a finished process to its job"""
+        process.close()
+        job = process.job
+        command = process.command
+        command.returncode = process.popen.returncode
+        if process.timed_out:
+            if self.__retry(job, queue, 'timeout'):
+                return
+            try:
+                raise JobTimeout(command, self.timeout)
+            except JobTimeout:
+                self.__resume(job, queue, exc_info=sys.exc_info())
+        elif command.returncode < 0 and self.__retry(
+            job, queue, 'killed by signal %d' % -command.returncode):
+            return
+        elif command.returncode != 0 and command.check:
+            try:
+                raise subprocess.CalledProcessError(command.returncode,
+                                                    command.args,
+                                                    output="".join(process.output))
+            except subprocess.CalledProcessError:
+                self.__resume(job, queue, exc_info=sys.exc_info())
+        elif command.outfile_path is not None:
+            self.__resume(job, queue, value=None)
+        else:
+            self.__resume(job, queue, value="".join(process.output))
+
+
+def run_job(job):
+    """runs a single job and returns its result"""
+    return JobScheduler(1).run([job])[0]
+
+
+__all__ = ['Command', 'JobTimeout', 'JobScheduler', 'run_job']
@@ -35,6 +35,8 @@ KEY_MAX_CLUSTER_ROWS_ALLOWED = 'memb.max_cluster_rows_allowed'
 # These keys are for save points
 KEY_ROW_IS_MEMBER_OF = 'memb.row_is_member_of'
 KEY_COL_IS_MEMBER_OF = 'memb.col_is_member_of'
+KEY_ROW_NAMES = 'memb.row_names'
+KEY_COL_NAMES = 'memb.col_names'
 
 
 class OrigMembership:
@@ -75,6 +77,21 @@ class OrigMembership:
             tmp = col_is_member_of[col][:num_per_col]
             for i in range(len(tmp)):
                 self.col_membs[self.colidx[col]][i] = tmp[i]
+        self.__init_indexes()
+
+    def __init_indexes(self):
+        """builds the cluster indexes from the membership tables"""
+        # inverted indexes cluster -> {row/column index}, kept up to date by
+        # the modification methods, so member lookups are O(cluster size).
+        # The caches hold (sorted index array, name set) pairs per cluster
+        self.__cluster_rows = make_cluster_index(self.row_membs)
+        self.__cluster_cols = make_cluster_index(self.col_membs)
+        self.__cluster_rows_cache = {}
+        self.__cluster_cols_cache = {}
+        # cluster -> number of changes to its rows/columns, scoring functions
+        # use these to detect the clusters that need to be rescored
+        self.__row_versions = {}
+        self.__col_versions = {}
 
     def write_column_members(self, filename):
         """Mostly for debugging, write out the current column membership state into a TSV file"""
@@ -160,19 +177,61 @@ class OrigMembership:
         """returns the number of clusters for the column"""
         return len(self.clusters_for_column(column))
 
+    def __cluster_members(self, cluster, index, cache, names):
+        """returns the cached (sorted index array, name set) pair for
+        the specified cluster, building it from the index if necessary"""
+        if cluster not in cache:
+            indexes = np.array(sorted(index.get(cluster, ())), dtype='int32')
+            cache[cluster] = (indexes, frozenset([names[i] for i in indexes]))
+        return cache[cluster]
+
+    def row_indexes_for_cluster(self, cluster):
+        """returns the sorted row indexes of the specified cluster"""
+        return self.__cluster_members(cluster, self.__cluster_rows,
+                                      self.__cluster_rows_cache,
+                                      self.row_names)[0]
+
+    def column_indexes_for_cluster(self, cluster):
+        """returns the sorted column indexes of the specified cluster"""
+        return self.__cluster_members(cluster, self.__cluster_cols,
+                                      self.__cluster_cols_cache,
+                                      self.col_names)[0]
+
     def rows_for_cluster(self, cluster):
-        idx = set(np.where(self.row_membs == cluster)[0])
-        return {self.row_names[i] for i in idx}
+        """returns the names of the rows in the specified cluster.
+        The result is shared, so it is returned as an immutable set"""
+        return self.__cluster_members(cluster, self.__cluster_rows,
+                                      self.__cluster_rows_cache,
+                                      self.row_names)[1]
 
     def columns_for_cluster(self, cluster):
-        idx = set(np.where(self.col_membs == cluster)[0])
-        return {self.col_names[i] for i in idx}
+        """returns the names of the columns in the specified cluster.
+        The result is shared, so it is returned as an immutable set"""
+        return self.__cluster_members(cluster, self.__cluster_cols,
+                                      self.__cluster_cols_cache,
+                                      self.col_names)[1]
+
+    def row_version(self, cluster):
+        """returns a counter that changes whenever the rows of the
+        specified cluster change"""
+        return self.__row_versions.get(cluster, 0)
+
+    def column_version(self, cluster):
+        """returns a counter that changes whenever the columns of the
+        specified cluster change"""
+        return self.__col_versions.get(cluster, 0)
+
+    def row_membership_matrix(self, row_names, num_clusters):
+        """returns a boolean |row_names| x num_clusters matrix where entry
+        (i, k) is True if row_names[i] is a member of cluster k + 1"""
+        return make_membership_matrix(self.row_membs, self.rowidx,
+                                      row_names, num_clusters)
 
     def num_row_members(self, cluster):
-        return len(self.rows_for_cluster(cluster))
+        return len(self.__cluster_rows.get(cluster, ()))
 
     def num_column_members(self, cluster):
-        return len(self.columns_for_cluster(cluster))
+        return len(self.__cluster_cols.get(cluster, ()))
 
     def clusters_not_in_row(self, row, clusters):
         return [cluster for cluster in clusters
@@ -208,6 +267,9 @@ class OrigMembership:
             tmp[:, :-1] = self.row_membs
             self.row_membs = tmp
             self.row_membs[rowidx][-1] = cluster
+        update_cluster_index(self.__cluster_rows, self.__cluster_rows_cache,
+                             self.__row_versions,
+                             self.row_membs[rowidx], rowidx, 0, cluster)
 
     def add_cluster_to_column(self, col, cluster, force=False):
         colidx = self.colidx[col]
@@ -223,12 +285,25 @@ class OrigMembership:
             tmp[:, :-1] = self.col_membs
             self.col_membs = tmp
             self.col_membs[colidx][-1] = cluster
+        update_cluster_index(self.__cluster_cols, self.__cluster_cols_cache,
+                             self.__col_versions,
+                             self.col_membs[colidx], colidx, 0, cluster)
 
     def replace_row_cluster(self, row, index, new):
-        self.row_membs[self.rowidx[row]][index] = new
+        rowidx = self.rowidx[row]
+        old = self.row_membs[rowidx][index]
+        self.row_membs[rowidx][index] = new
+        update_cluster_index(self.__cluster_rows, self.__cluster_rows_cache,
+                             self.__row_versions,
+                             self.row_membs[rowidx], rowidx, old, new)
 
     def replace_column_cluster(self, col, index, new):
-        self.col_membs[self.colidx[col]][index] = new
+        colidx = self.colidx[col]
+        old = self.col_membs[colidx][index]
+        self.col_membs[colidx][index] = new
+        update_cluster_index(self.__cluster_cols, self.__cluster_cols_cache,
+                             self.__col_versions,
+                             self.col_membs[colidx], colidx, old, new)
 
     def pickle_path(self):
         """returns the function-specific pickle-path"""
@@ -275,20 +350,77 @@ class OrigMembership:
         elapsed = util.current_millis() - start_time
         logging.info("update_for cdscores finished in %f s.", elapsed / 1000.0)
 
-    def store_checkpoint_data(self, shelf):
+    def store_checkpoint_data(self, checkpoint):
         """Save memberships into checkpoint"""
         logging.info("Saving checkpoint data for memberships in iteration %d",
-                     shelf['iteration'])
-        shelf[KEY_ROW_IS_MEMBER_OF] = self.row_membs
-        shelf[KEY_COL_IS_MEMBER_OF] = self.col_membs
+                     checkpoint.iteration)
+        checkpoint.put_names(KEY_ROW_NAMES, self.row_names)
+        checkpoint.put_names(KEY_COL_NAMES, self.col_names)
+        checkpoint.put_array(KEY_ROW_IS_MEMBER_OF, self.row_membs)
+        checkpoint.put_array(KEY_COL_IS_MEMBER_OF, self.col_membs)
 
     @classmethod
-    def restore_from_checkpoint(cls, config_params, shelf):
-        """Restore memberships from checkpoint information"""
+    def restore_from_checkpoint(cls, checkpoint, matrix, config_params):
+        """Restore memberships from checkpoint information, the checkpoint
+        has to be made for the rows and columns of matrix"""
         logging.info("Restoring cluster memberships from checkpoint data")
-        row_is_member_of = shelf[KEY_ROW_IS_MEMBER_OF]
-        col_is_member_of = shelf[KEY_COL_IS_MEMBER_OF]
-        return cls(row_is_member_of, col_is_member_of, config_params)
+        if (checkpoint.get_names(KEY_ROW_NAMES) != list(matrix.row_names) or
+            checkpoint.get_names(KEY_COL_NAMES) != list(matrix.column_names)):
+            raise Exception("the checkpoint memberships do not match the " +
+                            "ratio matrix")
+        result = cls(matrix.row_names, matrix.column_names, {}, {},
+                     config_params, matrix.row_indexes, matrix.column_indexes)
+        # the tables can have more slots than configured, see
+        # add_cluster_to_row(), so they are restored as they are
+        result.row_membs = np.array(checkpoint.get_array(KEY_ROW_IS_MEMBER_OF),
+                                    dtype='int32')
+        result.col_membs = np.array(checkpoint.get_array(KEY_COL_IS_MEMBER_OF),
+                                    dtype='int32')
+        result.__init_indexes()
+        return result
+
+
+def make_cluster_index(membs):
+    """builds an inverted index cluster -> set of row indexes from a
+    membership table with one row of cluster slots per element"""
+    result = {}
+    for index, clusters in enumerate(membs):
+        for cluster in clusters:
+            if cluster > 0:
+                result.setdefault(cluster, set()).add(index)
+    return result
+
+
+def make_membership_matrix(membs, index_map, names, num_clusters):
+    """builds a boolean |names| x num_clusters matrix from a membership
+    table. Names that are not in index_map are not members of any cluster"""
+    result = np.zeros((len(names), num_clusters + 1), dtype=bool)
+    rows = [(i, index_map[name]) for i, name in enumerate(names)
+            if name in index_map]
+    if len(rows) > 0:
+        result_indexes, memb_indexes = zip(*rows)
+        slots = membs[list(memb_indexes)]
+        slots[(slots < 0) | (slots > num_clusters)] = 0
+        result[np.array(result_indexes)[:, np.newaxis], slots] = True
+    return result[:, 1:]
+
+
+def update_cluster_index(index, cache, versions, slots, elem_index, old, new):
+    """updates the inverted index after the cluster in one of an element's
+    slots changed from old to new. slots are the element's cluster slots
+    after the change. Since an element can hold the same cluster in several
+    slots, it is only removed from old if no slot refers to it anymore.
+    The versions of the clusters whose members changed are incremented"""
+    if old > 0 and old != new and old not in slots:
+        index[old].discard(elem_index)
+        cache.pop(old, None)
+        versions[old] = versions.get(old, 0) + 1
+    if new > 0:
+        members = index.setdefault(new, set())
+        if elem_index not in members:
+            members.add(elem_index)
+            cache.pop(new, None)
+            versions[new] = versions.get(new, 0) + 1
 
 
 def create_membership(matrix, seed_row_memberships, seed_column_memberships,
@@ -532,16 +664,10 @@ def get_row_density_scores(membership, row_scores):
                               row_scores.num_columns,
                               row_scores.row_names,
                               row_scores.column_names)
-    rds_values = rd_scores.values
-
     start_time = util.current_millis()
-    for cluster in xrange(1, num_clusters + 1):
-        # instead of assigning the rr_scores values per row, we can assign to the
-        # transpose and let numpy do the assignment
-        rds_values.T[cluster - 1] = get_rr_scores(membership, row_scores,
-                                                  rowscore_bandwidth,
-                                                  cluster)
-
+    rd_scores.values[:, :num_clusters] = get_rr_scores(
+        membership, row_scores, rowscore_bandwidth,
+        range(1, num_clusters + 1)).T
     elapsed = util.current_millis() - start_time
     logging.info("RR_SCORES IN %f s.", elapsed / 1000.0)
     return rd_scores
@@ -555,16 +681,10 @@ def get_col_density_scores(membership, col_scores):
                               col_scores.num_columns,
                               col_scores.row_names,
                               col_scores.column_names)
-    cds_values = cd_scores.values
-
     start_time = util.current_millis()
-    for cluster in xrange(1, num_clusters + 1):
-        # instead of assigning the cc_scores values per row, we can assign to the
-        # transpose and let numpy do the assignment
-        cds_values.T[cluster - 1] = get_cc_scores(membership, col_scores,
-                                                  colscore_bandwidth,
-                                                  cluster)
-
+    cd_scores.values[:, :num_clusters] = get_cc_scores(
+        membership, col_scores, colscore_bandwidth,
+        range(1, num_clusters + 1)).T
     elapsed = util.current_millis() - start_time
     logging.info("CC_SCORES IN %f s.", elapsed / 1000.0)
     return cd_scores
@@ -575,49 +695,81 @@ def get_density_scores(membership, row_scores, col_scores):
             get_col_density_scores(membership, col_scores))
 
 
-def get_rr_scores(membership, rowscores, bandwidth, cluster):
+def __compute_density_scores(scores, cluster_members, bandwidths, clusters):
+    """computes the density scores of the specified clusters in a single
+    batched call. cluster_members contains the member names for each
+    cluster, or None if the cluster should get the uniform fallback score.
+    Returns an array with one row of scores per cluster"""
+    num_rows = scores.num_rows
+    result = np.empty((len(clusters), num_rows))
+    result.fill(1.0 / num_rows)
+    computed = [i for i, members in enumerate(cluster_members)
+                if members is not None]
+    if len(computed) == 0:
+        return result
+
+    kscores = np.array([scores.values[:, clusters[i] - 1] for i in computed])
+    max_members = max([len(cluster_members[i]) for i in computed])
+    cluster_scores = np.empty((len(computed), max_members))
+    cluster_scores.fill(np.nan)
+    dmins = np.empty(len(computed))
+    dmaxs = np.empty(len(computed))
+    for row, i in enumerate(computed):
+        score_indexes = scores.row_indexes_for(cluster_members[i])
+        cluster_scores[row, :len(score_indexes)] = kscores[row][score_indexes]
+        kscores_finite = kscores[row][np.isfinite(kscores[row])]
+        dmins[row] = np.amin(kscores_finite) - 1
+        dmaxs[row] = np.amax(kscores_finite) + 1
+    result[computed] = util.density_batch(kscores, cluster_scores,
+                                          np.asarray(bandwidths)[computed],
+                                          dmins, dmaxs)
+    return result
+
+
+def __has_finite_scores(scores, cluster):
+    """determines whether the cluster's score column has finite values"""
+    return np.any(np.isfinite(scores.values[:, cluster - 1]))
+
+
+def get_rr_scores(membership, rowscores, bandwidth, clusters):
     """calculate the density scores for the given row score values in the
-    specified cluster"""
+    specified clusters"""
     def bwscale(value):
         """standard bandwidth scaling function for row scores"""
         return math.exp(-value / 10.0) * 10.0
 
-    cluster_rows = membership.rows_for_cluster(cluster)
-    cluster_columns = membership.columns_for_cluster(cluster)
-    kscores = rowscores.column_values(cluster - 1)
-    kscores_finite = kscores[np.isfinite(kscores)]
-
-    if len(cluster_rows) == 0 or len(kscores_finite) == 0 or len(cluster_columns) == 0:
-        num_rows = rowscores.num_rows
-        return [(1.0 / num_rows) for _ in xrange(num_rows)]
-    else:
-        score_indexes = rowscores.row_indexes_for(cluster_rows)
-        cluster_scores = [kscores[index] for index in score_indexes]
-        cluster_bandwidth = bandwidth * bwscale(len(cluster_rows))
-        return util.density(kscores, cluster_scores, cluster_bandwidth,
-                            np.amin(kscores_finite) - 1,
-                            np.amax(kscores_finite) + 1)
+    cluster_members = []
+    bandwidths = []
+    for cluster in clusters:
+        cluster_rows = membership.rows_for_cluster(cluster)
+        if (len(cluster_rows) == 0 or
+            membership.num_column_members(cluster) == 0 or
+            not __has_finite_scores(rowscores, cluster)):
+            cluster_members.append(None)
+            bandwidths.append(bandwidth)
+        else:
+            cluster_members.append(cluster_rows)
+            bandwidths.append(bandwidth * bwscale(len(cluster_rows)))
+    return __compute_density_scores(rowscores, cluster_members, bandwidths,
+                                    clusters)
 
 
-def get_cc_scores(membership, scores, bandwidth, cluster):
+def get_cc_scores(membership, scores, bandwidth, clusters):
     """calculate the density scores for the given column score values in the
-    specified cluster"""
-    cluster_rows = membership.rows_for_cluster(cluster)
-    cluster_columns = membership.columns_for_cluster(cluster)
-    kscores = scores.column_values(cluster - 1)
-    kscores_finite = kscores[np.isfinite(kscores)]
-
-    if len(cluster_rows) == 0 or len(kscores_finite) == 0 or len(cluster_columns) <= 1:
+    specified clusters"""
+    cluster_members = []
+    for cluster in clusters:
+        cluster_columns = membership.columns_for_cluster(cluster)
         # This is a little weird, but is here to at least attempt to simulate
         # what the original cMonkey is doing
-        num_rows = scores.num_rows
-        return [(1.0 / num_rows) for _ in xrange(num_rows)]
-    else:
-        score_indexes = scores.row_indexes_for(cluster_columns)
-        cluster_scores = [kscores[index] for index in score_indexes]
-        return util.density(kscores, cluster_scores, bandwidth,
-                            np.amin(kscores_finite) - 1,
-                            np.amax(kscores_finite) + 1)
+        if (membership.num_row_members(cluster) == 0 or
+            len(cluster_columns) <= 1 or
+            not __has_finite_scores(scores, cluster)):
+            cluster_members.append(None)
+        else:
+            cluster_members.append(cluster_columns)
+    return __compute_density_scores(scores, cluster_members,
+                                    [bandwidth] * len(clusters), clusters)
 
 
 def compensate_size(membership, matrix, rd_scores, cd_scores):
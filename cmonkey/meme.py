@@ -10,12 +10,16 @@ import subprocess
 import tempfile
 import logging
 import seqtools as st
+import jobscheduler
+import pssmscan
 import os
 import os.path
 import util
 import shutil
 import re
 import collections
+import hashlib
+import cPickle
 import xml.etree.ElementTree as ET
 
 
@@ -34,14 +38,32 @@ class MemeSuite:
     dust - remove low-complexity regions or sequence repeats
     meme - discover motifs in a set of sequences
     mast - search for a group of motifs in a set of sequences
+
+    The motifs can be searched with MAST (scanner = 'mast') or with the
+    in-process scanner of the pssmscan module (scanner = 'pssm')
     """
+    # the MAST E-value thresholds for the sequences (-ev) and motifs (-mev)
+    MAX_SEQ_EVALUE = 999999.0
+    MAX_MOTIF_EVALUE = 9999999.0
+
     def __init__(self, max_width=24, use_revcomp=True, background_file=None,
-                 remove_tempfiles=True):
-        """Create MemeSuite instance"""
+                 remove_tempfiles=True, result_cache=None, scanner='mast'):
+        """Create MemeSuite instance. If a MemeResultCache is provided,
+        MEME and MAST are only run for inputs that are not in the cache"""
+        if scanner not in ['mast', 'pssm']:
+            raise Exception("unknown motif scanner: '%s'" % scanner)
         self.__max_width = max_width
         self.__use_revcomp = use_revcomp
         self.__background_file = background_file
         self.__remove_tempfiles = remove_tempfiles
+        self.__result_cache = result_cache
+        self.__scanner = scanner
+        # id(all_seqs) -> (all_seqs, MAST database file)
+        self.__database_files = {}
+        # id(all_seqs) -> (all_seqs, pssmscan.SequenceDatabase)
+        self.__scan_databases = {}
+        # id(all_seqs) -> (all_seqs, digest of the sequences)
+        self.__used_seqs_digests = {}
 
     def global_background_file(self):
         """returns the global background file used with this meme suite
@@ -69,7 +91,7 @@ class MemeSuite:
                 dust_tmp_file = dust_input.name
                 #logging.info("DUST input written to: %s", dust_input.name)
             seqpairs = st.read_sequences_from_fasta_string(
-                self.dust(dust_tmp_file))
+                jobscheduler.run_job(self.dust_job(dust_tmp_file)))
             os.remove(dust_tmp_file)
             result = {}
             for feature_id, seq in seqpairs:
@@ -99,6 +121,11 @@ class MemeSuite:
         distribution.
         Note: To more closely resemble the original R algorithm, we provide
         ----- the sorted feature ids so MEME will return the same output"""
+        return jobscheduler.run_job(self.job(params))
+
+    def job(self, params):
+        """the MEME and MAST run of __call__() as a job for the
+        JobScheduler, it yields the MemeRunResult"""
         feature_ids = set(params.feature_ids)  # optimization: reduce lookup time
         input_seqs = params.seqs
         all_seqs = params.used_seqs
@@ -117,43 +144,55 @@ class MemeSuite:
         #logging.info("run_meme() - # seqs = %d", len(input_seqs))
         bgfile = background_file()
         #logging.info("created background file in %s", bgfile)
+
+        # cached results do not have a MEME output to keep, so we only
+        # use the cache if the output is not requested
+        keep_meme_output = (params.debug or params.keep_memeout and
+                            params.iteration > params.num_iterations)
+        cache_key = None
+        if self.__result_cache is not None and not keep_meme_output:
+            cache_key = self.__result_cache_key(params, bgfile)
+            result = self.__result_cache.get(cache_key)
+            if result is not None:
+                if self.__background_file is None and self.__remove_tempfiles:
+                    os.remove(bgfile)
+                yield result
+                return
+
         seqfile = self.make_sequence_file(
             [(feature_id, input_seqs[feature_id])
              for feature_id in params.feature_ids if feature_id in input_seqs])
         #logging.info("created sequence file in %s", seqfile)
-        motif_infos, output = self.meme(seqfile, bgfile, params.num_motifs,
-                                        previous_motif_infos=params.previous_motif_infos)
-
-        # run mast
         meme_outfile = None
-        if params.debug or params.keep_memeout and params.iteration > params.num_iterations:
-            meme_outfile = '%s/meme-out-%04d-%04d' % (params.outdir,
-                                                      params.iteration, params.cluster)
-            with open(meme_outfile, 'w') as outfile:
-                outfile.write(output)
-        else:
-            with tempfile.NamedTemporaryFile(prefix='meme.out.',
-                                             delete=False) as outfile:
-                meme_outfile = outfile.name
-                outfile.write(output)
-
-        #logging.info('wrote meme output to %s', meme_outfile)
-        dbfile = self.make_sequence_file(
-            [(feature_id, locseq[1])
-             for feature_id, locseq in all_seqs.items()])
-        #logging.info('created mast database in %s', dbfile)
         try:
-            mast_output = self.mast(meme_outfile, dbfile, bgfile)
-            pe_values, annotations = self.read_mast_output(mast_output,
-                                                           input_seqs.keys())
-            return MemeRunResult(pe_values, annotations, motif_infos)
-        except subprocess.CalledProcessError, e:
-            if e.output.startswith('No input motifs pass the E-value'):
-                logging.warn("no input motifs pass the e-value, ignoring result")
-                return MemeRunResult([], [], [])
+            motif_infos, output = yield self.meme_job(
+                seqfile, bgfile, params.num_motifs,
+                previous_motif_infos=params.previous_motif_infos)
+
+            # run mast
+            if keep_meme_output:
+                meme_outfile = '%s/meme-out-%04d-%04d' % (params.outdir,
+                                                          params.iteration, params.cluster)
+                with open(meme_outfile, 'w') as outfile:
+                    outfile.write(output)
             else:
-                print "Unknown error in MAST:\n ", e.__dict__
-                raise
+                with tempfile.NamedTemporaryFile(prefix='meme.out.',
+                                                 delete=False) as outfile:
+                    meme_outfile = outfile.name
+                    outfile.write(output)
+
+            #logging.info('wrote meme output to %s', meme_outfile)
+            try:
+                pe_values, annotations = yield self.scan_job(
+                    meme_outfile, all_seqs, bgfile, motif_infos, input_seqs.keys())
+                result = MemeRunResult(pe_values, annotations, motif_infos)
+            except subprocess.CalledProcessError, e:
+                if e.output.startswith('No input motifs pass the E-value'):
+                    logging.warn("no input motifs pass the e-value, ignoring result")
+                    result = MemeRunResult([], [], [])
+                else:
+                    print "Unknown error in MAST:\n ", e.__dict__
+                    raise
         finally:
             if self.__remove_tempfiles:
                 #logging.info("DELETING ALL TMP FILES...")
@@ -163,14 +202,10 @@ class MemeSuite:
                     logging.warn("could not remove tmp file: '%s'", seqfile)
                 try:
                     #if params.iteration <= params.num_iterations or not params.keep_memeout:
-                    if not params.keep_memeout:
+                    if meme_outfile is not None and not params.keep_memeout:
                         os.remove(meme_outfile)
                 except:
                     logging.warn("could not remove tmp file: '%s'", meme_outfile)
-                try:
-                    os.remove(dbfile)
-                except:
-                    logging.warn("could not remove tmp file: '%s'", dbfile)
 
                 if self.__background_file is None:
                     try:
@@ -178,10 +213,101 @@ class MemeSuite:
                     except:
                         logging.warn("could not remove tmp file: '%s'", bgfile)
 
+        if cache_key is not None:
+            self.__result_cache.put(cache_key, result)
+        yield result
+
+    def __result_cache_key(self, params, bgfile):
+        """the cache key of a MEME/MAST run consists of everything the
+        result depends on: the tool versions and parameters, the input
+        sequences, the background model and the MAST database"""
+        input_seqs = params.seqs
+        with open(bgfile) as infile:
+            background = infile.read()
+        return self.__result_cache.make_key(
+            self.__class__.__name__, self.__scanner,
+            self.__max_width, self.__use_revcomp,
+            params.num_motifs, self.meme_seed(params.previous_motif_infos),
+            [(feature_id, input_seqs[feature_id])
+             for feature_id in sorted(params.feature_ids)
+             if feature_id in input_seqs],
+            background, self.used_seqs_digest(params.used_seqs))
+
+    def used_seqs_digest(self, all_seqs):
+        """returns the digest of the sequences in all_seqs for the result
+        cache keys. Like the MAST database, it is computed once for each
+        sequence dictionary"""
+        key = id(all_seqs)
+        if key not in self.__used_seqs_digests:
+            digest = hashlib.sha1(repr(sorted(
+                        (feature_id, locseq[1])
+                        for feature_id, locseq in all_seqs.items())))
+            self.__used_seqs_digests[key] = (all_seqs, digest.hexdigest())
+        return self.__used_seqs_digests[key][1]
+
     def read_mast_output(self, mast_output, genes):
         """Please implement me"""
         logging.error("MemeSuite.read_mast_output() - please implement me")
 
+    def scan_job(self, meme_outfile_path, all_seqs, bgfile_path, motif_infos,
+                 genes):
+        """searches the motifs in all_seqs as a job, it yields the pair
+        (pe_values, annotations) of the scan. With the 'mast' scanner, MAST
+        is run on the MEME output file, otherwise the motif_infos are
+        scanned in-process"""
+        if self.__scanner == 'pssm':
+            result = pssmscan.scan(
+                motif_infos, self.scan_database(all_seqs),
+                pssmscan.read_background_frequencies(bgfile_path), genes,
+                use_revcomp=self.__use_revcomp,
+                max_seq_evalue=self.MAX_SEQ_EVALUE,
+                max_motif_evalue=self.MAX_MOTIF_EVALUE)
+        else:
+            dbfile = self.mast_database_file(all_seqs)
+            mast_output = yield self.mast_job(meme_outfile_path, dbfile,
+                                              bgfile_path)
+            result = self.read_mast_output(mast_output, genes)
+        yield result
+
+    def scan_database(self, all_seqs):
+        """returns the pssmscan.SequenceDatabase for all_seqs, it is
+        created once for each sequence dictionary like the MAST database
+        file"""
+        key = id(all_seqs)
+        if key not in self.__scan_databases:
+            database = pssmscan.SequenceDatabase(
+                [(feature_id, locseq[1])
+                 for feature_id, locseq in all_seqs.items()])
+            self.__scan_databases[key] = (all_seqs, database)
+        return self.__scan_databases[key][1]
+
+    def mast_database_file(self, all_seqs):
+        """returns the MAST database file for all_seqs, a dictionary of
+        (feature_id : (location, sequence)). The scan sequences do not
+        change during a run, so the file is written once for each sequence
+        dictionary and shared by all MAST runs until cleanup() is called"""
+        key = id(all_seqs)
+        if key not in self.__database_files:
+            dbfile = self.make_sequence_file(
+                [(feature_id, locseq[1])
+                 for feature_id, locseq in all_seqs.items()])
+            logging.info('created mast database in %s', dbfile)
+            # keeping a reference to all_seqs makes sure its id is not reused
+            self.__database_files[key] = (all_seqs, dbfile)
+        return self.__database_files[key][1]
+
+    def cleanup(self):
+        """removes the files that were shared by the runs of this suite"""
+        if self.__remove_tempfiles:
+            for _, dbfile in self.__database_files.values():
+                try:
+                    os.remove(dbfile)
+                except:
+                    logging.warn("could not remove tmp file: '%s'", dbfile)
+        self.__database_files = {}
+        self.__scan_databases = {}
+        self.__used_seqs_digests = {}
+
     def make_sequence_file(self, seqs):
         """Creates a FASTA file from a list of(feature_id, sequence)
         pairs"""
@@ -196,38 +322,55 @@ class MemeSuite:
         """runs the dust command on the specified FASTA file and
         returns a list of sequences. It is assumed that dust has
         a very simple interface: FASTA in, output on stdout"""
-        output = subprocess.check_output(['dust', fasta_file_path])
-        return output
+        return jobscheduler.run_job(self.dust_job(fasta_file_path))
+
+    def dust_job(self, fasta_file_path):  # pylint: disable-msg=R0201
+        """the dust command as a job"""
+        output = yield jobscheduler.Command(['dust', fasta_file_path])
+        yield output
+
+    def meme_seed(self, previous_motif_infos):  # pylint: disable-msg=W0613,R0201
+        """returns the consensus sequence MEME is seeded with, None if
+        this version does not seed MEME"""
+        return None
 
-    # pylint: disable-msg=W0613,R0201
     def meme(self, infile_path, bgfile_path, num_motifs,
              previous_motif_infos=None, pspfile_path=None):
-        """Please implement me"""
-        logging.error("MemeSuite.meme() - please implement me")
+        """runs the meme command on the specified input file, background file
+        and positional priors file. Returns a tuple of
+        (list of MemeMotifInfo objects, meme output)
+        """
+        return jobscheduler.run_job(self.meme_job(
+            infile_path, bgfile_path, num_motifs, previous_motif_infos,
+            pspfile_path))
 
     def mast(self, meme_outfile_path, database_file_path,
-             bgfile_path):  # pylint: disable-msg=R0201
+             bgfile_path):
+        """runs the mast command and returns its output"""
+        return jobscheduler.run_job(self.mast_job(
+            meme_outfile_path, database_file_path, bgfile_path))
+
+    # pylint: disable-msg=W0613,R0201
+    def meme_job(self, infile_path, bgfile_path, num_motifs,
+                 previous_motif_infos=None, pspfile_path=None):
         """Please implement me"""
-        logging.error("MemeSuite.mast() - please implement me")
+        logging.error("MemeSuite.meme_job() - please implement me")
+        yield None
+
+    def mast_job(self, meme_outfile_path, database_file_path,
+                 bgfile_path):  # pylint: disable-msg=R0201
+        """Please implement me"""
+        logging.error("MemeSuite.mast_job() - please implement me")
+        yield None
 
 
 class MemeSuite430(MemeSuite):
     """Version 4.3.0 of MEME"""
 
-    def meme(self, infile_path, bgfile_path, num_motifs,
-             previous_motif_infos=None, pspfile_path=None):
-        """runs the meme command on the specified input file, background file
-        and positional priors file. Returns a tuple of
-        (list of MemeMotifInfo objects, meme output)
-        """
-        command = ['meme', infile_path, '-bfile', bgfile_path,
-                   '-time', '600', '-dna', '-revcomp',
-                   '-maxsize', '9999999', '-nmotifs', str(num_motifs),
-                   '-evt', '1e9', '-minw', '6', '-maxw', str(self.max_width()),
-                   '-mod',  'zoops', '-nostatus', '-text']
-        # if determine the seed sequence (-cons parameter) for this MEME run
-        # uses the PSSM with the smallest score that has an e-value lower
-        # than 0.1
+    def meme_seed(self, previous_motif_infos):
+        """determine the seed sequence (-cons parameter) for this MEME run
+        uses the PSSM with the smallest score that has an e-value lower
+        than 0.1"""
         if previous_motif_infos is not None:
             max_evalue = 0.1
             min_evalue = 10000000.0
@@ -237,20 +380,34 @@ class MemeSuite430(MemeSuite):
                     min_evalue = motif_info.evalue
                     min_motif_info = motif_info
             if min_motif_info is not None and min_motif_info.evalue < max_evalue:
-                cons = min_motif_info.consensus_string().upper()
-                logging.info("seeding MEME with good motif %s", cons)
-                command.extend(['-cons', cons])
+                return min_motif_info.consensus_string().upper()
+        return None
+
+    def meme_job(self, infile_path, bgfile_path, num_motifs,
+                 previous_motif_infos=None, pspfile_path=None):
+        """the meme command as a job, yields a tuple of
+        (list of MemeMotifInfo objects, meme output)
+        """
+        command = ['meme', infile_path, '-bfile', bgfile_path,
+                   '-time', '600', '-dna', '-revcomp',
+                   '-maxsize', '9999999', '-nmotifs', str(num_motifs),
+                   '-evt', '1e9', '-minw', '6', '-maxw', str(self.max_width()),
+                   '-mod',  'zoops', '-nostatus', '-text']
+        cons = self.meme_seed(previous_motif_infos)
+        if cons is not None:
+            logging.info("seeding MEME with good motif %s", cons)
+            command.extend(['-cons', cons])
 
         if pspfile_path:
             command.extend(['-psp', pspfile_path])
 
         #logging.info("running: %s", " ".join(command))
-        output = subprocess.check_output(command)
-        return (read_meme_output(output, num_motifs), output)
+        output = yield jobscheduler.Command(command)
+        yield (read_meme_output(output, num_motifs), output)
 
-    def mast(self, meme_outfile_path, database_file_path,
-             bgfile_path):
-        """runs the mast command"""
+    def mast_job(self, meme_outfile_path, database_file_path,
+                 bgfile_path):
+        """the mast command as a job"""
         # note: originally run with -ev 99999, but MAST will crash with
         # memory errors
         command = ['mast', meme_outfile_path, '-d', database_file_path,
@@ -258,8 +415,8 @@ class MemeSuite430(MemeSuite):
                    '-brief', '-ev', '999999', '-mev', '9999999', '-mt', '0.99',
                    '-seqp', '-remcorr']
         #logging.info("running: %s", " ".join(command))
-        output = subprocess.check_output(command, stderr=subprocess.STDOUT)
-        return output
+        output = yield jobscheduler.Command(command, stderr_to_stdout=True)
+        yield output
 
     def read_mast_output(self, mast_output, genes):
         """old-style MAST output"""
@@ -268,12 +425,13 @@ class MemeSuite430(MemeSuite):
 
 class MemeSuite481(MemeSuite):
     """Version 4.8.1 of MEME"""
+    MAX_SEQ_EVALUE = 1500.0
+    MAX_MOTIF_EVALUE = 99999.0
 
-    def meme(self, infile_path, bgfile_path, num_motifs,
-             previous_motif_infos=None,
-             pspfile_path=None):
-        """runs the meme command on the specified input file, background file
-        and positional priors file. Returns a tuple of
+    def meme_job(self, infile_path, bgfile_path, num_motifs,
+                 previous_motif_infos=None,
+                 pspfile_path=None):
+        """the meme command as a job, yields a tuple of
         (list of MemeMotifInfo objects, meme output)
         """
         command = ['meme', infile_path, '-bfile', bgfile_path,
@@ -307,45 +465,126 @@ class MemeSuite481(MemeSuite):
 
         #logging.info("running: %s", " ".join(command))
         try:
-            output = subprocess.check_output(command)
-            return (read_meme_output(output, num_motifs), output)
-        except:
+            output = yield jobscheduler.Command(command)
+        except Exception:
             print command
             raise
+        yield (read_meme_output(output, num_motifs), output)
 
-    def mast(self, meme_outfile_path, database_file_path,
-             bgfile_path):
-        """runs the mast command. Version 4.81 and above behave differently
+    def mast_job(self, meme_outfile_path, database_file_path,
+                 bgfile_path):
+        """the mast command as a job. Version 4.81 and above behave differently
         than 4.30: The output will be generated in an output directory
         So, here we'll generate a temporary directory
         """
         # note: originally run with -ev 99999, but MAST will crash with
         # memory errors
         dirname = tempfile.mkdtemp(prefix="mastout")
+        result = None
         try:
             command = ['mast', meme_outfile_path, database_file_path,
                        '-bfile', bgfile_path, '-nostatus',
                        '-ev', '1500', '-mev', '99999', '-mt', '0.99', '-nohtml',
                        '-notext', '-seqp', '-remcorr', '-oc', dirname]
             logging.info("running: %s", " ".join(command))
-            output = subprocess.check_output(command, stderr=subprocess.STDOUT)
+            yield jobscheduler.Command(command, stderr_to_stdout=True)
             with open(os.path.join(dirname, "mast.xml")) as infile:
                 result = infile.read()
-            return result
         except subprocess.CalledProcessError, e:
+            # return nothing if there was an error
             logging.warn("there is an exception thrown in MAST: %s",
                          e.output)
-            return None  # return nothing if there was an error
         finally:
             print "removing %s..." % dirname
             shutil.rmtree(dirname)
             print "done."
+        yield result
 
     def read_mast_output(self, mast_output, genes):
         """XML MAST output"""
         return read_mast_output_xml(mast_output, genes)
 
 
+class MemeResultCache:
+    """A persistent cache for MemeRunResult objects. The results are
+    stored as pickle files in a directory under a hash of their inputs.
+    When the total size of the cache exceeds max_bytes, the least
+    recently used results are removed.
+    The cache can be shared between processes: results are written
+    atomically and missing or broken files are treated as cache misses"""
+
+    def __init__(self, cache_dir, max_bytes, version=None):
+        """creates a cache in cache_dir, version is the MEME version which
+        becomes part of each key"""
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.version = version
+
+    def make_key(self, *components):
+        """returns the key for the specified input components"""
+        digest = hashlib.sha1(str(self.version))
+        for component in components:
+            digest.update(repr(component))
+            digest.update('\0')
+        return digest.hexdigest()
+
+    def __path(self, key):
+        """returns the file path for key"""
+        return os.path.join(self.cache_dir, '%s.pkl' % key)
+
+    def get(self, key):
+        """returns the result stored for key or None"""
+        path = self.__path(key)
+        try:
+            with open(path, 'rb') as infile:
+                result = cPickle.load(infile)
+            # the modification time is the last use for the eviction
+            os.utime(path, None)
+            return result
+        except (IOError, OSError, EOFError, cPickle.UnpicklingError):
+            return None
+
+    def put(self, key, result):
+        """stores result under key and evicts old results if necessary"""
+        if not os.path.exists(self.cache_dir):
+            try:
+                os.makedirs(self.cache_dir)
+            except OSError:
+                # created by another process in the meantime
+                pass
+        with tempfile.NamedTemporaryFile(prefix='tmp', dir=self.cache_dir,
+                                         delete=False) as outfile:
+            cPickle.dump(result, outfile, cPickle.HIGHEST_PROTOCOL)
+        os.rename(outfile.name, self.__path(key))
+        self.evict()
+
+    def evict(self):
+        """removes the least recently used results until the cache does
+        not exceed its maximum size"""
+        entries = []
+        total_bytes = 0
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith('.pkl'):
+                continue
+            path = os.path.join(self.cache_dir, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total_bytes += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_bytes -= size
+
+
 class MemeMotifInfo:
     """Only a motif's info line, the
     probability matrix and the site information is relevant"""
@@ -696,45 +935,87 @@ def __next_regex_index(pat, start_index, lines):
 
 def make_background_file(bgseqs, use_revcomp, bgorder=3):
     """create a meme background file and returns its name"""
-    def make_seqs(seqs):
-        """prepare the input sequences for feeding into meme.
-        This means only taking the unique sequences and their reverse
-        complement if desired"""
-        meme_input_seqs = []
-        for locseq in seqs.values():
-            seq = locseq[1]
-            if seq not in meme_input_seqs:
-                meme_input_seqs.append(seq)
-            if use_revcomp:
-                revseq = st.revcomp(seq)
-                if revseq not in meme_input_seqs:
-                    meme_input_seqs.append(revseq)
-        return meme_input_seqs
-
-    filename = None
-    bgmodel = st.markov_background(make_seqs(bgseqs), bgorder)
     with tempfile.NamedTemporaryFile(prefix='memebg',
                                      delete=False) as outfile:
-        filename = outfile.name
-        #logging.info("make background file '%s'", filename)
-        outfile.write("# %s order Markov background model\n" %
-                      util.order2string(len(bgmodel) - 1))
-        for order_row in bgmodel:
-            for seq, frequency in order_row.items():
-                outfile.write('%s %10s\n' %
-                              (seq, str(round(frequency, 8))))
-    return filename
+        #logging.info("make background file '%s'", outfile.name)
+        write_background_model(outfile,
+                               make_background_model(bgseqs, use_revcomp,
+                                                     bgorder))
+    return outfile.name
+
+
+def make_background_model(bgseqs, use_revcomp, bgorder=3):
+    """computes the Markov background model of the specified order on
+    the unique sequences of bgseqs and their reverse complements if
+    desired"""
+    unique_seqs = set()
+    for locseq in bgseqs.values():
+        unique_seqs.add(locseq[1])
+        if use_revcomp:
+            unique_seqs.add(st.revcomp(locseq[1]))
+    return st.markov_background(sorted(unique_seqs), bgorder)
+
+
+def write_background_model(outfile, bgmodel):
+    """writes a background model in MEME format"""
+    outfile.write("# %s order Markov background model\n" %
+                  util.order2string(len(bgmodel) - 1))
+    for order_row in bgmodel:
+        for seq, frequency in order_row.items():
+            outfile.write('%s %10s\n' %
+                          (seq, str(round(frequency, 8))))
 
 
 def global_background_file(organism, gene_aliases, seqtype, bgorder=3,
-                           use_revcomp=True):
+                           use_revcomp=True, cache_dir=None):
     """returns a background file that was computed on the set of all
-    used sequences"""
-    global_seqs = organism.sequences_for_genes_scan(gene_aliases,
-                                                    seqtype=seqtype)
+    used sequences. If cache_dir is specified, the file is stored there
+    and reused as long as the organism, the sequence type, the order and
+    the sequences are the same. The sequences depend on the scan distance,
+    the operons and the genome, so they are part of the key"""
+    global_seqs = organism.scan_sequences(gene_aliases, seqtype)
+    cache_path = None
+    if cache_dir is not None:
+        cache_name = background_cache_name(organism.code, global_seqs,
+                                           seqtype, bgorder, use_revcomp)
+        cache_path = os.path.join(cache_dir, 'meme-background', cache_name)
+        if os.path.exists(cache_path):
+            logging.info("using cached global background file '%s'",
+                         cache_path)
+            return cache_path
+
     logging.info("Computing global background file on seqtype '%s' " +
                  "(%d sequences)", seqtype, len(global_seqs))
-    return make_background_file(global_seqs, use_revcomp, bgorder)
+    if cache_path is None:
+        return make_background_file(global_seqs, use_revcomp, bgorder)
+
+    start_time = util.current_millis()
+    bgmodel = make_background_model(global_seqs, use_revcomp, bgorder)
+    if not os.path.exists(os.path.dirname(cache_path)):
+        os.makedirs(os.path.dirname(cache_path))
+    # write into a temporary file first, so an interrupted run does not
+    # leave an incomplete background file in the cache
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(cache_path),
+                                     prefix='memebg', delete=False) as outfile:
+        write_background_model(outfile, bgmodel)
+    os.rename(outfile.name, cache_path)
+    elapsed = util.current_millis() - start_time
+    logging.info("computed global background file '%s' in %f s.",
+                 cache_path, elapsed / 1000.0)
+    return cache_path
+
+
+def background_cache_name(organism_code, seqs, seqtype, bgorder,
+                          use_revcomp):
+    """the file name of a cached background model, seqs is the
+    dictionary of (feature_id : (location, sequence)) the model is
+    computed from"""
+    digest = hashlib.sha1()
+    for feature_id in sorted(seqs.keys()):
+        digest.update('%s\t%s\n' % (feature_id, seqs[feature_id][1]))
+    return '%s-%s-order%d%s-%s.bg' % (
+        organism_code, seqtype, bgorder, '-revcomp' if use_revcomp else '',
+        digest.hexdigest()[:16])
 
 
 USER_TEST_FASTA_PATH = 'config/fasta_test.fa'
@@ -11,7 +11,11 @@ import logging
 import datamatrix as dm
 import util
 import scoring
-import multiprocessing as mp
+import workerpool
+
+
+# config key to select the batched row scoring
+KEY_VECTORIZED_ROW_SCORING = 'vectorized_row_scoring'
 
 
 def seed_column_members(data_matrix, row_membership, num_clusters,
@@ -42,12 +46,25 @@ def seed_column_members(data_matrix, row_membership, num_clusters,
 
 
 def compute_row_scores(membership, matrix, num_clusters,
-                       use_multiprocessing):
+                       use_multiprocessing, pool=None, vectorized=False,
+                       cache=None):
     """for each cluster 1, 2, .. num_clusters compute the row scores
-    for the each row name in the input name matrix"""
+    for the each row name in the input name matrix.
+    If a ClusterScoreCache is provided, only the clusters that changed since
+    the previous call are computed"""
+    clusters = range(1, num_clusters + 1)
+    if cache is not None:
+        clusters = cache.dirty_clusters(membership, clusters)
+        logging.info("computing row scores for %d of %d clusters",
+                     len(clusters), num_clusters)
+
     start_time = util.current_millis()
-    cluster_row_scores = __compute_row_scores_for_clusters(
-        membership, matrix, num_clusters, use_multiprocessing)
+    if vectorized:
+        cluster_row_scores = __compute_row_scores_vectorized(
+            membership, matrix, clusters).T
+    else:
+        cluster_row_scores = __compute_row_scores_for_clusters(
+            membership, matrix, clusters, use_multiprocessing, pool)
     # TODO: replace the nan/inf-Values with the quantile-thingy in the R-version
 
     logging.info("__compute_row_scores_for_clusters() in %f s.",
@@ -59,9 +76,16 @@ def compute_row_scores(membership, matrix, num_clusters,
     values = np.zeros((matrix.num_rows, num_clusters))
 
     # note that cluster is 0 based on a matrix
-    for cluster in xrange(num_clusters):
-        row_scores = cluster_row_scores[cluster]
-        values[:, cluster] = row_scores
+    for index, cluster in enumerate(clusters):
+        values[:, cluster - 1] = cluster_row_scores[index]
+        if cache is not None:
+            cache.put(cluster, values[:, cluster - 1].copy())
+    if cache is not None and len(clusters) < num_clusters:
+        computed = set(clusters)
+        for cluster in xrange(1, num_clusters + 1):
+            if cluster not in computed:
+                values[:, cluster - 1] = cache.get(cluster)
+
     result = dm.DataMatrix(matrix.num_rows, num_clusters,
                            row_names=matrix.row_names,
                            values=values)
@@ -69,12 +93,39 @@ def compute_row_scores(membership, matrix, num_clusters,
                  (util.current_millis() - start_time) / 1000.0)
     return result
 
+
+def __compute_row_scores_vectorized(membership, matrix, clusters):
+    """computes the row scores for the specified clusters, the result is
+    a |rows| x |clusters| array. The cluster blocks are selected by index
+    instead of building submatrices, the squared distances of the rows to
+    the cluster's column means are computed on each block with the same
+    operations as __compute_row_scores_for_submatrix(), so the results are
+    identical to the submatrix based ones"""
+    values = np.empty((matrix.num_rows, len(clusters)))
+    values.fill(np.nan)
+    for index, cluster in enumerate(clusters):
+        col_indexes = matrix.sorted_indexes_for(
+            membership.columns_for_cluster(cluster), matrix.column_indexes_for)
+        # clusters with less than 2 columns are not scored
+        if len(col_indexes) <= 1:
+            continue
+        row_indexes = matrix.sorted_indexes_for(
+            membership.rows_for_cluster(cluster), matrix.row_indexes_for)
+        # select the blocks like submatrix_by_name(), the memory layout
+        # determines the summation order of the means
+        colmeans = util.column_means(
+            matrix.values[row_indexes][:, col_indexes])
+        row_means = util.row_means(
+            np.square(matrix.values[:, col_indexes] - colmeans))
+        values[:, index] = np.log(np.clip(row_means, 1e-20, 1000.0) + 1e-99)
+    return values
+
 ROW_SCORE_MATRIX = None
 ROW_SCORE_MEMBERSHIP = None
 
 
-def __compute_row_scores_for_clusters(membership, matrix, num_clusters,
-                                      use_multiprocessing):
+def __compute_row_scores_for_clusters(membership, matrix, clusters,
+                                      use_multiprocessing, pool):
     """compute the pure row scores for the specified clusters
     without nowmalization"""
     # note that we set the data into globals before we fork it off
@@ -84,13 +135,14 @@ def __compute_row_scores_for_clusters(membership, matrix, num_clusters,
     ROW_SCORE_MEMBERSHIP = membership
 
     if use_multiprocessing:
-        pool = mp.Pool()
-        result = pool.map(compute_row_scores_for_cluster, xrange(1, num_clusters + 1))
-        pool.close()
-        pool.join()
+        if pool is not None:
+            pool.share(__name__, 'ROW_SCORE_MATRIX', matrix, readonly=True)
+            pool.share(__name__, 'ROW_SCORE_MEMBERSHIP', membership)
+        result = workerpool.pool_map(pool, compute_row_scores_for_cluster,
+                                     clusters)
     else:
         result = []
-        for cluster in range(1, num_clusters + 1):
+        for cluster in clusters:
             result.append(compute_row_scores_for_cluster(cluster))
     # cleanup
     ROW_SCORE_MATRIX = None
@@ -141,6 +193,7 @@ class RowScoringFunction(scoring.ScoringFunctionBase):
                                              schedule,
                                              config_params)
         self.run_log = scoring.RunLog("row_scoring", config_params)
+        self.score_cache = scoring.ClusterScoreCache(scoring.row_column_versions)
 
     def name(self):
         """returns the name of this scoring function"""
@@ -151,7 +204,11 @@ class RowScoringFunction(scoring.ScoringFunctionBase):
         return compute_row_scores(self.membership,
                                   self.ratios,
                                   self.num_clusters(),
-                                  self.config_params[scoring.KEY_MULTIPROCESSING])
+                                  self.config_params[scoring.KEY_MULTIPROCESSING],
+                                  self.pool,
+                                  self.config_params.get(
+                                      KEY_VECTORIZED_ROW_SCORING, False),
+                                  self.score_cache)
 
     def run_logs(self):
         """return the run logs"""
@@ -103,7 +103,7 @@ def make_operon_pairs(operon, features):
     # for, and ignore the rest
     available_operon_genes = []
     for gene in operon:
-        if gene in features.keys():
+        if gene in features:
             available_operon_genes.append(gene)
         else:
             logging.warn("Microbes Online operon gene '%s' not found in " +
@@ -134,21 +134,27 @@ def make_operon_pairs(operon, features):
 
 
 def build_operons(names1, names2):
-    """build the list of operons given two name lists"""
-    def first_row_containing(alist, aname):
-        """returns in a list containing the specified name"""
-        for row in alist:
-            if aname in row:
-                return row
-        return None
-
+    """build the list of operons given two name lists. names2[i] is added
+    to the first operon that contains names1[i], if there is none,
+    [names1[i], names2[i]] starts a new operon. Operons that are linked
+    by a later pair are not merged. The first operon of each name is
+    kept in a dictionary instead of scanning the operons for every pair"""
     operons = []
-    for i in range(len(names1)):
-        found = first_row_containing(operons, names1[i])
-        if found:
-            found.append(names2[i])
+    first_operon = {}
+
+    def add_name(name, index):
+        """adds name to the operon at index"""
+        operons[index].append(name)
+        if first_operon.get(name, index) >= index:
+            first_operon[name] = index
+
+    for name1, name2 in zip(names1, names2):
+        if name1 in first_operon:
+            add_name(name2, first_operon[name1])
         else:
-            operons.append([names1[i], names2[i]])
+            operons.append([])
+            add_name(name1, len(operons) - 1)
+            add_name(name2, len(operons) - 1)
     return operons
 
 
@@ -160,10 +166,14 @@ def __make_operons_from_predictions(predictions, organism):
         """builds the gene name lists from the predictions"""
         names1 = []
         names2 = []
+        seen1 = set()
+        seen2 = set()
         for prediction in predictions:
-            if prediction[0] not in names1:
+            if prediction[0] not in seen1:
+                seen1.add(prediction[0])
                 names1.append(prediction[0])
-            if prediction[1] not in names2:
+            if prediction[1] not in seen2:
+                seen2.add(prediction[1])
                 names2.append(prediction[1])
         return names1, names2
 
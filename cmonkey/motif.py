@@ -7,7 +7,8 @@ This file is part of cMonkey Python. Please see README and LICENSE for
 more information and licensing details.
 """
 import logging
-import multiprocessing as mp
+import workerpool
+import jobscheduler
 import numpy as np
 import scoring
 import datamatrix as dm
@@ -19,6 +20,7 @@ import util
 import os
 import cPickle
 import collections
+import checkpoint as ckpt
 
 ComputeScoreParams = collections.namedtuple('ComputeScoreParams',
                                             ['iteration',
@@ -40,9 +42,11 @@ def unique_filter(seqs, feature_ids):
     """returns a map that contains only the keys that are in
     feature_ids and only contains unique sequences"""
     unique_seqs = {}
+    seen = set()
     for feature_id in feature_ids:
-        if feature_id in seqs and seqs[feature_id] not in unique_seqs.values():
+        if feature_id in seqs and seqs[feature_id] not in seen:
             unique_seqs[feature_id] = seqs[feature_id]
+            seen.add(seqs[feature_id])
     return unique_seqs
 
 
@@ -60,9 +64,8 @@ def get_remove_atgs_filter(distance):
         """a filter removes the ATG's from the sequence, this
         just masks a window of 4 letters with N's"""
         for feature_id in seqs:
-            chars = [c for c in seqs[feature_id]]
-            chars[distance[1]:distance[1] + 4] = "NNNN"
-            seqs[feature_id] = "".join(chars)
+            seq = seqs[feature_id]
+            seqs[feature_id] = seq[:distance[1]] + "NNNN" + seq[distance[1] + 4:]
         return seqs
     return remove_atgs_filter
 
@@ -82,7 +85,6 @@ def compute_mean_score(pvalue_matrix, membership, organism):
 
 # Readonly structure to avoid passing it to the forked child processes for efficiency.
 # non-serializable parameters go here, too
-MOTIF_PARAMS = None
 SEQUENCE_FILTERS = None
 ORGANISM = None
 MEMBERSIP = None
@@ -137,12 +139,13 @@ class MotifScoringFunctionBase(scoring.ScoringFunctionBase):
         self.all_pvalues = None
         self.last_result = None
 
+        self.job_scheduler = make_job_scheduler(config_params)
+
         self.update_log = scoring.RunLog("motif-score-" + seqtype, config_params)
         self.motif_log = scoring.RunLog("motif-motif-" + seqtype, config_params)
 
         used_genes = sorted(ratios.row_names)
-        self.used_seqs = organism.sequences_for_genes_scan(
-            used_genes, seqtype=self.seqtype)
+        self.used_seqs = organism.scan_sequences(used_genes, self.seqtype)
 
         logging.info("building reverse map...")
         start_time = util.current_millis()
@@ -153,6 +156,10 @@ class MotifScoringFunctionBase(scoring.ScoringFunctionBase):
     def run_logs(self):
         return [self.update_log, self.motif_log]
 
+    def cleanup(self):
+        """removes the files that the MEME suite shares between runs"""
+        self.meme_suite.cleanup()
+
     def __build_reverse_map(self, ratios):
         """build a map that reconstructs the original row name from
         a feature id"""
@@ -197,6 +204,43 @@ class MotifScoringFunctionBase(scoring.ScoringFunctionBase):
     def last_cached(self):
         return self.last_result
 
+    def __checkpoint_key(self):
+        """the key prefix of the checkpoint data, there can be a motif
+        scoring function for each sequence type"""
+        return '%s.%s' % (self.name(), self.seqtype)
+
+    def store_checkpoint_data(self, checkpoint):
+        """stores the last scores and motif results, so the next motif
+        run can be seeded with them"""
+        key = self.__checkpoint_key()
+        if self.last_result is not None:
+            checkpoint.put_matrix(key, self.last_result)
+        checkpoint.put_value(key + '.pvalues', self.all_pvalues)
+        if self.__last_motif_infos is not None:
+            checkpoint.put_value(key + '.motif_infos', {
+                    cluster: [motif_info_json(motif_info)
+                              for motif_info in motif_infos]
+                    for cluster, motif_infos in self.__last_motif_infos.items()})
+        checkpoint.put_value(key + '.iteration_result', {
+                cluster: result
+                for cluster, result in self.__last_iteration_result.items()
+                if cluster != 'iteration'})
+
+    def restore_checkpoint_data(self, checkpoint):
+        """restores the last scores and motif results"""
+        key = self.__checkpoint_key()
+        self.last_result = checkpoint.get_matrix(key)
+        all_pvalues = checkpoint.get_value(key + '.pvalues')
+        if all_pvalues is not None:
+            self.all_pvalues = ckpt.int_keys(all_pvalues)
+        motif_infos = checkpoint.get_value(key + '.motif_infos')
+        if motif_infos is not None:
+            self.__last_motif_infos = {
+                cluster: [make_motif_info(info) for info in infos]
+                for cluster, infos in ckpt.int_keys(motif_infos).items()}
+        self.__last_iteration_result = ckpt.int_keys(
+            checkpoint.get_value(key + '.iteration_result', {}))
+
     def matrix_pickle_path(self):
         return "%s/%s_matrix_last.pkl" % (self.config_params['output_dir'],
                                           self.name())
@@ -256,13 +300,11 @@ class MotifScoringFunctionBase(scoring.ScoringFunctionBase):
         (seqs, feature_ids, distance) -> seqs
         These filters are applied in the order they appear in the list.
         """
-        global MOTIF_PARAMS, SEQUENCE_FILTERS, ORGANISM, MEMBERSHIP
+        global SEQUENCE_FILTERS, ORGANISM, MEMBERSHIP
 
         cluster_pvalues = {}
         min_cluster_rows_allowed = self.config_params['memb.min_cluster_rows_allowed']
         max_cluster_rows_allowed = self.config_params['memb.max_cluster_rows_allowed']
-        use_multiprocessing = self.config_params[
-            scoring.KEY_MULTIPROCESSING]
 
         # extract the sequences for each cluster, slow
         start_time = util.current_millis()
@@ -270,10 +312,13 @@ class MotifScoringFunctionBase(scoring.ScoringFunctionBase):
         ORGANISM = self.organism
         MEMBERSHIP = self.membership
 
-        pool = mp.Pool()
         cluster_seqs_params = [(cluster, self.seqtype)
                                for cluster in xrange(1, self.num_clusters() + 1)]
-        seqs_list = pool.map(cluster_seqs, cluster_seqs_params)
+        if self.pool is not None:
+            self.pool.share(__name__, 'SEQUENCE_FILTERS', SEQUENCE_FILTERS, readonly=True)
+            self.pool.share(__name__, 'ORGANISM', ORGANISM, readonly=True)
+            self.pool.share(__name__, 'MEMBERSHIP', MEMBERSHIP)
+        seqs_list = workerpool.pool_map(self.pool, cluster_seqs, cluster_seqs_params)
         SEQUENCE_FILTERS = None
         ORGANISM = None
         MEMBERSHIP = None
@@ -312,44 +357,35 @@ class MotifScoringFunctionBase(scoring.ScoringFunctionBase):
             if not cluster in iteration_result:
                 iteration_result[cluster] = {}
 
-        # compute and store motif results
-        MOTIF_PARAMS = params
+        # compute and store motif results, the external tools are run
+        # by the job scheduler, the clusters with the most sequences first
+        start_time = util.current_millis()
         self.__last_motif_infos = {}
-        if use_multiprocessing:
-            pool = mp.Pool()
-            results = pool.map(compute_cluster_score, xrange(1, self.num_clusters() + 1))
-
-            for cluster in xrange(1, self.num_clusters() + 1):
-                pvalues, run_result = results[cluster - 1]
-                cluster_pvalues[cluster] = pvalues
-                if run_result:
-                    self.__last_motif_infos[cluster] = run_result.motif_infos
-                iteration_result[cluster]['motif-info'] = meme_json(run_result)
-                iteration_result[cluster]['pvalues'] = pvalues
-            pool.close()
-            pool.join()
-        else:
-            for cluster in xrange(1, self.num_clusters() + 1):
-                pvalues, run_result = compute_cluster_score(cluster)
-                cluster_pvalues[cluster] = pvalues
-                if run_result:
-                    self.__last_motif_infos[cluster] = run_result.motif_infos
-                iteration_result[cluster]['motif-info'] = meme_json(run_result)
-                iteration_result[cluster]['pvalues'] = pvalues
-
-        # cleanup
-        MOTIF_PARAMS = None
+        results = self.job_scheduler.run(
+            [cluster_score_job(cluster_params) for cluster_params in params],
+            sizes=[len(cluster_params.seqs) for cluster_params in params])
+        logging.info("ran motif finding in %d ms.",
+                     util.current_millis() - start_time)
+
+        for cluster in xrange(1, self.num_clusters() + 1):
+            pvalues, run_result = results[cluster - 1]
+            cluster_pvalues[cluster] = pvalues
+            if run_result:
+                self.__last_motif_infos[cluster] = run_result.motif_infos
+            iteration_result[cluster]['motif-info'] = meme_json(run_result)
+            iteration_result[cluster]['pvalues'] = pvalues
         return cluster_pvalues
 
 
 def cluster_seqs(params):
-    """Retrieves the sequences for a cluster. Designed to run in in pool.map()"""
+    """Retrieves the sequences for a cluster. Designed to run in in pool.map()
+    The sequences are looked up in the organism's precomputed sequence
+    tables, only the filters are applied per cluster"""
     global SEQUENCE_FILTERS, ORGANISM, MEMBERSHIP
     cluster, seqtype = params
     genes = sorted(MEMBERSHIP.rows_for_cluster(cluster))
     feature_ids = ORGANISM.feature_ids_for(genes)
-    seqs = ORGANISM.sequences_for_genes_search(
-        feature_ids, seqtype=seqtype)
+    seqs = ORGANISM.search_sequences(feature_ids, seqtype)
     for sequence_filter in SEQUENCE_FILTERS:
         seqs = sequence_filter(seqs, feature_ids)
     if len(seqs) == 0:
@@ -358,6 +394,23 @@ def cluster_seqs(params):
     return (seqs, feature_ids)
 
 
+def motif_info_json(motif_info):
+    """the attributes of a MemeMotifInfo as a JSON object"""
+    return {'pssm': motif_info.pssm, 'motif_num': motif_info.motif_num,
+            'width': motif_info.width, 'num_sites': motif_info.num_sites,
+            'llr': motif_info.llr, 'evalue': motif_info.evalue,
+            'sites': motif_info.sites}
+
+
+def make_motif_info(json_object):
+    """creates a MemeMotifInfo from the result of motif_info_json()"""
+    return meme.MemeMotifInfo([list(row) for row in json_object['pssm']],
+                              json_object['motif_num'], json_object['width'],
+                              json_object['num_sites'], json_object['llr'],
+                              json_object['evalue'],
+                              [tuple(site) for site in json_object['sites']])
+
+
 def meme_json(run_result):
     result = []
     if run_result is not None:
@@ -389,23 +442,36 @@ def meme_json(run_result):
     return result
 
 
-def compute_cluster_score(cluster):
-    """This function computes the MEME score for a cluster"""
-    global MOTIF_PARAMS
-    params = MOTIF_PARAMS[cluster - 1]
+def make_job_scheduler(config_params):
+    """creates the scheduler for the external motif finding tools"""
+    if config_params.get(scoring.KEY_MULTIPROCESSING, False):
+        max_processes = config_params.get('motif_max_jobs', None)
+    else:
+        max_processes = 1
+    return jobscheduler.JobScheduler(max_processes,
+                                     config_params.get('motif_job_timeout', None),
+                                     config_params.get('motif_job_retries', 1))
+
+
+def cluster_score_job(params):
+    """This job computes the MEME score for a cluster, it yields the
+    pvalues and the run result"""
     pvalues = {}
     run_result = None
     nseqs = len(params.seqs)
     logging.info('Cluster %d, # sequences: %d', params.cluster, nseqs)
     if (nseqs >= params.min_cluster_rows and nseqs <= params.max_cluster_rows):
-        run_result = params.meme_runner(params)
-        pe_values = run_result.pe_values
-        for feature_id, pvalue, evalue in pe_values:
-            pvalues[feature_id] = pvalue
+        try:
+            run_result = yield params.meme_runner.job(params)
+        except jobscheduler.JobTimeout, e:
+            logging.warn("skipping cluster %d: %s", params.cluster, str(e))
+        if run_result is not None:
+            for feature_id, pvalue, evalue in run_result.pe_values:
+                pvalues[feature_id] = pvalue
     else:
         logging.info("# seqs (= %d) outside of defined limits, "
                      "skipping cluster %d", len(params.seqs), params.cluster)
-    return pvalues, run_result
+    yield pvalues, run_result
 
 
 class MemeScoringFunction(MotifScoringFunctionBase):
@@ -484,53 +550,51 @@ class WeederRunner:
 
     def __call__(self, params):
         """call the runner like a function"""
+        return jobscheduler.run_job(self.job(params))
+
+    def job(self, params):
+        """the Weeder and MAST run as a job, yields the MemeRunResult"""
         with tempfile.NamedTemporaryFile(prefix='weeder.fasta',
                                          delete=False) as outfile:
             filename = outfile.name
             logging.info("Run Weeder on FASTA file: '%s'", filename)
             st.write_sequences_to_fasta_file(outfile, params.seqs.items())
 
-        pssms = weeder.run_weeder(filename)
-        meme_outfile = '%s.meme' % filename
-        dbfile = self.meme_suite.make_sequence_file(
-            [(feature_id, locseq[1])
-             for feature_id, locseq in params.used_seqs.items()])
-        logging.info("# PSSMS created: %d %s", len(pssms), str([i.consensus_motif() for i in pssms]))
-        logging.info("run MAST on '%s'", meme_outfile)
-
-        motif_infos = []
-        for i in xrange(len(pssms)):
-            pssm = pssms[i]
-            motif_infos.append(meme.MemeMotifInfo(pssm.values, i + 1,
-                                                  pssm.sequence_length(),
-                                                  len(pssm.sites),
-                                                  None, pssm.e_value,
-                                                  pssm.sites))
-
         try:
-            mast_out = self.meme_suite.mast(
-                meme_outfile, dbfile,
-                self.meme_suite.global_background_file())
-            pe_values, annotations = meme.read_mast_output(mast_out,
-                                                           params.seqs.keys())
-            return meme.MemeRunResult(pe_values, annotations, motif_infos)
-        except:
-            return meme.MemeRunResult([], {}, [])
+            pssms = yield weeder.run_weeder_job(filename)
+            meme_outfile = '%s.meme' % filename
+            logging.info("# PSSMS created: %d %s", len(pssms), str([i.consensus_motif() for i in pssms]))
+            logging.info("scan the motifs of '%s'", meme_outfile)
+
+            motif_infos = []
+            for i in xrange(len(pssms)):
+                pssm = pssms[i]
+                motif_infos.append(meme.MemeMotifInfo(pssm.values, i + 1,
+                                                      pssm.sequence_length(),
+                                                      len(pssm.sites),
+                                                      None, pssm.e_value,
+                                                      pssm.sites))
+
+            try:
+                pe_values, annotations = yield self.meme_suite.scan_job(
+                    meme_outfile, params.used_seqs,
+                    self.meme_suite.global_background_file(), motif_infos,
+                    params.seqs.keys())
+                result = meme.MemeRunResult(pe_values, annotations, motif_infos)
+            except Exception:
+                result = meme.MemeRunResult([], {}, [])
         finally:
             if self.__remove_tempfiles:
-                for fileExtension in ['', '.wee', '.mix', '.html', '.meme', '.1.f1', '.1.f2', '.2.f1', '.2.f2']:
+                for fileExtension in ['', '.log', '.wee', '.mix', '.html', '.meme', '.1.f1', '.1.f2', '.2.f1', '.2.f2']:
                     tmpName = filename+fileExtension
                     if os.path.exists(tmpName):
                         try:
                             os.remove(tmpName)
                         except:
                             logging.warn("could not remove tmp file:'%s'", tmpName)
-            try:
-                os.remove(dbfile)
-            except:
-                logging.warn("could not remove tmp file:'%s'", dbfile)
             #if self.__background_file==None:
             #    try:
             #        os.remove(bgFile)
             #    except:
             #        logging.warn("could not remove tmp file: '%s'", bgfile)
+        yield result
@@ -5,11 +5,11 @@ This file is part of cMonkey Python. Please see README and LICENSE for
 more information and licensing details.
 """
 import numpy as np
+import scipy.sparse as sparse
 import logging
 import util
 import datamatrix as dm
 import scoring
-import multiprocessing as mp
 import cPickle
 import os.path
 
@@ -28,6 +28,9 @@ class Network:
         self.__compute_edges_with_source()
 
     def __compute_edges_with_source(self):
+        # the edges changed, so the adjacency matrix has to be rebuilt
+        self.__adjacency = None
+        self.__adjacency_genes = None
         self.edges_with_source = {}
         for edge in self.edges:
             if edge[0] not in self.edges_with_source:
@@ -38,25 +41,35 @@ class Network:
             self.edges_with_source[edge[1]].append(edge)
 
     def validate(self, synonyms, genes):
-        # remap first
-        new_edges = []
-        for n0, n1, score in self.edges:
-            n0 = synonyms[n0] if n0 in synonyms else n0
-            n1 = synonyms[n1] if n1 in synonyms else n1
-            new_edges.append((n0, n1, score))
-        self.edges = new_edges
+        """remaps the nodes to their primary names and checks that the
+        network contains enough of the genes"""
+        start_time = util.current_millis()
+        node_names, node1, node2 = index_edges(self.edges)
+        primary_names = [synonyms[name] if name in synonyms else name
+                         for name in node_names]
+        self.edges = [(primary_names[n0], primary_names[n1], edge[2])
+                      for n0, n1, edge in zip(node1, node2, self.edges)]
         self.__compute_edges_with_source()
 
-        # then validate
-        found = []
-        for g in genes:
-            primary = synonyms.get(g, g)
-            for n0, n1, score in self.edges:
-                if primary == n0 or primary == n1:
-                    found.append(primary)
-        if len(found) < len(genes) / 2:
-            print edges
-            raise(Exception("only %d genes found in edges" % len(found)))
+        # each gene is counted once for each edge it is in
+        primary_ids = {}
+        for name in primary_names:
+            primary_ids.setdefault(name, len(primary_ids))
+        id_map = np.array([primary_ids[name] for name in primary_names],
+                          dtype='int64')
+        node1, node2 = id_map[node1], id_map[node2]
+        degrees = (np.bincount(node1, minlength=len(primary_ids)) +
+                   np.bincount(node2[node1 != node2], minlength=len(primary_ids)))
+        num_found = 0
+        for gene in genes:
+            primary_id = primary_ids.get(synonyms.get(gene, gene))
+            if primary_id is not None:
+                num_found += degrees[primary_id]
+        logging.info("validated network '%s' in %f s.", self.name,
+                     (util.current_millis() - start_time) / 1000.0)
+        if num_found < len(genes) / 2:
+            raise(Exception("only %d genes found in edges of network '%s'" %
+                            (num_found, self.name)))
 
     def num_edges(self):
         """returns the number of edges in this graph"""
@@ -84,6 +97,37 @@ class Network:
         else:
             return []
 
+    def adjacency_matrix(self, genes):
+        """returns the network as a symmetric |genes| x |genes| sparse
+        matrix in CSR format, where row and column i correspond to genes[i].
+        Edges with a node that is not in genes are left out, multiple edges
+        between the same nodes are added up. The matrix is cached for the
+        most recently requested gene list"""
+        genes = list(genes)
+        if self.__adjacency is not None and self.__adjacency_genes == genes:
+            return self.__adjacency
+
+        gene_index = {gene: index for index, gene in enumerate(genes)}
+        sources = []
+        targets = []
+        weights = []
+        for n0, n1, score in self.edges:
+            if n0 in gene_index and n1 in gene_index:
+                sources.append(gene_index[n0])
+                targets.append(gene_index[n1])
+                weights.append(score)
+        sources = np.array(sources, dtype='int32')
+        targets = np.array(targets, dtype='int32')
+        weights = np.array(weights, dtype='float64')
+        # the graph is undirected, so each edge is entered in both directions
+        self.__adjacency = sparse.coo_matrix(
+            (np.concatenate((weights, weights)),
+             (np.concatenate((sources, targets)),
+              np.concatenate((targets, sources)))),
+            shape=(len(genes), len(genes))).tocsr()
+        self.__adjacency_genes = genes
+        return self.__adjacency
+
     def __repr__(self):
         return "Network: %s\n# edges: %d\n" % (self.name,
                                                len(self.edges))
@@ -92,43 +136,47 @@ class Network:
     def create(cls, name, edges, weight, organism=None, ratios=None,
                check_size=True):
         """standard Factory method"""
-        logging.info("Network.create() called with %d edges", len(edges))
         if edges is None:
             raise Exception("no edges specified in network '%s'" % name)
-        added = set([])
-        network_edges = []
-        nodes = set()
-        for edge in edges:
-            nodes.add(edge[0])
-            nodes.add(edge[1])
+        logging.info("Network.create() called with %d edges", len(edges))
+        start_time = util.current_millis()
+        node_names, node1, node2 = index_edges(edges)
+        logging.info("indexed %d nodes in %f s.", len(node_names),
+                     (util.current_millis() - start_time) / 1000.0)
+
         """Shrink the number of edges to the ones that are actually usable. These
         are selected by the following considerations:
         # 1. check nodes that are in the thesaurus
         # 2. check gene names that are in the ratios matrix, but not in the network
         # 3. keep the nodes that are in the ratios and are in the thesaurus
         """
-        num_nodes_orig = len(nodes)
+        start_time = util.current_millis()
         if organism:
             thesaurus = organism.thesaurus()
-            nodes = {n for n in nodes if n in thesaurus}
             if ratios:
-                cano_nodes = {thesaurus[n] for n in nodes}
                 cano_genes = {thesaurus[row] for row in ratios.row_names
                               if row in thesaurus}
-                probes_in = [gene for gene in cano_genes if gene in cano_nodes]
-                nodes = {n for n in nodes if thesaurus[n] in probes_in}
-
-        logging.info("# nodes in network '%s': %d (of %d)", name, len(nodes), num_nodes_orig)
-
-        for edge in edges:
-            # we ignore self-edges, and edges with nodes not in the final nodes
-            if edge[0] != edge[1] and (edge[0] in nodes or edge[1] in nodes):
-                key = "%s:%s" % (edge[0], edge[1])
-                key_rev = "%s:%s" % (edge[1], edge[0])
-                if key not in added and key_rev not in added:
-                    network_edges.append(edge)
-                added.add(key)
-                added.add(key_rev)
+                is_node = [n in thesaurus and thesaurus[n] in cano_genes
+                           for n in node_names]
+            else:
+                is_node = [n in thesaurus for n in node_names]
+            is_node = np.array(is_node, dtype='bool')
+        else:
+            is_node = np.ones(len(node_names), dtype='bool')
+        logging.info("# nodes in network '%s': %d (of %d), filtered in %f s.",
+                     name, np.count_nonzero(is_node), len(node_names),
+                     (util.current_millis() - start_time) / 1000.0)
+
+        # we ignore self-edges, and edges with nodes not in the final nodes,
+        # of the edges in both directions, only the first one is kept
+        start_time = util.current_millis()
+        is_edge = (node1 != node2) & (is_node[node1] | is_node[node2])
+        edge_indexes = np.nonzero(is_edge)[0]
+        first = first_unique_edges(node1[edge_indexes], node2[edge_indexes],
+                                   len(node_names))
+        network_edges = [edges[index] for index in edge_indexes[first]]
+        logging.info("removed duplicate edges in %f s.",
+                     (util.current_millis() - start_time) / 1000.0)
 
         if check_size and len(network_edges) < 10:
             raise Exception("Error: only %d edges in network '%s'" % (len(network_edges), name))
@@ -136,34 +184,43 @@ class Network:
         return Network(name, network_edges, weight, 0)
 
 
-COMPUTE_NETWORK = None
-ALL_GENES = None
-NETWORK_SCORE_MEMBERSHIP = None
-
-
-def compute_network_scores(cluster):
-    """Generic method to compute network scores"""
-    global COMPUTE_NETWORK, ALL_GENES, NETWORK_SCORE_MEMBERSHIP
-    network = COMPUTE_NETWORK
-
-    genes = sorted(NETWORK_SCORE_MEMBERSHIP.rows_for_cluster(cluster))
-    gene_scores = {}
-    for gene in genes:
-        edges = network.edges_with_node(gene)
-        for edge in edges:
-            other_gene = edge[0]
-            if other_gene == gene:
-                other_gene = edge[1]
-            if other_gene in ALL_GENES:
-                if other_gene not in gene_scores:
-                    gene_scores[other_gene] = []
-                gene_scores[other_gene].append(edge[2])
-
-    final_gene_scores = {}
-    for gene, scores in gene_scores.items():
-        final_gene_scores[gene] = sum(scores) / len(genes)
-        final_gene_scores[gene] = -np.log(final_gene_scores[gene] + 1)
-    return final_gene_scores
+def index_edges(edges):
+    """assigns an integer id to each node of the edges, returns the node
+    names and the arrays of the source and target ids"""
+    node_ids = {}
+    node1 = np.array([node_ids.setdefault(edge[0], len(node_ids))
+                      for edge in edges], dtype='int64')
+    node2 = np.array([node_ids.setdefault(edge[1], len(node_ids))
+                      for edge in edges], dtype='int64')
+    node_names = [None] * len(node_ids)
+    for node, node_id in node_ids.iteritems():
+        node_names[node_id] = node
+    return node_names, node1, node2
+
+
+def first_unique_edges(node1, node2, num_nodes):
+    """returns the sorted indexes of the first occurrence of each undirected
+    edge between the integer nodes node1[i] and node2[i]. An edge is
+    encoded as the integer min(node1, node2) * num_nodes + max(node1, node2)"""
+    node1 = np.asarray(node1, dtype='int64')
+    node2 = np.asarray(node2, dtype='int64')
+    keys = np.minimum(node1, node2) * num_nodes + np.maximum(node1, node2)
+    _, first = np.unique(keys, return_index=True)
+    return np.sort(first)
+
+
+def compute_network_scores(adjacency, membership_matrix):
+    """computes the network scores of all genes for a set of clusters at
+    once. adjacency is the |genes| x |genes| adjacency matrix of the
+    network and membership_matrix a boolean |genes| x |clusters| matrix.
+    The score of a gene for a cluster is -log(x + 1), where x is the sum
+    of the weights of its edges into the cluster divided by the cluster
+    size. Genes without edges into a cluster have a score of 0"""
+    cluster_sizes = membership_matrix.sum(axis=0).astype('float64')
+    # empty clusters have no edge sums, avoid the division by zero
+    cluster_sizes[cluster_sizes == 0] = 1.0
+    edge_sums = adjacency.dot(membership_matrix.astype('float64'))
+    return -np.log(edge_sums / cluster_sizes + 1.0)
 
 
 def compute_mean(score_means):
@@ -190,7 +247,11 @@ class ScoringFunction(scoring.ScoringFunctionBase):
                                              schedule,
                                              config_params)
         self.__networks = None
+        self.score_means = {}
         self.run_log = scoring.RunLog("network", config_params)
+        # network name -> ClusterScoreCache, network scores only depend
+        # on the cluster rows
+        self.__score_caches = {}
 
     def name(self):
         """returns the name of this function"""
@@ -199,13 +260,15 @@ class ScoringFunction(scoring.ScoringFunctionBase):
     def run_logs(self):
         return [self.run_log]
 
-    def store_checkpoint_data(self, shelf):
-        """Default implementation does not store checkpoint data"""
-        pass
+    def store_checkpoint_data(self, checkpoint):
+        """stores the cached result and the network score means"""
+        scoring.ScoringFunctionBase.store_checkpoint_data(self, checkpoint)
+        checkpoint.put_value(self.name() + '.score_means', self.score_means)
 
-    def restore_checkpoint_data(self, shelf):
-        """Default implementation does not store checkpoint data"""
-        pass
+    def restore_checkpoint_data(self, checkpoint):
+        """restores the cached result and the network score means"""
+        scoring.ScoringFunctionBase.restore_checkpoint_data(self, checkpoint)
+        self.score_means = checkpoint.get_value(self.name() + '.score_means', {})
 
     def compute(self, iteration_result, ref_matrix=None):
         """overridden compute for storing additional information"""
@@ -231,7 +294,7 @@ class ScoringFunction(scoring.ScoringFunctionBase):
                                      self.gene_names())
         return self.__networks
 
-    def __update_score_means(self, network_scores):
+    def __update_score_means(self, network_scores, membership_matrix):
         """returns the score means, adjusted to the current cluster setup"""
         # a dictionary that holds the network score means for
         # each cluster, separated for each network
@@ -239,7 +302,7 @@ class ScoringFunction(scoring.ScoringFunctionBase):
         if network_scores:
             for network in self.networks():
                 score_means[network.name] = self.__compute_cluster_score_means(
-                    network_scores[network.name])
+                    network_scores[network.name], membership_matrix)
         return compute_mean(score_means)
 
     def do_compute(self, iteration_result, ref_matrix=None):
@@ -247,72 +310,60 @@ class ScoringFunction(scoring.ScoringFunctionBase):
 
         matrix = dm.DataMatrix(len(self.gene_names()), self.num_clusters(),
                                self.gene_names())
+        membership_matrix = self.membership.row_membership_matrix(
+            self.gene_names(), self.num_clusters())
         network_scores = {}
         for network in self.networks():
             logging.info("Compute scores for network '%s', WEIGHT: %f",
                          network.name, network.weight)
             start_time = util.current_millis()
-            network_score = self.__compute_network_cluster_scores(network)
+            network_score = self.__compute_network_cluster_scores(
+                network, membership_matrix)
             network_scores[network.name] = network_score
-            self.__update_score_matrix(matrix, network_score, network.weight)
+            matrix.values += network_score * network.weight
             elapsed = util.current_millis() - start_time
             logging.info("NETWORK '%s' SCORING TIME: %f s.",
                          network.name, (elapsed / 1000.0))
 
         # compute and store score means
-        self.score_means = self.__update_score_means(network_scores)
+        self.score_means = self.__update_score_means(network_scores,
+                                                     membership_matrix)
         matrix.subtract_with_quantile(0.99)
         return matrix
 
-    def __compute_network_cluster_scores(self, network):
-        """computes the cluster scores for the given network"""
-        global COMPUTE_NETWORK, ALL_GENES, NETWORK_SCORE_MEMBERSHIP
-        result = {}
-        use_multiprocessing = self.config_params[
-            scoring.KEY_MULTIPROCESSING]
-        # Set the huge memory objects into globals
-        # These are readonly anyways, but using Manager.list() or something
-        # similar brings this down to a crawl
-        COMPUTE_NETWORK = network
-        ALL_GENES = set(self.gene_names())  # optimization: O(1) lookup
-        NETWORK_SCORE_MEMBERSHIP = self.membership
-
-        if use_multiprocessing:
-            pool = mp.Pool()
-            map_results = pool.map(compute_network_scores, xrange(1, self.num_clusters() + 1))
-            pool.close()
-            pool.join()
-            for cluster in xrange(1, self.num_clusters() + 1):
-                result[cluster] = map_results[cluster - 1]
-        else:
-            for cluster in xrange(1, self.num_clusters() + 1):
-                result[cluster] = compute_network_scores(cluster)
-        # cleanup
-        COMPUTE_NETWORK = None
-        ALL_GENES = None
-        NETWORK_SCORE_MEMBERSHIP = None
+    def __compute_network_cluster_scores(self, network, membership_matrix):
+        """computes the |genes| x |clusters| score matrix for the given
+        network. Only the clusters whose rows changed since the previous
+        call are computed"""
+        num_clusters = self.num_clusters()
+        if network.name not in self.__score_caches:
+            self.__score_caches[network.name] = scoring.ClusterScoreCache(
+                scoring.row_versions)
+        cache = self.__score_caches[network.name]
+        clusters = cache.dirty_clusters(self.membership,
+                                        range(1, num_clusters + 1))
+        logging.info("computing network scores for %d of %d clusters",
+                     len(clusters), num_clusters)
+
+        if len(clusters) > 0:
+            scores = compute_network_scores(
+                network.adjacency_matrix(self.gene_names()),
+                membership_matrix[:, np.array(clusters) - 1])
+            for index, cluster in enumerate(clusters):
+                cache.put(cluster, scores[:, index])
+
+        result = np.zeros((len(self.gene_names()), num_clusters))
+        for cluster in xrange(1, num_clusters + 1):
+            result[:, cluster - 1] = cache.get(cluster)
         return result
 
-    def __update_score_matrix(self, matrix, network_score, weight):
-        """add values into the result score matrix"""
-        mvalues = matrix.values
-        gene_names = self.gene_names()
-        for cluster in xrange(1, self.num_clusters() + 1):
-            cluster_genes = set(network_score[cluster].keys())
-            for row_index in xrange(self.ratios.num_rows):
-                gene = gene_names[row_index]
-                if gene in cluster_genes:
-                    weighted_score = network_score[cluster][gene] * weight
-                    mvalues[row_index][cluster - 1] += weighted_score
-
-    def __compute_cluster_score_means(self, network_score):
+    def __compute_cluster_score_means(self, network_score, membership_matrix):
         """compute the score means on the given network score"""
         result = {}
         for cluster in xrange(1, self.num_clusters() + 1):
-            cluster_scores = [network_score[cluster][gene]
-                              if gene in network_score[cluster] else 0.0
-                              for gene in self.rows_for_cluster(cluster)]
-            result[cluster] = util.trim_mean(cluster_scores, 0.05)
+            cluster_scores = network_score[membership_matrix[:, cluster - 1],
+                                           cluster - 1]
+            result[cluster] = util.trim_mean(cluster_scores.tolist(), 0.05)
         return result
 
 
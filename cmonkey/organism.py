@@ -6,8 +6,12 @@ from Microbes Online and RSAT
 This file is part of cMonkey Python. Please see README and LICENSE for
 more information and licensing details.
 """
+import os
 import string
 import logging
+import hashlib
+import cPickle
+import tempfile
 import thesaurus
 import util
 import seqtools as st
@@ -82,7 +86,7 @@ class MicrobeFactory:
                  get_go_taxonomy_id,
                  microbes_online_db,
                  network_factories,
-                 ncbi_code=None):
+                 ncbi_code=None, cache_dir=None):
         """create a OrganismFactory instance"""
         self.__code2kegg_organism = code2kegg_organism
         self.__rsat_mapper = rsat_mapper
@@ -90,6 +94,7 @@ class MicrobeFactory:
         self.__microbes_online_db = microbes_online_db
         self.__network_factories = network_factories
         self.__ncbi_code = ncbi_code
+        self.__cache_dir = cache_dir
 
     def create(self, organism_code, search_distances,
                scan_distances, use_operons=True,
@@ -113,7 +118,8 @@ class MicrobeFactory:
                        search_distances,
                        scan_distances,
                        use_operons,
-                       ratios)
+                       ratios,
+                       self.__cache_dir)
 
 
 class OrganismBase:
@@ -123,6 +129,8 @@ class OrganismBase:
     def __init__(self, code, network_factories, ratios=None):
         """Initialize the base class instance"""
         self.code = code
+        # (seqtype, is_search) -> {gene: (location, sequence)}
+        self.__sequence_tables = {}
         logging.info("Creating networks...")
         self.__networks = []
         for make_network in network_factories:
@@ -143,6 +151,44 @@ class OrganismBase:
         synonyms = self.thesaurus()
         return [synonyms[alias] for alias in gene_aliases if alias in synonyms]
 
+    def precompute_sequences(self, genes, seqtypes):
+        """computes the search and scan sequences of the specified genes
+        for each sequence type once. search_sequences() and
+        scan_sequences() then look the sequences up in these tables"""
+        start_time = util.current_millis()
+        for seqtype in seqtypes:
+            self.__sequence_tables[(seqtype, True)] = (
+                self.sequences_for_genes_search(genes, seqtype=seqtype))
+            self.__sequence_tables[(seqtype, False)] = (
+                self.sequences_for_genes_scan(genes, seqtype=seqtype))
+        logging.info("precomputed sequences of %d genes in %f s.", len(genes),
+                     (util.current_millis() - start_time) / 1000.0)
+
+    def search_sequences(self, genes, seqtype):
+        """like sequences_for_genes_search(), but looks the sequences up
+        in the precomputed table if there is one"""
+        table = self.__sequence_tables.get((seqtype, True))
+        if table is None:
+            return self.sequences_for_genes_search(genes, seqtype=seqtype)
+        return self.__lookup_sequences(table, genes)
+
+    def scan_sequences(self, genes, seqtype):
+        """like sequences_for_genes_scan(), but looks the sequences up
+        in the precomputed table if there is one"""
+        table = self.__sequence_tables.get((seqtype, False))
+        if table is None:
+            return self.sequences_for_genes_scan(genes, seqtype=seqtype)
+        return self.__lookup_sequences(table, genes)
+
+    def __lookup_sequences(self, table, genes):
+        """the tables are keyed by feature id, genes without a sequence
+        are not in them"""
+        result = {}
+        for feature_id in self.feature_ids_for(genes):
+            if feature_id in table:
+                result[feature_id] = table[feature_id]
+        return result
+
 
 class DummyOrganism(OrganismBase):
 
@@ -167,12 +213,15 @@ class Microbe(OrganismBase):
                  go_taxonomy_id, microbes_online_db,
                  network_factories,
                  search_distances, scan_distances,
-                 use_operons=True, ratios=None):
-        """create an Organism instance"""
+                 use_operons=True, ratios=None, cache_dir=None):
+        """create an Organism instance. If cache_dir is specified, the
+        feature index is stored there"""
         # microbe-specific network factories need access to synonyms
         # and rsat info, so initialize them here before the base class
         # init
         self.__synonyms = None  # lazy loaded
+        self.__features = None  # lazy loaded
+        self.__cache_dir = cache_dir
         self.__rsat_info = rsat_info
         self.use_operons = use_operons
         logging.info("RSAT taxonomy id = %s" % rsat_info.taxonomy_id)
@@ -242,10 +291,7 @@ class Microbe(OrganismBase):
 
         def unique_sequences(operon_pairs):
             """Returns the unique sequences for the specified operon pairs"""
-            unique_feature_ids = []
-            for _, head in operon_pairs:
-                if head not in unique_feature_ids:
-                    unique_feature_ids.append(head)
+            unique_feature_ids = set([head for _, head in operon_pairs])
             features = self.__read_features(unique_feature_ids)
             return self.__read_sequences(features, distance,
                                          st.extract_upstream)
@@ -267,10 +313,22 @@ class Microbe(OrganismBase):
         """Returns the operon map for this particular organism.
         Microbes Online works on VNG names, but RSAT is working on
         feature ids, so this function also maps VNG names to feature ids"""
-        if not self.__operon_mappings:
+        def make_operon_map():
+            """computes the operon map from the predictions"""
             pairs = mo.get_operon_pairs(self.__microbes_online_db, self)
             synonyms = self.thesaurus()
-            self.__operon_mappings = {synonyms[gene]: synonyms[head] for head, gene in pairs}
+            return {synonyms[gene]: synonyms[head] for head, gene in pairs}
+
+        if not self.__operon_mappings:
+            # the map depends on the predictions, the features and the
+            # synonyms
+            digest = hashlib.sha1()
+            digest.update(self.__microbes_online_db.get_operon_predictions_for(
+                    self.taxonomy_id()))
+            digest.update(self.__rsatdb().get_features(self.species()))
+            digest.update(self.__rsatdb().get_feature_names(self.species()))
+            self.__operon_mappings = self.__cached('operons', digest.hexdigest(),
+                                                   make_operon_map)
         return self.__operon_mappings
 
     def thesaurus(self):
@@ -286,8 +344,53 @@ class Microbe(OrganismBase):
         return self.__synonyms
 
     def __read_features(self, feature_ids):
-        """Returns a list containing the features for the specified feature
-        ids"""
+        """Returns a dictionary containing the features for the specified
+        feature ids"""
+        features = self.__feature_index()
+        return {feature_id: features[feature_id]
+                for feature_id in feature_ids if feature_id in features}
+
+    def __feature_index(self):
+        """returns the dictionary feature id -> feature of all features.
+        It is built once from the RSAT feature file. With a cache directory,
+        it is stored as a pickle together with the digest of the feature
+        file, so later runs only need to parse the file if it changed"""
+        if self.__features is None:
+            text = self.__rsatdb().get_features(self.species())
+            self.__features = self.__cached(
+                'features', hashlib.sha1(text).hexdigest(),
+                lambda: self.__parse_features(text))
+        return self.__features
+
+    def __cached(self, name, digest, compute):
+        """returns the result of compute(). With a cache directory, the
+        result is stored as a pickle together with the digest of its
+        inputs and reused as long as the digest is the same"""
+        if self.__cache_dir is None:
+            return compute()
+
+        cache_path = os.path.join(self.__cache_dir,
+                                  '%s_%s.pkl' % (self.species(), name))
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'rb') as infile:
+                    cached_digest, result = cPickle.load(infile)
+                if cached_digest == digest:
+                    return result
+            except Exception, e:
+                logging.warn("could not read cached %s '%s': %s", name,
+                             cache_path, str(e))
+
+        result = compute()
+        with tempfile.NamedTemporaryFile(dir=self.__cache_dir, prefix=name,
+                                         delete=False) as outfile:
+            cPickle.dump((digest, result), outfile, cPickle.HIGHEST_PROTOCOL)
+        os.rename(outfile.name, cache_path)
+        return result
+
+    def __parse_features(self, text):
+        """parses the RSAT feature file into a dictionary feature id ->
+        feature"""
 
         def read_feature(line):
             """Creates and adds a feature and associated contig from current
@@ -306,12 +409,9 @@ class Microbe(OrganismBase):
                                           is_reverse))
 
         features = {}
-        dfile = util.dfile_from_text(
-            self.__rsatdb().get_features(self.species()), comment='--')
+        dfile = util.dfile_from_text(text, comment='--')
         for line in dfile.lines:
-            feature_id = line[0]
-            if feature_id in feature_ids:
-                features[feature_id] = read_feature(line)
+            features[line[0]] = read_feature(line)
         return features
 
     def __rsatdb(self):
@@ -322,13 +422,12 @@ class Microbe(OrganismBase):
         """for each feature, extract and set its sequence"""
         def unique_contigs():
             """extract the unique contigs from the input features"""
-            result = []
-            for feature in features.values():
-                if feature.location.contig not in result:
-                    result.append(feature.location.contig)
-            return result
+            return set([feature.location.contig
+                        for feature in features.values()])
 
         sequences = {}
+        # the RSAT database keeps the contigs memory-mapped, so this does
+        # not read the whole sequences
         contig_seqs = {contig: self.__rsatdb().get_contig_sequence(self.species(), contig)
                        for contig in unique_contigs()}
 
@@ -0,0 +1,310 @@
+# vi: sw=4 ts=4 et:
+"""pssmscan.py - in-process motif scanner
+
+An alternative to running MAST on the MEME output. The motifs found by
+MEME are scanned against the sequence database with NumPy, following
+the scoring scheme of MAST:
+
+- the letter frequencies of a motif are converted into a log-odds
+  matrix against the 0-order background and scaled to integers
+- the p-value of a score is the probability of reaching at least this
+  score in a random sequence, it is computed exactly from the score
+  distribution under the background model
+- the sequence p-value of a motif is derived from the best match
+  in the sequence, strands are combined by taking the better one
+- the combined p-value of a sequence is the probability of the product
+  of the motif sequence p-values (QFAST), the E-value is the combined
+  p-value times the number of sequences in the database
+
+The result has the same format as the one read from the MAST output
+by meme.read_mast_output_xml(), so it can be used as a MemeRunResult.
+
+This file is part of cMonkey Python. Please see README and LICENSE for
+more information and licensing details.
+"""
+import logging
+import numpy as np
+
+
+ALPHABET = 'ACGT'
+# index of the unknown letter in the encoded sequences
+UNKNOWN = 4
+# the scores of a motif column are scaled to integers in [0, SCORE_RANGE]
+SCORE_RANGE = 100
+# pseudocount added to the motif frequencies relative to the number of
+# sites, as in the MEME log-odds matrices
+MOTIF_PSEUDOCOUNT = 0.01
+
+# defaults that match the MAST parameters used by cMonkey
+MAX_HIT_PVALUE = 0.99
+MAX_MOTIF_EVALUE = 99999.0
+MAX_CORRELATION = 0.6
+
+
+def read_background_frequencies(bgfile_path):
+    """reads the 0-order letter frequencies from a MEME background file"""
+    frequencies = {}
+    with open(bgfile_path) as infile:
+        for line in infile:
+            if line.startswith('#'):
+                continue
+            row = line.split()
+            if len(row) == 2 and len(row[0]) == 1 and row[0].upper() in ALPHABET:
+                frequencies[row[0].upper()] = float(row[1])
+    total = sum(frequencies.values())
+    return np.array([frequencies.get(letter, 0.0) / total
+                     for letter in ALPHABET])
+
+
+def encode(seq):
+    """encodes a sequence into an array of letter indexes, letters that
+    are not in the alphabet are encoded as UNKNOWN"""
+    codes = np.empty(256, dtype='int8')
+    codes.fill(UNKNOWN)
+    for index, letter in enumerate(ALPHABET):
+        codes[ord(letter)] = index
+        codes[ord(letter.lower())] = index
+    return codes[np.frombuffer(seq, dtype='uint8')]
+
+
+class SequenceDatabase:
+    """The scanned sequences, encoded and concatenated into one array, so
+    all windows can be scored at once. starts[i] is the start of
+    sequence i in the array"""
+
+    def __init__(self, seqs):
+        """creates the database from a list of (name, sequence) pairs"""
+        self.names = [name for name, _ in seqs]
+        self.lengths = np.array([len(seq) for _, seq in seqs], dtype='int64')
+        self.starts = np.zeros(len(seqs), dtype='int64')
+        if len(seqs) > 0:
+            self.starts[1:] = np.cumsum(self.lengths)[:-1]
+        self.codes = encode(''.join(seq for _, seq in seqs))
+        # the sequence index of each position
+        self.seq_indexes = np.repeat(np.arange(len(seqs)), self.lengths)
+
+    def best_window_pvalues(self, window_pvalues, width):
+        """returns the smallest p-value of the windows that lie within
+        each sequence and the number of these windows"""
+        num_windows = self.lengths - width + 1
+        pvalues = np.ones(len(self.codes))
+        if len(window_pvalues) > 0:
+            seq_indexes = self.seq_indexes[:len(window_pvalues)]
+            offsets = np.arange(len(window_pvalues)) - self.starts[seq_indexes]
+            inside = offsets < num_windows[seq_indexes]
+            pvalues[:len(window_pvalues)][inside] = window_pvalues[inside]
+        nonempty = self.lengths > 0
+        best = np.ones(len(self.names))
+        best[nonempty] = np.minimum.reduceat(pvalues, self.starts[nonempty])
+        best[num_windows <= 0] = 1.0
+        return best, np.maximum(num_windows, 0)
+
+    def num_sequences(self):
+        """returns the number of sequences"""
+        return len(self.names)
+
+
+class ScaledMotif:
+    """a motif as a scaled integer score matrix with an additional column
+    for unknown letters. pvalues[s] is the probability of a score >= s at
+    a position of a random sequence"""
+
+    def __init__(self, motif_info, bg_freqs):
+        """creates the scaled motif from a MemeMotifInfo"""
+        self.motif_num = motif_info.motif_num
+        self.evalue = motif_info.evalue
+        freqs = np.array(motif_info.pssm, dtype='float64')
+        num_sites = motif_info.num_sites if motif_info.num_sites else 1
+        freqs = ((freqs * num_sites + MOTIF_PSEUDOCOUNT * bg_freqs) /
+                 (num_sites + MOTIF_PSEUDOCOUNT))
+        self.log_odds = np.log2(freqs / bg_freqs)
+        self.width = self.log_odds.shape[0]
+
+        offset = self.log_odds.min()
+        spread = self.log_odds.max() - offset
+        scale = SCORE_RANGE / spread if spread > 0 else 0.0
+        scores = np.rint((self.log_odds - offset) * scale).astype('int64')
+        unknown_scores = np.rint(np.dot(scores, bg_freqs)).astype('int64')
+        self.scores = np.column_stack((scores, unknown_scores))
+        # the reverse complement: reverse the columns, swap A/T and C/G
+        self.rc_scores = self.scores[::-1][:, [3, 2, 1, 0, UNKNOWN]]
+        self.pvalues = score_pvalues(scores, bg_freqs)
+
+
+def score_pvalues(scores, bg_freqs):
+    """computes the distribution of the sum of the column scores of a
+    scaled score matrix for sequences generated from the background model
+    and returns the upper tail probabilities"""
+    max_score = int(scores.max(axis=1).sum())
+    pdf = np.zeros(max_score + 1)
+    pdf[0] = 1.0
+    for column in scores:
+        next_pdf = np.zeros(max_score + 1)
+        for letter in xrange(len(ALPHABET)):
+            score = column[letter]
+            next_pdf[score:] += pdf[:max_score + 1 - score] * bg_freqs[letter]
+        pdf = next_pdf
+    return np.minimum(np.cumsum(pdf[::-1])[::-1], 1.0)
+
+
+def window_scores(scores, codes, width):
+    """scores all windows of the encoded sequence array. The convolution
+    of the one-hot encoded sequence with the score matrix is a lookup of
+    the letter scores of each column"""
+    num_windows = len(codes) - width + 1
+    if num_windows <= 0:
+        return np.zeros(0, dtype='int64')
+    result = np.zeros(num_windows, dtype='int64')
+    for column in xrange(width):
+        result += scores[column][codes[column:column + num_windows]]
+    return result
+
+
+def motif_correlation(motif1, motif2):
+    """the highest average correlation of the aligned log-odds columns
+    over all offsets and both strands of motif2"""
+    def column_correlations(columns1, columns2):
+        """the Pearson correlations of the aligned columns"""
+        centered1 = columns1 - columns1.mean(axis=1)[:, np.newaxis]
+        centered2 = columns2 - columns2.mean(axis=1)[:, np.newaxis]
+        norms = np.sqrt((centered1 ** 2).sum(axis=1) * (centered2 ** 2).sum(axis=1))
+        norms[norms == 0] = np.inf
+        return (centered1 * centered2).sum(axis=1) / norms
+
+    short, long_ = motif1.log_odds, motif2.log_odds
+    if short.shape[0] > long_.shape[0]:
+        short, long_ = long_, short
+    width = short.shape[0]
+    best = -1.0
+    for other in [long_, long_[::-1][:, ::-1]]:
+        for offset in xrange(other.shape[0] - width + 1):
+            corr = column_correlations(short, other[offset:offset + width]).mean()
+            best = max(best, corr)
+    return best
+
+
+def select_motifs(motif_infos, bg_freqs, max_motif_evalue=MAX_MOTIF_EVALUE,
+                  max_correlation=MAX_CORRELATION):
+    """scales the motifs and leaves out the ones with a high E-value and
+    the ones that are too similar to a motif with a better E-value,
+    like MAST does with -mev and -remcorr"""
+    motifs = [ScaledMotif(motif_info, bg_freqs) for motif_info in motif_infos
+              if motif_info.evalue is None or motif_info.evalue <= max_motif_evalue]
+    by_evalue = sorted(motifs, key=lambda motif: motif.evalue)
+    selected = []
+    for motif in by_evalue:
+        if all(motif_correlation(motif, other) <= max_correlation
+               for other in selected):
+            selected.append(motif)
+        else:
+            logging.info("motif %d is too similar to another motif, ignored",
+                         motif.motif_num)
+    return sorted(selected, key=lambda motif: motif.motif_num)
+
+
+def combined_pvalues(seq_pvalues):
+    """the probability that the product of k uniform p-values is at most
+    the product of the k p-values in each row (QFAST)"""
+    num_motifs = seq_pvalues.shape[1]
+    product = seq_pvalues.prod(axis=1)
+    with np.errstate(divide='ignore'):
+        minus_log = -np.log(product)
+    result = np.zeros(len(product))
+    term = np.ones(len(product))
+    for i in xrange(num_motifs):
+        if i > 0:
+            term = term * minus_log / i
+        result += term
+    result = product * result
+    result[product == 0.0] = 0.0
+    return np.minimum(result, 1.0)
+
+
+def one_minus_power(pvalues, exponents):
+    """computes 1 - (1 - p)^n without losing the small p-values, a
+    p-value of 1 stays 1"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = -np.expm1(exponents * np.log1p(-pvalues))
+    return np.where(pvalues >= 1.0, 1.0, result)
+
+
+def scan(motif_infos, database, bg_freqs, genes, use_revcomp=True,
+         max_seq_evalue=None, max_motif_evalue=MAX_MOTIF_EVALUE,
+         max_hit_pvalue=MAX_HIT_PVALUE):
+    """scans the sequence database with the motifs of a MEME run.
+    Returns a pair (pevalues, annotations) like read_mast_output_xml():
+    - pevalues is [(gene, pval, eval)] for the sequences with an E-value
+      of at most max_seq_evalue, ordered by p-value
+    - annotations is a dictionary gene -> [(pval, pos, motifnum)] with the
+      best non-overlapping hits in the sequences of genes, positions
+      follow the convention of the XML reader"""
+    motifs = select_motifs(motif_infos, bg_freqs, max_motif_evalue)
+    if len(motifs) == 0 or database.num_sequences() == 0:
+        return [], {}
+
+    num_seqs = database.num_sequences()
+    seq_pvalues = np.ones((num_seqs, len(motifs)))
+    # (motif, best scores per window, p-values per window)
+    window_results = []
+    for motif_index, motif in enumerate(motifs):
+        forward = window_scores(motif.scores, database.codes, motif.width)
+        if use_revcomp:
+            reverse = window_scores(motif.rc_scores, database.codes, motif.width)
+            position_pvalues = motif.pvalues[np.maximum(forward, reverse)]
+            # the better of two strands
+            position_pvalues = one_minus_power(position_pvalues, 2)
+        else:
+            reverse = None
+            position_pvalues = motif.pvalues[forward]
+        window_results.append((motif, forward, reverse, position_pvalues))
+
+        best, num_windows = database.best_window_pvalues(position_pvalues,
+                                                         motif.width)
+        seq_pvalues[:, motif_index] = one_minus_power(best, num_windows)
+
+    pvalues = combined_pvalues(seq_pvalues)
+    evalues = pvalues * num_seqs
+
+    pevalues = []
+    annotations = {}
+    genes = set(genes)
+    for seq in np.argsort(pvalues, kind='mergesort'):
+        if max_seq_evalue is not None and evalues[seq] > max_seq_evalue:
+            continue
+        name = database.names[seq]
+        pevalues.append((name, float(pvalues[seq]), float(evalues[seq])))
+        annotations[name] = []
+        if name in genes:
+            annotations[name] = sequence_hits(database, seq, window_results,
+                                              max_hit_pvalue)
+    return pevalues, annotations
+
+
+def sequence_hits(database, seq, window_results, max_hit_pvalue):
+    """selects the best non-overlapping motif matches in a sequence with
+    a p-value below max_hit_pvalue, ordered by position"""
+    start = database.starts[seq]
+    length = database.lengths[seq]
+    candidates = []
+    for motif, forward, reverse, position_pvalues in window_results:
+        num_windows = length - motif.width + 1
+        if num_windows <= 0:
+            continue
+        pvalues = position_pvalues[start:start + num_windows]
+        for pos in np.where(pvalues < max_hit_pvalue)[0]:
+            motif_num = motif.motif_num
+            if reverse is not None and reverse[start + pos] > forward[start + pos]:
+                motif_num = -motif_num
+            candidates.append((pvalues[pos], pos, motif.width, motif_num))
+
+    occupied = np.zeros(length, dtype=bool)
+    hits = []
+    for pvalue, pos, width, motif_num in sorted(candidates):
+        if not occupied[pos:pos + width].any():
+            occupied[pos:pos + width] = True
+            # 1-based position + 2 like the XML reader
+            hits.append((float(pvalue), int(pos) + 3, motif_num))
+    return sorted(hits, key=lambda hit: hit[1])
+
+
+__all__ = ['read_background_frequencies', 'SequenceDatabase', 'scan']
@@ -0,0 +1,190 @@
+# vi: sw=4 ts=4 et:
+"""resultdb.py - buffered writes into the cMonkey output database
+
+Writing the results of an iteration row by row, with a connection per
+call, makes SQLite sync the database file for every statement. The
+ResultWriter keeps one connection for the run, collects the rows of an
+iteration and writes them with executemany in a single transaction.
+
+The transaction and other output tasks, like compressing the debug
+files, run in a background thread, so they overlap with the scoring of
+the next iteration. The tasks are run in the order they were submitted,
+at most max_pending tasks are waiting, further submits block until the
+writer caught up.
+
+This file is part of cMonkey Python. Please see README and LICENSE for
+more information and licensing details.
+"""
+import sys
+import Queue
+import logging
+import sqlite3
+import threading
+import util
+
+
+# the number of output tasks that can wait for the writer thread
+MAX_PENDING = 4
+
+
+def number_or_default(value, default):
+    """returns value if SQLite can store it as a number, e.g. a masked
+    numpy value or NaN can not be stored and is replaced by default"""
+    if (isinstance(value, (int, long, float)) and not isinstance(value, bool)
+        and value == value):
+        return value
+    return default
+
+
+class ResultWriter:
+    """Buffers the statements for the output database at path and
+    executes them in one transaction on flush(). The database uses
+    write-ahead logging, so readers are not blocked while cMonkey writes"""
+
+    def __init__(self, path, max_pending=MAX_PENDING):
+        """creates a writer for the database at path"""
+        self.path = path
+        self.__conn = None
+        self.__statements = []
+        self.__rows = {}
+        self.__next_ids = {}
+        # the connection is shared with the writer thread, which holds
+        # the lock while it runs a task
+        self.__lock = threading.RLock()
+        self.__tasks = Queue.Queue(max_pending)
+        self.__thread = None
+        self.__error = None
+
+    def connection(self):
+        """returns the connection of the run, it is opened on first use.
+        Outside of the submitted tasks, it should only be used when there
+        are no pending tasks, see wait()"""
+        with self.__lock:
+            if self.__conn is None:
+                self.__conn = sqlite3.connect(self.path, check_same_thread=False)
+                self.__conn.execute('pragma journal_mode=WAL')
+                self.__conn.execute('pragma synchronous=NORMAL')
+            return self.__conn
+
+    def add(self, sql, params):
+        """buffers a statement with its parameters. Statements are executed
+        in the order of their first use"""
+        self.__buffer(sql).append(params)
+
+    def insert(self, table, columns, values):
+        """buffers a row for the table"""
+        self.insert_many(table, columns, [values])
+
+    def insert_many(self, table, columns, rows):
+        """buffers the rows for the table"""
+        sql = 'insert into %s (%s) values (%s)' % (
+            table, ','.join(columns), ','.join(['?'] * len(columns)))
+        self.__buffer(sql).extend(rows)
+
+    def __buffer(self, sql):
+        """returns the list of buffered parameters for the statement"""
+        if sql not in self.__rows:
+            self.__statements.append(sql)
+            self.__rows[sql] = []
+        return self.__rows[sql]
+
+    def next_id(self, table):
+        """returns the rowid for the next row of the table, so rows that
+        refer to it can be buffered before it is written. The rowid has
+        to be inserted explicitly"""
+        if table not in self.__next_ids:
+            with self.__lock:
+                cursor = self.connection().execute(
+                    'select max(rowid) from %s' % table)
+                max_id = cursor.fetchone()[0]
+                cursor.close()
+            self.__next_ids[table] = 1 if max_id is None else max_id + 1
+        result = self.__next_ids[table]
+        self.__next_ids[table] += 1
+        return result
+
+    def flush_async(self):
+        """writes the buffered statements in one transaction in the
+        writer thread"""
+        if len(self.__statements) == 0:
+            return
+        statements = [(sql, self.__rows[sql]) for sql in self.__statements]
+        self.__statements = []
+        self.__rows = {}
+        self.submit(lambda: self.__execute(statements))
+
+    def flush(self):
+        """writes the buffered statements in one transaction and waits
+        until all output tasks are done"""
+        self.flush_async()
+        self.wait()
+
+    def __execute(self, statements):
+        """executes the statements in one transaction"""
+        start_time = util.current_millis()
+        num_rows = 0
+        conn = self.connection()
+        with conn:
+            for sql, rows in statements:
+                conn.executemany(sql, rows)
+                num_rows += len(rows)
+        logging.info("wrote %d rows to the output database in %f s.", num_rows,
+                     (util.current_millis() - start_time) / 1000.0)
+
+    def submit(self, task):
+        """runs task() in the writer thread after the tasks that were
+        submitted before. If an earlier task failed, its exception is
+        raised here"""
+        self.__raise_error()
+        if self.__thread is None:
+            self.__thread = threading.Thread(target=self.__run,
+                                             name='result writer')
+            self.__thread.daemon = True
+            self.__thread.start()
+        self.__tasks.put(task)
+
+    def __run(self):
+        """the writer thread, runs the tasks until it receives None"""
+        while True:
+            task = self.__tasks.get()
+            try:
+                if task is None:
+                    return
+                with self.__lock:
+                    task()
+            except:
+                logging.exception("error in the result writer")
+                if self.__error is None:
+                    self.__error = sys.exc_info()
+            finally:
+                self.__tasks.task_done()
+
+    def __raise_error(self):
+        """raises the exception of a failed task"""
+        if self.__error is not None:
+            error, self.__error = self.__error, None
+            raise error[0], error[1], error[2]
+
+    def wait(self):
+        """waits until all submitted tasks are done"""
+        if self.__thread is not None:
+            self.__tasks.join()
+        self.__raise_error()
+
+    def close(self):
+        """writes the remaining statements, stops the writer thread and
+        closes the connection"""
+        self.flush_async()
+        if self.__thread is not None:
+            self.__tasks.put(None)
+            self.__thread.join()
+            self.__thread = None
+        with self.__lock:
+            if self.__conn is not None:
+                self.__conn.close()
+                self.__conn = None
+        self.__next_ids = {}
+        self.__raise_error()
+
+
+__all__ = ['ResultWriter', 'number_or_default']
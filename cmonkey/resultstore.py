@@ -0,0 +1,394 @@
+# vi: sw=4 ts=4 et:
+"""resultstore.py - columnar storage of the iteration results
+
+The output database stores the cluster members, the PSSMs and the motif
+annotations as one row per entry, which makes it grow by millions of
+rows in long runs with a high result frequency. The columnar store
+writes the results of an iteration as packed NumPy arrays into a
+compressed file <output_dir>/results/iteration-NNNN.npz:
+
+  row_members, row_member_offsets   the row indexes of cluster k are
+                                    row_members[offsets[k - 1]:offsets[k]]
+  column_members, column_member_offsets
+  residuals                         the residual of cluster k at k - 1
+  motif_*                           one entry per motif, the PSSM rows of
+                                    motif i are
+                                    pssms[pssm_offsets[i]:pssm_offsets[i + 1]]
+  annotation_*, site_*, pvalue_*    the motif annotations, MEME sites and
+                                    gene p-values
+
+The manifest.json file lists the row and column names and the stored
+iterations. The statistics and run information stay in the output
+database.
+
+Both storage formats are read through the same interface, see
+SQLiteResults and ColumnarResults.
+
+This file is part of cMonkey Python. Please see README and LICENSE for
+more information and licensing details.
+"""
+import os
+import re
+import json
+import tempfile
+import numpy as np
+
+
+# the directory of the store in the output directory
+STORE_DIR = 'results'
+MANIFEST_FILE = 'manifest.json'
+ITERATION_FILE_PATTERN = re.compile(r'^iteration-(\d+)\.npz$')
+STORE_VERSION = 1
+
+
+def pack_lists(lists):
+    """packs a list of integer lists into a flat array and an offset array"""
+    offsets = np.zeros(len(lists) + 1, dtype=np.int32)
+    offsets[1:] = np.cumsum([len(alist) for alist in lists])
+    values = np.array([value for alist in lists for value in alist],
+                      dtype=np.int32)
+    return values, offsets
+
+
+def string_array(values):
+    """a NumPy string array, empty lists result in an empty array"""
+    if len(values) == 0:
+        return np.array([], dtype='S1')
+    return np.array(values, dtype=str)
+
+
+def pack_motifs(motifs, gene_indexes):
+    """packs the motif results of an iteration into the motif_*,
+    annotation_*, site_* and pvalue_* arrays"""
+    seqtypes = sorted(motifs.keys())
+    infos = []
+    pssms = []
+    annotations = []
+    sites = []
+    pvalues = []
+    for seqtype_index, seqtype in enumerate(seqtypes):
+        for cluster in sorted(motifs[seqtype].keys()):
+            cluster_motifs = motifs[seqtype][cluster]
+            for motif_info in cluster_motifs['motif-info']:
+                motif_id = len(infos)
+                infos.append((cluster, seqtype_index, motif_info['motif_num'],
+                              motif_info['evalue'], len(motif_info['pssm'])))
+                pssms.extend(motif_info['pssm'])
+                for annotation in motif_info['annotations']:
+                    annotations.append((motif_id,
+                                        gene_indexes[annotation['gene']],
+                                        annotation['position'],
+                                        annotation['reverse'],
+                                        annotation['pvalue']))
+                for site in motif_info['sites']:
+                    sites.append((motif_id,) + tuple(site))
+            for gene, pvalue in cluster_motifs['pvalues'].items():
+                pvalues.append((cluster, seqtype_index, gene_indexes[gene],
+                                pvalue))
+
+    def column(rows, index, dtype):
+        return np.array([row[index] for row in rows], dtype=dtype)
+
+    pssm_offsets = np.zeros(len(infos) + 1, dtype=np.int32)
+    pssm_offsets[1:] = np.cumsum(column(infos, 4, np.int32))
+    return {
+        'seqtypes': string_array(seqtypes),
+        'motif_clusters': column(infos, 0, np.int32),
+        'motif_seqtypes': column(infos, 1, np.int32),
+        'motif_nums': column(infos, 2, np.int32),
+        'motif_evalues': column(infos, 3, np.float64),
+        'pssm_offsets': pssm_offsets,
+        'pssms': np.array(pssms, dtype=np.float64).reshape((len(pssms), 4)),
+        'annotation_motifs': column(annotations, 0, np.int32),
+        'annotation_genes': column(annotations, 1, np.int32),
+        'annotation_positions': column(annotations, 2, np.int32),
+        'annotation_reverse': column(annotations, 3, np.bool_),
+        'annotation_pvalues': column(annotations, 4, np.float64),
+        'site_motifs': column(sites, 0, np.int32),
+        'site_seq_names': string_array([site[1] for site in sites]),
+        'site_reverse': np.array([site[2] == '-' for site in sites],
+                                 dtype=np.bool_),
+        'site_starts': column(sites, 3, np.int32),
+        'site_pvalues': column(sites, 4, np.float64),
+        'site_flank_left': string_array([site[5] for site in sites]),
+        'site_seqs': string_array([site[6] for site in sites]),
+        'site_flank_right': string_array([site[7] for site in sites]),
+        'pvalue_clusters': column(pvalues, 0, np.int32),
+        'pvalue_seqtypes': column(pvalues, 1, np.int32),
+        'pvalue_genes': column(pvalues, 2, np.int32),
+        'pvalues': column(pvalues, 3, np.float64)}
+
+
+def write_atomic(path, write):
+    """calls write() with a temporary file that is renamed to path"""
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path),
+                                     delete=False) as outfile:
+        write(outfile)
+    os.rename(outfile.name, path)
+
+
+class ColumnarResultWriter:
+    """writes the iteration results into the store at store_dir.
+    The iterations of an existing store are kept. The files are written
+    by the submit function, e.g. in a background thread, by default they
+    are written immediately"""
+
+    def __init__(self, store_dir, row_names, column_names, submit=None):
+        """creates a writer for the store"""
+        self.store_dir = store_dir
+        self.__submit = submit
+        if not os.path.exists(store_dir):
+            os.makedirs(store_dir)
+        manifest_path = os.path.join(store_dir, MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as infile:
+                self.__manifest = json.load(infile)
+        else:
+            self.__manifest = {'version': STORE_VERSION,
+                               'row_names': list(row_names),
+                               'column_names': list(column_names),
+                               'iterations': {}}
+
+    def write_iteration(self, iteration, row_members, column_members,
+                        residuals, motifs=None, gene_indexes=None):
+        """writes the results of an iteration. row_members and
+        column_members are the lists of member indexes for each cluster,
+        residuals the list of cluster residuals and motifs the motif
+        results of the iteration, with the genes numbered by gene_indexes"""
+        arrays = {}
+        arrays['row_members'], arrays['row_member_offsets'] = pack_lists(
+            row_members)
+        arrays['column_members'], arrays['column_member_offsets'] = pack_lists(
+            column_members)
+        arrays['residuals'] = np.array(residuals, dtype=np.float64)
+        arrays.update(pack_motifs(motifs if motifs is not None else {},
+                                  gene_indexes))
+
+        filename = 'iteration-%04d.npz' % iteration
+
+        def write():
+            """writes the arrays and adds them to the manifest"""
+            write_atomic(os.path.join(self.store_dir, filename),
+                         lambda outfile: np.savez_compressed(outfile, **arrays))
+            self.__manifest['iterations'][str(iteration)] = filename
+            self.__write_manifest()
+
+        self.__run(write)
+
+    def remove_after(self, iteration):
+        """removes the iterations after the specified one from the store,
+        including iteration files that were written without being added
+        to the manifest"""
+        def remove():
+            """removes the files and their manifest entries"""
+            iterations = self.__manifest['iterations']
+            for key in [key for key in iterations if int(key) > iteration]:
+                del iterations[key]
+            self.__write_manifest()
+            for filename in os.listdir(self.store_dir):
+                match = ITERATION_FILE_PATTERN.match(filename)
+                if match is not None and int(match.group(1)) > iteration:
+                    os.remove(os.path.join(self.store_dir, filename))
+
+        self.__run(remove)
+
+    def __write_manifest(self):
+        """writes the manifest"""
+        write_atomic(os.path.join(self.store_dir, MANIFEST_FILE),
+                     lambda outfile: json.dump(self.__manifest, outfile))
+
+    def __run(self, task):
+        """runs the task with the submit function or immediately"""
+        if self.__submit is not None:
+            self.__submit(task)
+        else:
+            task()
+
+
+class SQLiteResults:
+    """reads the iteration results from the output database"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __query(self, sql, params=()):
+        cursor = self.conn.cursor()
+        cursor.execute(sql, params)
+        result = cursor.fetchall()
+        cursor.close()
+        return result
+
+    def iterations(self):
+        """returns the stored iterations"""
+        return [row[0] for row in self.__query(
+                'select distinct iteration from row_members order by iteration')]
+
+    def rows_for_cluster(self, iteration, cluster):
+        """returns the names of the rows in the cluster"""
+        return [row[0] for row in self.__query(
+                '''select name from row_members m join row_names r
+                   on m.order_num = r.order_num where m.cluster = ?
+                   and iteration = ?''', (cluster, iteration))]
+
+    def columns_for_cluster(self, iteration, cluster):
+        """returns the names of the columns in the cluster"""
+        return [row[0] for row in self.__query(
+                '''select name from column_members m join column_names c
+                   on m.order_num = c.order_num where m.cluster = ?
+                   and iteration = ?''', (cluster, iteration))]
+
+    def cluster_residual(self, iteration, cluster):
+        """returns the residual of the cluster or None"""
+        rows = self.__query('''select residual from cluster_residuals
+                               where cluster = ? and iteration = ?''',
+                            (cluster, iteration))
+        return rows[0][0] if len(rows) > 0 else None
+
+    def motif_infos(self, iteration, cluster=None):
+        """returns the motifs as (motif_id, cluster, seqtype, motif_num,
+        evalue) tuples"""
+        if cluster is None:
+            return self.__query('''select rowid, cluster, seqtype, motif_num,
+                                   evalue from motif_infos where iteration = ?''',
+                                (iteration,))
+        return self.__query('''select rowid, cluster, seqtype, motif_num, evalue
+                               from motif_infos where iteration = ?
+                               and cluster = ?''', (iteration, cluster))
+
+    def motif_pssms(self, iteration):
+        """returns a dictionary from the motif ids to their PSSM rows"""
+        result = {}
+        for motif_id, a, c, g, t in self.__query(
+            '''select motif_info_id, a, c, g, t from motif_pssm_rows
+               where iteration = ? order by motif_info_id, row''', (iteration,)):
+            result.setdefault(motif_id, []).append([a, c, g, t])
+        return result
+
+    def motif_annotations(self, iteration, cluster):
+        """returns the annotations of the cluster motifs as (motif_id,
+        seqtype, motif_num, gene, position, reverse, pvalue) tuples"""
+        return self.__query('''select a.motif_info_id, seqtype, motif_num,
+                               g.name, position, reverse, pvalue
+                               from motif_annotations a join motif_infos i
+                               on a.motif_info_id = i.rowid join row_names g
+                               on g.order_num = a.gene_num
+                               where i.iteration = ? and i.cluster = ?''',
+                            (iteration, cluster))
+
+
+class ColumnarResults:
+    """reads the iteration results from a columnar store. The motif ids
+    are the motif indexes within an iteration"""
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, MANIFEST_FILE)) as infile:
+            manifest = json.load(infile)
+        if manifest['version'] != STORE_VERSION:
+            raise Exception("unsupported result store version: %s" %
+                            str(manifest['version']))
+        self.__row_names = manifest['row_names']
+        self.__column_names = manifest['column_names']
+        self.__files = {int(iteration): filename
+                        for iteration, filename in manifest['iterations'].items()}
+        self.__iteration = None
+        self.__arrays = None
+
+    def __getitem__(self, iteration):
+        """returns the arrays of the iteration, the most recent ones are
+        kept in memory"""
+        if iteration != self.__iteration:
+            with np.load(os.path.join(self.store_dir,
+                                      self.__files[iteration])) as npzfile:
+                self.__arrays = {name: npzfile[name] for name in npzfile.files}
+            self.__iteration = iteration
+        return self.__arrays
+
+    def iterations(self):
+        """returns the stored iterations"""
+        return sorted(self.__files.keys())
+
+    def __members(self, iteration, cluster, name, names):
+        """the names of the cluster members"""
+        if iteration not in self.__files:
+            return []
+        arrays = self[iteration]
+        offsets = arrays[name + '_offsets']
+        if cluster >= len(offsets):
+            return []
+        return [names[index] for index
+                in arrays[name + 's'][offsets[cluster - 1]:offsets[cluster]]]
+
+    def rows_for_cluster(self, iteration, cluster):
+        """returns the names of the rows in the cluster"""
+        return self.__members(iteration, cluster, 'row_member',
+                              self.__row_names)
+
+    def columns_for_cluster(self, iteration, cluster):
+        """returns the names of the columns in the cluster"""
+        return self.__members(iteration, cluster, 'column_member',
+                              self.__column_names)
+
+    def cluster_residual(self, iteration, cluster):
+        """returns the residual of the cluster or None"""
+        if iteration not in self.__files:
+            return None
+        residuals = self[iteration]['residuals']
+        return float(residuals[cluster - 1]) if cluster <= len(residuals) else None
+
+    def motif_infos(self, iteration, cluster=None):
+        """returns the motifs as (motif_id, cluster, seqtype, motif_num,
+        evalue) tuples"""
+        if iteration not in self.__files:
+            return []
+        arrays = self[iteration]
+        motif_ids = np.arange(len(arrays['motif_clusters']))
+        if cluster is not None:
+            motif_ids = motif_ids[arrays['motif_clusters'] == cluster]
+        seqtypes = arrays['seqtypes']
+        return [(int(motif_id), int(arrays['motif_clusters'][motif_id]),
+                 str(seqtypes[arrays['motif_seqtypes'][motif_id]]),
+                 int(arrays['motif_nums'][motif_id]),
+                 float(arrays['motif_evalues'][motif_id]))
+                for motif_id in motif_ids]
+
+    def motif_pssms(self, iteration):
+        """returns a dictionary from the motif ids to their PSSM rows"""
+        if iteration not in self.__files:
+            return {}
+        arrays = self[iteration]
+        offsets = arrays['pssm_offsets']
+        return {motif_id: arrays['pssms'][offsets[motif_id]:
+                                              offsets[motif_id + 1]].tolist()
+                for motif_id in xrange(len(offsets) - 1)}
+
+    def motif_annotations(self, iteration, cluster):
+        """returns the annotations of the cluster motifs as (motif_id,
+        seqtype, motif_num, gene, position, reverse, pvalue) tuples"""
+        if iteration not in self.__files:
+            return []
+        arrays = self[iteration]
+        motif_ids = arrays['annotation_motifs']
+        indexes = np.nonzero(arrays['motif_clusters'][motif_ids] == cluster)[0]
+        seqtypes = arrays['seqtypes']
+        return [(int(motif_ids[index]),
+                 str(seqtypes[arrays['motif_seqtypes'][motif_ids[index]]]),
+                 int(arrays['motif_nums'][motif_ids[index]]),
+                 self.__row_names[arrays['annotation_genes'][index]],
+                 int(arrays['annotation_positions'][index]),
+                 bool(arrays['annotation_reverse'][index]),
+                 float(arrays['annotation_pvalues'][index]))
+                for index in indexes]
+
+
+def open_results(conn, output_dir):
+    """returns the results of a run in output_dir, from the columnar store
+    if the run wrote one, otherwise from the output database"""
+    store_dir = os.path.join(output_dir, STORE_DIR)
+    if os.path.exists(os.path.join(store_dir, MANIFEST_FILE)):
+        return ColumnarResults(store_dir)
+    return SQLiteResults(conn)
+
+
+__all__ = ['ColumnarResultWriter', 'SQLiteResults', 'ColumnarResults',
+           'open_results']
@@ -6,10 +6,12 @@ more information and licensing details.
 """
 import logging
 import util
-import StringIO
 import re
 import patches
 import os
+import mmap
+import tempfile
+import hashlib
 
 RSAT_BASE_URL = 'http://embnet.ccg.unam.mx/rsa-tools'
 
@@ -17,10 +19,15 @@ RSAT_BASE_URL = 'http://embnet.ccg.unam.mx/rsa-tools'
 class RsatFiles:
     """This class implements the same service functions as RsatDatabase, but
     takes the data from files"""
-    def __init__(self, dirname, basename, taxonomy_id):
+    def __init__(self, dirname, basename, taxonomy_id, cache_dir=None):
+        """if cache_dir is specified, the contig sequences are kept in a
+        ContigStore in that directory"""
         self.dirname = dirname
         self.taxonomy_id = taxonomy_id
         self.basename = basename
+        self.contig_store = None
+        if cache_dir is not None:
+            self.contig_store = ContigStore(os.path.join(cache_dir, 'contigs'))
 
     def get_taxonomy_id(self, organism):
         return self.taxonomy_id
@@ -40,9 +47,20 @@ class RsatFiles:
 
     def get_contig_sequence(self, organism, contig):
         path = os.path.join(self.dirname, organism + '_' + contig)
-        with open(path) as infile:
-            seqstr = infile.read().upper()
-            return join_contig_sequence(seqstr)
+
+        def read_contig():
+            """reads the raw contig file"""
+            with open(path) as infile:
+                return infile.read()
+
+        if self.contig_store is not None:
+            # the stored contig is replaced when the file changes
+            stat = os.stat(path)
+            return self.contig_store.get(
+                organism, contig, read_contig,
+                source=source_digest(os.path.abspath(path), stat.st_size,
+                                     int(stat.st_mtime)))
+        return join_contig_sequence(read_contig().upper())
 
 
 class RsatDatabase:
@@ -57,6 +75,7 @@ class RsatDatabase:
         """create an RsatDatabase instance based on a mirror URL"""
         self.base_url = base_url
         self.cache_dir = cache_dir.rstrip('/')
+        self.contig_store = ContigStore(os.path.join(self.cache_dir, 'contigs'))
 
     def get_rsat_organism(self, kegg_organism):
         """returns the HTML page for the directory listing"""
@@ -103,23 +122,119 @@ class RsatDatabase:
             cache_file)
 
     def get_contig_sequence(self, organism, contig):
-        """returns the specified contig sequence"""
+        """returns the specified contig sequence from the contig store,
+        it is a read-only memory map that can be sliced like a string"""
         #logging.info('RSAT - get_contig_sequence(%s, %s)',
         #             organism, contig)
         cache_file = "/".join([self.cache_dir, organism + '_' + contig])
         url = "/".join([self.base_url, RsatDatabase.DIR_PATH, organism,
                         'genome', contig + '.raw'])
-        seqstr = util.read_url_cached(url, cache_file).upper()
-        return join_contig_sequence(seqstr)
+        return self.contig_store.get(
+            organism, contig, lambda: util.read_url_cached(url, cache_file),
+            source=source_digest(url))
+
+
+class ContigStore:
+    """Keeps the contig sequences as flat upper case files, one per
+    contig, that are memory-mapped once and sliced directly by the
+    sequence extraction. The index file of an organism lists the stored
+    contigs with their lengths and the digests of their sources, a contig
+    file is only used if it is listed in the index with its size and the
+    same source"""
+
+    def __init__(self, store_dir):
+        """creates a store in the specified directory"""
+        self.store_dir = store_dir
+        # (organism, contig) -> memory map
+        self.__contigs = {}
+
+    def get(self, organism, contig, read_raw, source=''):
+        """returns the contig sequence as a read-only memory map. If the
+        contig is not in the store yet or was stored from another source,
+        read_raw() is called to retrieve the raw contig text, which is then
+        normalized and stored. source identifies the origin of the raw
+        contig, see source_digest()"""
+        key = (organism, contig)
+        if key not in self.__contigs:
+            path = self.__contig_path(organism, contig)
+            length, stored_source = self.__read_index(organism).get(
+                contig, (None, None))
+            if (length is None or stored_source != source or
+                not os.path.exists(path) or os.path.getsize(path) != length):
+                length = self.__store(organism, contig,
+                                      join_contig_sequence(read_raw().upper()),
+                                      source)
+            self.__contigs[key] = self.__map(path, length)
+        return self.__contigs[key]
+
+    def __map(self, path, length):
+        """maps a contig file into memory, empty files can not be mapped"""
+        if length == 0:
+            return ''
+        with open(path, 'rb') as infile:
+            return mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __contig_path(self, organism, contig):
+        """the path of the contig file"""
+        return os.path.join(self.store_dir, organism, contig + '.seq')
+
+    def __index_path(self, organism):
+        """the path of the index file"""
+        return os.path.join(self.store_dir, organism, 'index.tsv')
+
+    def __read_index(self, organism):
+        """returns the dictionary contig -> (length, source) of the
+        organism"""
+        index = {}
+        path = self.__index_path(organism)
+        if os.path.exists(path):
+            with open(path) as infile:
+                for line in infile:
+                    row = line.rstrip('\n').split('\t')
+                    if len(row) == 3:
+                        index[row[0]] = (int(row[1]), row[2])
+        return index
+
+    def __store(self, organism, contig, seq, source):
+        """writes the contig file and adds it to the index, both files are
+        replaced atomically, so concurrent runs can share the store"""
+        dirname = os.path.dirname(self.__contig_path(organism, contig))
+        if not os.path.exists(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                # created by a concurrent run
+                if not os.path.isdir(dirname):
+                    raise
+        self.__write_atomic(self.__contig_path(organism, contig), seq)
+        index = self.__read_index(organism)
+        index[contig] = (len(seq), source)
+        self.__write_atomic(self.__index_path(organism),
+                            ''.join(['%s\t%d\t%s\n' % (name, index[name][0],
+                                                       index[name][1])
+                                     for name in sorted(index.keys())]))
+        logging.info("stored contig '%s' of '%s' (%d bp)", contig, organism,
+                     len(seq))
+        return len(seq)
+
+    def __write_atomic(self, path, text):
+        """writes a file through a temporary file in the same directory"""
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path),
+                                         prefix='contig', delete=False) as outfile:
+            outfile.write(text)
+        os.rename(outfile.name, path)
+
+
+def source_digest(*components):
+    """identifies the source of a stored contig, e.g. its URL or the
+    path, size and modification time of its file"""
+    return hashlib.sha1('\t'.join([str(component)
+                                   for component in components])).hexdigest()
 
 
 def join_contig_sequence(seqstr):
     """we take the safer route and assume that the input could
     be separated out into lines"""
-    buf = StringIO.StringIO(seqstr)
-    result = ''
-    for line in buf:
-        result += line.strip()
-    return result
+    return ''.join([line.strip() for line in seqstr.splitlines()])
 
-__all__ = ['RsatDatabase']
+__all__ = ['RsatDatabase', 'RsatFiles', 'ContigStore']
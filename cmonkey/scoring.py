@@ -12,7 +12,7 @@ import os.path
 import datamatrix as dm
 from datetime import date
 import util
-import multiprocessing as mp
+import workerpool
 import membership as memb
 import numpy as np
 import cPickle
@@ -57,6 +57,49 @@ class RunLog:
             logfile.write('%d:%d:%f\n' % (iteration, 1 if was_active else 0, scaling))
 
 
+def row_versions(membership, cluster):
+    """cluster version for scores that only depend on the cluster rows"""
+    return membership.row_version(cluster)
+
+
+def row_column_versions(membership, cluster):
+    """cluster version for scores that depend on rows and columns"""
+    return (membership.row_version(cluster), membership.column_version(cluster))
+
+
+class ClusterScoreCache:
+    """Remembers the per-cluster scores of the previous computation together
+    with the membership version of the cluster they were computed for.
+    This allows scoring functions to only recompute the clusters that
+    changed since. version_func(membership, cluster) determines the
+    version a cluster's scores depend on"""
+
+    def __init__(self, version_func=row_column_versions):
+        self.version_func = version_func
+        self.__membership = None
+        self.__scores = {}
+        self.__versions = {}
+
+    def dirty_clusters(self, membership, clusters):
+        """returns the clusters in clusters whose scores need to be computed"""
+        if membership is not self.__membership:
+            self.__membership = membership
+            self.__scores = {}
+            self.__versions = {}
+        return [cluster for cluster in clusters
+                if cluster not in self.__scores or
+                self.__versions[cluster] != self.version_func(membership, cluster)]
+
+    def get(self, cluster):
+        """returns the cached scores for the specified cluster"""
+        return self.__scores[cluster]
+
+    def put(self, cluster, scores):
+        """stores the scores computed for the current version of the cluster"""
+        self.__scores[cluster] = scores
+        self.__versions[cluster] = self.version_func(self.__membership, cluster)
+
+
 class ScoringFunctionBase:
     """Base class for scoring functions"""
 
@@ -77,9 +120,22 @@ class ScoringFunctionBase:
         # state. In general, setting this to True will be the best, but
         # if your environment has little memory, set this to False
         self.cache_result = True
+        self.cached_result = None
         self.config_params = config_params
         if config_params is None:
             raise Exception('NO CONFIG PARAMS !!!')
+        # run-scoped worker pool, if None, a temporary pool is created
+        # for each parallel computation
+        self.pool = None
+
+    def set_pool(self, pool):
+        """sets the worker pool to use for parallel computations"""
+        self.pool = pool
+
+    def cleanup(self):
+        """releases the resources that were kept for the duration of the
+        run, the default implementation does nothing"""
+        pass
 
     def name(self):
         """returns the name of this function
@@ -177,13 +233,16 @@ class ScoringFunctionBase:
         else:
             return 0.0
 
-    def store_checkpoint_data(self, shelf):
-        """Default implementation does not store checkpoint data"""
-        pass
+    def store_checkpoint_data(self, checkpoint):
+        """stores the cached result, results that are not cached are
+        pickled to the output directory after each computation"""
+        if self.cache_result and self.cached_result is not None:
+            checkpoint.put_matrix(self.name(), self.cached_result)
 
-    def restore_checkpoint_data(self, shelf):
-        """Default implementation does not store checkpoint data"""
-        pass
+    def restore_checkpoint_data(self, checkpoint):
+        """restores the cached result"""
+        if self.cache_result:
+            self.cached_result = checkpoint.get_matrix(self.name())
 
     def run_logs(self):
         """returns a list of RunLog objects, giving information about
@@ -204,6 +263,7 @@ class ColumnScoringFunction(ScoringFunctionBase):
                                      schedule=schedule,
                                      config_params=config_params)
         self.run_log = RunLog("column_scoring", config_params)
+        self.score_cache = ClusterScoreCache(row_versions)
 
     def name(self):
         """returns the name of this scoring function"""
@@ -213,12 +273,15 @@ class ColumnScoringFunction(ScoringFunctionBase):
         """compute method, iteration is the 0-based iteration number"""
         return compute_column_scores(self.membership, self.ratios,
                                      self.num_clusters(),
-                                     self.config_params[KEY_MULTIPROCESSING])
+                                     self.config_params[KEY_MULTIPROCESSING],
+                                     self.pool, self.score_cache)
 
 
 def compute_column_scores(membership, matrix, num_clusters,
-                          use_multiprocessing=False):
-    """Computes the column scores for the specified number of clusters"""
+                          use_multiprocessing=False, pool=None, cache=None):
+    """Computes the column scores for the specified number of clusters.
+    If a ClusterScoreCache is provided, only the clusters whose rows changed
+    since the previous call are computed"""
 
     def compute_substitution(cluster_column_scores):
         """calculate substitution value for missing column scores"""
@@ -240,18 +303,37 @@ def compute_column_scores(membership, matrix, num_clusters,
         else:
             return None
 
-    if use_multiprocessing:
-        pool = mp.Pool()
-        cluster_column_scores = pool.map(compute_column_scores_submatrix,
-                                         map(make_submatrix, xrange(1, num_clusters + 1)))
-        pool.close()
-        pool.join()
+    def copy_scores(column_scores):
+        """the scores are modified below, so the cache holds copies"""
+        if column_scores is None:
+            return None
+        colnames, scores = column_scores
+        return (colnames, scores.copy())
+
+    clusters = range(1, num_clusters + 1)
+    if cache is not None:
+        clusters = cache.dirty_clusters(membership, clusters)
+        logging.info("computing column scores for %d of %d clusters",
+                     len(clusters), num_clusters)
+
+    if use_multiprocessing and len(clusters) > 0:
+        computed_scores = workerpool.pool_map(
+            pool, compute_column_scores_submatrix,
+            map(make_submatrix, clusters))
     else:
-        cluster_column_scores = []
-        for cluster in xrange(1, num_clusters + 1):
-            cluster_column_scores.append(compute_column_scores_submatrix(
+        computed_scores = []
+        for cluster in clusters:
+            computed_scores.append(compute_column_scores_submatrix(
                 make_submatrix(cluster)))
 
+    if cache is None:
+        cluster_column_scores = computed_scores
+    else:
+        for index, cluster in enumerate(clusters):
+            cache.put(cluster, copy_scores(computed_scores[index]))
+        cluster_column_scores = [copy_scores(cache.get(cluster))
+                                 for cluster in xrange(1, num_clusters + 1)]
+
     substitution = compute_substitution(cluster_column_scores)
 
     # Convert scores into a matrix that have the clusters as columns
@@ -299,7 +381,8 @@ def compute_column_scores_submatrix(matrix):
     return (matrix.column_names, result)
 
 
-def combine(result_matrices, score_scalings, membership, quantile_normalize):
+def combine(result_matrices, score_scalings, membership, quantile_normalize,
+            pool=None):
     """This is  the combining function, taking n result matrices and scalings"""
     for m in result_matrices:
         m.fix_extreme_values()
@@ -308,7 +391,8 @@ def combine(result_matrices, score_scalings, membership, quantile_normalize):
         if len(result_matrices) > 1:
             start_time = util.current_millis()
             result_matrices = dm.quantile_normalize_scores(result_matrices,
-                                                           score_scalings)
+                                                           score_scalings,
+                                                           pool=pool)
             elapsed = util.current_millis() - start_time
             logging.info("quantile normalize in %f s.", elapsed / 1000.0)
 
@@ -387,6 +471,18 @@ class ScoringFunctionCombiner:
         self.scoring_functions = scoring_functions
         self.scaling_func = scaling_func
         self.config_params = config_params
+        self.pool = None
+
+    def set_pool(self, pool):
+        """recursively sets the worker pool on the children"""
+        self.pool = pool
+        for scoring_func in self.scoring_functions:
+            scoring_func.set_pool(pool)
+
+    def cleanup(self):
+        """recursively cleans up the children"""
+        for scoring_func in self.scoring_functions:
+            scoring_func.cleanup()
 
     def compute_force(self, iteration_result, ref_matrix=None):
         """compute scores for one iteration, recursive force"""
@@ -409,7 +505,7 @@ class ScoringFunctionCombiner:
                 if self.config_params['log_subresults']:
                     self.log_subresult(scoring_function, matrix)
         return combine(result_matrices, score_scalings, self.membership,
-                       self.config_params['quantile_normalize'])
+                       self.config_params['quantile_normalize'], self.pool)
 
     def compute(self, iteration_result, ref_matrix=None):
         """compute scores for one iteration"""
@@ -436,7 +532,7 @@ class ScoringFunctionCombiner:
                     self.log_subresult(scoring_function, matrix)
 
         return combine(result_matrices, score_scalings, self.membership,
-                       self.config_params['quantile_normalize'])
+                       self.config_params['quantile_normalize'], self.pool)
 
     def combine_cached(self, iteration):
         """Combine the cached results of the contained scoring function.
@@ -449,7 +545,8 @@ class ScoringFunctionCombiner:
                 result_matrices.append(matrix)
                 score_scalings.append(scoring_function.scaling(iteration))
 
-        return combine(result_matrices, score_scalings, self.membership, True)
+        return combine(result_matrices, score_scalings, self.membership, True,
+                       self.pool)
 
 
     def log_subresult(self, score_function, matrix):
@@ -469,15 +566,15 @@ class ScoringFunctionCombiner:
         """returns the scaling for the specified iteration"""
         return self.scaling_func(iteration)
 
-    def store_checkpoint_data(self, shelf):
+    def store_checkpoint_data(self, checkpoint):
         """recursively invokes store_checkpoint_data() on the children"""
         for scoring_func in self.scoring_functions:
-            scoring_func.store_checkpoint_data(shelf)
+            scoring_func.store_checkpoint_data(checkpoint)
 
-    def restore_checkpoint_data(self, shelf):
-        """recursively invokes store_checkpoint_data() on the children"""
+    def restore_checkpoint_data(self, checkpoint):
+        """recursively invokes restore_checkpoint_data() on the children"""
         for scoring_func in self.scoring_functions:
-            scoring_func.restore_checkpoint_data(shelf)
+            scoring_func.restore_checkpoint_data(checkpoint)
 
     def run_logs(self):
         """joins all contained function's run logs"""
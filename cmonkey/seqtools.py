@@ -5,11 +5,11 @@ This file is part of cMonkey Python. Please see README and LICENSE for
 more information and licensing details.
 """
 import itertools as it
-import re
 import logging
 import random
 import string
 import collections
+import numpy as np
 from util import DelimitedFile
 
 logger = logging.getLogger('seqtools')
@@ -106,25 +106,68 @@ def subsequence(sequence, start, stop, reverse=False):
 
 
 REV_DICT = {'A': 'T', 'G': 'C', 'C': 'G', 'T': 'A'}
+# translation table that upper-cases and complements a sequence
+REVCOMP_TABLE = "".join([REV_DICT.get(chr(i).upper(), chr(i).upper())
+                         for i in xrange(256)])
 
 
 def revcomp(sequence):
     """compute the reverse complement of the input string"""
-    return "".join([__revchar(c) for c in sequence[::-1]])
+    return str(sequence)[::-1].translate(REVCOMP_TABLE)
 
 
-def __revchar(nucleotide):
-    """for a nucleotide character, return its complement"""
-    nucleotide = nucleotide.upper()
-    if nucleotide in REV_DICT:
-        return REV_DICT[nucleotide]
+def subseq_counts(seqs, subseq_len):
+    """return a dictionary containing for each subsequence of length
+    subseq_len their respective count in the input sequences.
+    The sequences are integer-encoded over the letters that occur in
+    them, so each window is a number in that base and the windows can
+    be counted with np.bincount()"""
+    seqs = [str(seq) for seq in seqs if len(seq) >= subseq_len]
+    if subseq_len <= 0 or len(seqs) == 0:
+        return {}
+    data = np.frombuffer(''.join(seqs), dtype='uint8')
+    letters = np.nonzero(np.bincount(data, minlength=256))[0].astype('uint8')
+    table = np.zeros(256, dtype='uint8')
+    table[letters] = np.arange(len(letters))
+    codes = table[data]
+    base = len(letters)
+    if base ** subseq_len >= 2 ** 62:
+        return __subseq_counts(seqs, subseq_len)
+
+    num_windows = len(codes) - subseq_len + 1
+    kmers = np.zeros(num_windows, dtype='int64')
+    for index in xrange(subseq_len):
+        kmers *= base
+        kmers += codes[index:index + num_windows]
+    # leave out the windows that reach into the next sequence
+    if len(seqs) > 1 and subseq_len > 1:
+        ends = np.cumsum([len(seq) for seq in seqs])[:-1]
+        crossing = (ends[:, np.newaxis] -
+                    np.arange(1, subseq_len)[np.newaxis, :]).ravel()
+        inside = np.ones(num_windows, dtype=bool)
+        inside[crossing] = False
+        kmers = kmers[inside]
+
+    if base ** subseq_len <= 2 ** 24:
+        counts = np.bincount(kmers)
+        kmers = np.nonzero(counts)[0]
+        counts = counts[kmers]
     else:
-        return nucleotide
+        kmers, counts = np.unique(kmers, return_counts=True)
 
+    # decode the window numbers back into letters
+    digits = np.empty((len(kmers), subseq_len), dtype='uint8')
+    for index in xrange(subseq_len - 1, -1, -1):
+        digits[:, index] = letters[kmers % base]
+        kmers = kmers // base
+    chars = digits.tostring()
+    return {chars[i * subseq_len:(i + 1) * subseq_len]: count
+            for i, count in enumerate(counts.tolist())}
 
-def subseq_counts(seqs, subseq_len):
-    """return a dictionary containing for each subsequence of length
-    subseq_len their respective count in the input sequences"""
+
+def __subseq_counts(seqs, subseq_len):
+    """subseq_counts() for alphabets that are too large to encode the
+    windows as integers"""
     counts = {}
     for seq in seqs:
         for index in xrange(0, len(seq) - subseq_len + 1):
@@ -175,24 +218,38 @@ def all_kmers(length, seqs, seq=[], pos=0, choices=['A', 'C', 'G', 'T']):
             all_kmers(length, seqs, seq, pos + 1, choices)
 
 
-def replace_degenerate_residues(seqs):
-    """gets rid of funny characters in gene sequences by employing a
-    replacement strategy"""
-    replacements = {'R': ['G', 'A'], 'Y': ['T', 'C'], 'K': ['G', 'T'],
-                    'M': ['A', 'C'], 'S': ['G', 'C'], 'W': ['A', 'T'],
-                    'N': ['G', 'A', 'T', 'C'],
-                    ' ': [' ']}
+# the letters a degenerate residue stands for
+DEGENERATE_REPLACEMENTS = {'R': 'GA', 'Y': 'TC', 'K': 'GT', 'M': 'AC',
+                           'S': 'GC', 'W': 'AT', 'N': 'GATC'}
 
-    pat = re.compile('[ACGTX]*([^ACGTX])[ACGTX]*')
+
+def replace_degenerate_residues(seqs, random_state=None):
+    """gets rid of funny characters in gene sequences by employing a
+    replacement strategy: each degenerate residue is replaced by one of
+    the letters it stands for, drawn from random_state, a
+    numpy.random.RandomState. By default, it is seeded from the random
+    module, so runs with a fixed random seed are reproducible"""
+    # For some reasons, there were cases with newlines in the beginning
+    seqs = [str(seq).strip() for seq in seqs]
+    if len(seqs) == 0:
+        return []
+    if random_state is None:
+        random_state = np.random.RandomState(random.randint(0, 2 ** 31 - 1))
+
+    data = np.frombuffer(''.join(seqs), dtype='uint8').copy()
+    for residue in sorted(DEGENERATE_REPLACEMENTS.keys()):
+        positions = np.nonzero(data == ord(residue))[0]
+        if len(positions) > 0:
+            choices = np.frombuffer(DEGENERATE_REPLACEMENTS[residue],
+                                    dtype='uint8')
+            data[positions] = choices[random_state.randint(0, len(choices),
+                                                           len(positions))]
+    chars = data.tostring()
     result = []
+    start = 0
     for seq in seqs:
-        seq = seq.strip()  # For some reasons, there were cases with newlines in the beginning
-        for match in pat.finditer(seq):
-            replace_chars = replacements[seq[match.start(1)]]
-            replace_char = replace_chars[random.randint(
-                0, len(replace_chars) - 1)]
-            seq = seq[:match.start(1)] + replace_char + seq[match.end(1):]
-        result.append(seq)
+        result.append(chars[start:start + len(seq)])
+        start += len(seq)
     return result
 
 
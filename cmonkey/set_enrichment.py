@@ -10,7 +10,7 @@ import logging
 import scoring
 import numpy as np
 import datamatrix as dm
-import multiprocessing as mp
+import workerpool
 import os
 
 
@@ -142,12 +142,14 @@ class ScoringFunction(scoring.ScoringFunctionBase):
             logging.info("PROCESSING SET TYPE '%s'", set_type.name)
             start1 = util.current_millis()
             if use_multiprocessing:
-                pool = mp.Pool()
-                results = pool.map(compute_cluster_score,
-                                   [(cluster, self.bonferroni_cutoff())
-                                    for cluster in xrange(1, self.num_clusters() + 1)])
-                pool.close()
-                pool.join()
+                if self.pool is not None:
+                    self.pool.share(__name__, 'SET_MATRIX', SET_MATRIX, readonly=True)
+                    self.pool.share(__name__, 'SET_MEMBERSHIP', SET_MEMBERSHIP)
+                    self.pool.share(__name__, 'SET_REF_MATRIX', SET_REF_MATRIX)
+                    self.pool.share(__name__, 'SET_SET_TYPE', SET_SET_TYPE, readonly=True)
+                results = workerpool.pool_map(self.pool, compute_cluster_score,
+                                              [(cluster, self.bonferroni_cutoff())
+                                               for cluster in xrange(1, self.num_clusters() + 1)])
             else:
                 results = []
                 for cluster in xrange(1, self.num_clusters() + 1):
@@ -3,9 +3,13 @@
 This file is part of cMonkey Python. Please see README and LICENSE for
 more information and licensing details.
 """
+import os
+import gzip
 import logging
 import re
-import math
+import hashlib
+import tempfile
+import numpy as np
 import util
 import network
 import patches
@@ -15,36 +19,121 @@ STRING_FILE2 = 'string_links_64091.tab'
 PROTEIN_PREFIX = re.compile('^string:\d+[.]')
 
 
-def normalize_edges_to_max_score(edges, max_score):
-    """normalize scores to 1000, for combined scores"""
-    def normalize(edge_score):
-        score = edge_score / max_score * 1000.0
-        return 1000 * math.exp(score / 1000.0) / math.exp(1.0)
+EDGE_DTYPE = np.dtype([('node1', np.int32), ('node2', np.int32),
+                       ('score', np.float64)])
 
-    return [(edge[0], edge[1], normalize(edge[2])) for edge in edges]
+
+def read_edge_table(organism_code, filename, sep='\t'):
+    """reads a preprocessed STRING edge file (protein1, protein2,
+    combined_score) into a node name list and an edge array of node
+    indexes and scores. The gene names are patched, self edges and
+    duplicates of an edge in either direction are removed, the first
+    occurrence is kept"""
+    opener = gzip.open if filename.endswith('.gz') else open
+    node_ids = {}
+    node_names = []
+    nodes1 = []
+    nodes2 = []
+    scores = []
+    with opener(filename) as infile:
+        for line in infile:
+            row = line.rstrip('\r\n').split(sep)
+            if len(row) < 3:
+                continue
+            for name, nodes in ((row[0], nodes1), (row[1], nodes2)):
+                node_id = node_ids.get(name)
+                if node_id is None:
+                    node_id = node_ids[name] = len(node_names)
+                    node_names.append(name)
+                nodes.append(node_id)
+            scores.append(float(row[2]))
+
+    edges = np.zeros(len(scores), dtype=EDGE_DTYPE)
+    edges['node1'] = nodes1
+    edges['node2'] = nodes2
+    edges['score'] = scores
+
+    # patch each name once, names that become equal share a node
+    patched_names = []
+    patched_ids = {}
+    id_map = np.zeros(len(node_names), dtype=np.int32)
+    for node_id, name in enumerate(node_names):
+        name = patches.patch_string_gene(organism_code, name)
+        if name not in patched_ids:
+            patched_ids[name] = len(patched_names)
+            patched_names.append(name)
+        id_map[node_id] = patched_ids[name]
+    if len(edges) > 0:
+        edges['node1'] = id_map[edges['node1']]
+        edges['node2'] = id_map[edges['node2']]
+    # remove the self edges and keep the first occurrence of each
+    # undirected edge
+    edges = edges[edges['node1'] != edges['node2']]
+    return patched_names, edges[network.first_unique_edges(
+            edges['node1'], edges['node2'], len(patched_names))]
+
+
+def edge_cache_path(cache_dir, organism_code, filename, sep):
+    """the cache directory for a STRING file, its name changes with the
+    size and modification time of the file"""
+    stat = os.stat(filename)
+    digest = hashlib.sha1('\t'.join([os.path.abspath(filename), str(stat.st_size),
+                                     str(int(stat.st_mtime)), organism_code,
+                                     repr(sep)])).hexdigest()
+    return os.path.join(cache_dir, 'string-edges', '%s-%s' % (
+            os.path.basename(filename), digest[:16]))
+
+
+def read_cached_edge_table(organism_code, filename, sep='\t', cache_dir=None):
+    """reads the edge table of a STRING file. With a cache directory, the
+    table is compiled into a node name file and an edge array, which are
+    memory-mapped in later runs"""
+    if cache_dir is None:
+        return read_edge_table(organism_code, filename, sep)
+
+    path = edge_cache_path(cache_dir, organism_code, filename, sep)
+    nodes_path = os.path.join(path, 'nodes.txt')
+    edges_path = os.path.join(path, 'edges.npy')
+    if os.path.exists(edges_path):
+        with open(nodes_path) as infile:
+            node_names = infile.read().splitlines()
+        return node_names, np.load(edges_path, mmap_mode='r')
+
+    node_names, edges = read_edge_table(organism_code, filename, sep)
+    if not os.path.exists(path):
+        os.makedirs(path)
+    # the edge file is written last, it marks a complete cache entry
+    for outpath, write in [(nodes_path, lambda outfile: outfile.write(
+                    ''.join(name + '\n' for name in node_names))),
+                           (edges_path, lambda outfile: np.save(outfile, edges))]:
+        with tempfile.NamedTemporaryFile(dir=path, delete=False) as outfile:
+            write(outfile)
+        os.rename(outfile.name, outpath)
+    logging.info("compiled %d STRING edges into '%s'", len(edges), path)
+    return node_names, edges
 
 
 def get_network_factory2(organism_code, filename, weight, sep='\t',
-                         normalized=False):
+                         cache_dir=None):
     """STRING network factory from preprocessed edge file
     (protein1, protein2, combined_score), scores are already
     normalized to 1000.
     This is the standard factory method used for Microbes.
+    If cache_dir is specified, the edges are compiled into a binary
+    cache on first use.
     """
     def read_edges2(filename):
         """just read a preprocessed file, much faster to debug"""
         logging.info("stringdb.read_edges2()")
-        dfile = util.read_dfile(filename, sep)
-        result = []
-        max_score = 0.0
-        for line in dfile.lines:
-            score = float(line[2])
-            max_score = max(score, max_score)
-            result.append((patches.patch_string_gene(organism_code, line[0]),
-                           patches.patch_string_gene(organism_code, line[1]),
-                           score))
-        if not normalized:
-            normalize_edges_to_max_score(result, max_score)
+        start_time = util.current_millis()
+        node_names, edges = read_cached_edge_table(organism_code, filename,
+                                                   sep, cache_dir)
+        node_names = np.array(node_names, dtype=object)
+        result = zip(node_names[edges['node1']].tolist(),
+                     node_names[edges['node2']].tolist(),
+                     edges['score'].tolist())
+        logging.info("read %d STRING edges in %f s.", len(result),
+                     (util.current_millis() - start_time) / 1000.0)
         return result
 
     def make_network(organism, ratios=None, check_size=False):
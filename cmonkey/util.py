@@ -313,6 +313,10 @@ class ThesaurusBasedMap:  # pylint: disable-msg=R0903
         """Returns the keys of the thesaurus"""
         return self.__thesaurus.keys()
 
+    def __contains__(self, key):
+        """a key is contained if it is in the thesaurus, like in keys()"""
+        return key in self.__thesaurus
+
 
 def order2string(order):
     """returns the string representation for an order, e.g. 1st, 2nd etc."""
@@ -357,22 +361,133 @@ def trim_mean(values, trim):
 
 
 ######################################################################
-### RPY2 abstraction
+### Kernel density estimation
 ######################################################################
+# These functions reproduce what R computes for
+#
+#   d <- density(cluster_values, bw=bandwidth, adjust=2, from=dmin, to=dmax,
+#                n=256, na.rm=T)
+#   p <- approx(d$x, rev(cumsum(rev(d$y))), kvalues)$y
+#   p / sum(p, na.rm=T)
+#
+# i.e. a Gaussian KDE that is computed by linear binning on a regular grid
+# and FFT convolution, followed by linear interpolation. Each row of the
+# input arrays is an independent problem, so all clusters of an iteration
+# can be computed in a single call.
+DENSITY_ADJUST = 2
+DENSITY_NUM_POINTS = 256
+# R's density() always uses at least 512 points internally
+DENSITY_NUM_GRID_POINTS = 512
+
+
+def __approx(xlo, xhi, yvalues, xout):
+    """linear interpolation on the regular grids seq(xlo, xhi, length.out=n)
+    stored row-wise in yvalues, like R's approx() with rule=1:
+    values outside the grid and NaNs result in NaN"""
+    num_points = yvalues.shape[1]
+    step = (xhi - xlo) / (num_points - 1)
+    grid_x = xlo[:, np.newaxis] + np.arange(num_points) * step[:, np.newaxis]
+    grid_x[:, -1] = xhi
+    with np.errstate(invalid='ignore'):
+        outside = ~((xout >= xlo[:, np.newaxis]) & (xout <= xhi[:, np.newaxis]))
+        xout = np.where(outside, xlo[:, np.newaxis], xout)
+    left = np.floor((xout - xlo[:, np.newaxis]) / step[:, np.newaxis]).astype('int64')
+    left = np.clip(left, 0, num_points - 2)
+    rows = np.arange(yvalues.shape[0])[:, np.newaxis]
+    x0 = grid_x[rows, left]
+    x1 = grid_x[rows, left + 1]
+    y0 = yvalues[rows, left]
+    y1 = yvalues[rows, left + 1]
+    result = y0 + (y1 - y0) * ((xout - x0) / (x1 - x0))
+    result[outside] = np.nan
+    return result
+
+
+def __bin_dist(values, weights, xlo, xhi, num_points):
+    """linear binning of values into num_points bins per row, the same as
+    the BinDist() C function that R's density() uses. The result has
+    2 * num_points columns, the upper half is the zero padding for the FFT"""
+    num_rows = values.shape[0]
+    result = np.zeros((num_rows, 2 * num_points))
+    xdelta = (xhi - xlo) / (num_points - 1)
+    finite = np.isfinite(values)
+    with np.errstate(invalid='ignore'):
+        xpos = (values - xlo[:, np.newaxis]) / xdelta[:, np.newaxis]
+    xpos[~finite] = 0.0
+    ix = np.floor(xpos).astype('int64')
+    fx = xpos - ix
+    rows = np.repeat(np.arange(num_rows), values.shape[1]).reshape(values.shape)
+    weights = np.repeat(weights, values.shape[1]).reshape(values.shape)
+
+    inner = finite & (ix >= 0) & (ix <= num_points - 2)
+    np.add.at(result, (rows[inner], ix[inner]), weights[inner] * (1.0 - fx[inner]))
+    np.add.at(result, (rows[inner], ix[inner] + 1), weights[inner] * fx[inner])
+    below = finite & (ix == -1)
+    np.add.at(result, (rows[below], 0), weights[below] * fx[below])
+    above = finite & (ix == num_points - 1)
+    np.add.at(result, (rows[above], ix[above]), weights[above] * (1.0 - fx[above]))
+    return result
+
+
+def density_batch(kvalues, cluster_values, bandwidths, dmins, dmaxs):
+    """computes density scores for several problems at once.
+    kvalues is a 2D array with the values to evaluate for each problem,
+    cluster_values is a 2D array with the values the densities are
+    estimated from, rows can be padded with NaN. bandwidths, dmins and dmaxs
+    are arrays with one value per row. The result is a 2D array of the
+    shape of kvalues"""
+    kvalues = np.asarray(kvalues, dtype='float64')
+    cluster_values = np.asarray(cluster_values, dtype='float64')
+    bandwidths = np.asarray(bandwidths, dtype='float64') * DENSITY_ADJUST
+    dmins = np.asarray(dmins, dtype='float64')
+    dmaxs = np.asarray(dmaxs, dtype='float64')
+    num_points = DENSITY_NUM_GRID_POINTS
+
+    # na.rm=T: NaNs are not counted, while infinite values still count
+    # towards the total mass
+    num_values = np.sum(~np.isnan(cluster_values), axis=1).astype('float64')
+    num_finite = np.sum(np.isfinite(cluster_values), axis=1).astype('float64')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weights = 1.0 / num_finite
+        total_mass = num_finite / num_values
+
+    lo = dmins - 4.0 * bandwidths
+    up = dmaxs + 4.0 * bandwidths
+    ybins = __bin_dist(cluster_values, weights, lo, up, num_points)
+    ybins *= total_mass[:, np.newaxis]
+
+    # the Gaussian kernel at the FFT ordinates, wrapped around
+    kords = (np.arange(2 * num_points) / (2.0 * num_points - 1.0) *
+             (2.0 * (up - lo))[:, np.newaxis])
+    kords[:, num_points + 1:] = -kords[:, num_points - 1:0:-1]
+    kords = (np.exp(-0.5 * (kords / bandwidths[:, np.newaxis]) ** 2) /
+             (np.sqrt(2.0 * np.pi) * bandwidths[:, np.newaxis]))
+    kords = np.fft.ifft(np.fft.fft(ybins, axis=1) *
+                        np.conj(np.fft.fft(kords, axis=1)), axis=1)
+    kords = np.maximum(0.0, kords.real[:, :num_points])
+
+    # interpolate the density to the user grid, then the tail sums of
+    # the density to the kvalues
+    xout = (dmins[:, np.newaxis] +
+            np.arange(DENSITY_NUM_POINTS) *
+            ((dmaxs - dmins) / (DENSITY_NUM_POINTS - 1))[:, np.newaxis])
+    xout[:, -1] = dmaxs
+    dens = __approx(lo, up, kords, xout)
+    tail_sums = np.cumsum(dens[:, ::-1], axis=1)[:, ::-1]
+    result = __approx(dmins, dmaxs, tail_sums, kvalues)
+    return result / np.nansum(result, axis=1)[:, np.newaxis]
+
+
 def density(kvalues, cluster_values, bandwidth, dmin, dmax):
     """generic function to compute density scores"""
-    kwargs = {'bw': bandwidth, 'adjust': 2, 'from': dmin,
-              'to': dmax, 'n': 256, 'na.rm': True}
-    rdens = robjects.r("""
-      rdens <- function(cluster_values, kvalues, ...) {
-        d <- density(cluster_values, ...);
-        p <- approx(d$x, rev(cumsum(rev(d$y))), kvalues)$y
-        p / sum(p, na.rm=T)
-      }""")
-    return rdens(robjects.FloatVector(cluster_values),
-                 robjects.FloatVector(kvalues), **kwargs)
+    return density_batch([kvalues], [cluster_values], [bandwidth],
+                         [dmin], [dmax])[0]
 
 
+######################################################################
+### RPY2 abstraction
+######################################################################
+
 def r_set_seed(value):
     """calls R's set.seed()"""
     set_seed = robjects.r['set.seed']
@@ -4,11 +4,11 @@
 This file is part of cMonkey Python. Please see README and LICENSE for
 more information and licensing details.
 """
-import subprocess as sp
 import logging
 import re
 import pssm
 import os
+import jobscheduler
 
 LAUNCHER = 'weederlauncher'
 LLR_VALUE = 'NA'
@@ -34,11 +34,17 @@ class Site:
 
 
 def run_weeder(fasta_file):
+    """run the weeder command and interpret its result"""
+    return jobscheduler.run_job(run_weeder_job(fasta_file))
+
+
+def run_weeder_job(fasta_file):
+    """the weeder run as a job, yields the list of PSSMs"""
     if not os.path.exists(fasta_file):
         logging.warning("Weeder FASTA file %s not found! Skipping")
-        return []
+        yield []
+        return
 
-    """run the weeder command and interpret its result"""
     def write_f1_file(pssm_num, apssm, num_sites):
         """writes the pssm to the .f1 file"""
         with open('%s.%d.f1' % (fasta_file, pssm_num), 'w') as outfile:
@@ -74,7 +80,7 @@ def run_weeder(fasta_file):
                 outfile.write(apssm.to_mast_string())
                 outfile.write('\n')
 
-    __launch_weeder(fasta_file)
+    yield __launch_weeder(fasta_file)
     pssms = [pssm8 for pssm8 in __read_pssms_for(fasta_file)
              if pssm8.sequence_length() == 8]
     for index in xrange(len(pssms)):
@@ -86,20 +92,18 @@ def run_weeder(fasta_file):
         write_f1_file(index + 1, pssms[index], num_sites)
         write_f2_file(index + 1, pssms[index])
     write_meme_file(pssms)
-    return pssms
+    yield pssms
 
 
 def __launch_weeder(fasta_file):
-    """launch weeder command"""
-    command = [LAUNCHER, fasta_file, 'HS3P', 'small', 'T50']
-    retcode = 1
-    with open('weeder.log', 'w') as logfile:
-        logging.info("running weeder on '%s'", fasta_file)
-        #weederproc = sp.Popen(command, stdout=logfile, stderr=sp.STDOUT)
-        weederproc = sp.Popen(command, stdout=logfile, stderr=logfile)
-        retcode = weederproc.wait()
-        logging.info("Weeder finished, return code: %d", retcode)
-    return retcode
+    """launch weeder command, a job that yields the return code"""
+    command = jobscheduler.Command([LAUNCHER, fasta_file, 'HS3P', 'small', 'T50'],
+                                   outfile_path='%s.log' % fasta_file,
+                                   check=False)
+    logging.info("running weeder on '%s'", fasta_file)
+    yield command
+    logging.info("Weeder finished, return code: %d", command.returncode)
+    yield command.returncode
 
 
 def __read_pssms_for(fasta_file):
@@ -0,0 +1,243 @@
+# vi: sw=4 ts=4 et:
+"""workerpool.py - run-scoped pool of worker processes
+
+Creating a multiprocessing.Pool for every parallel computation forks a
+new set of processes each time, which dominates the iteration time for
+small organisms. A WorkerPool is created once per run and keeps its
+workers alive. The scoring functions pass their read-only data to the
+workers through module globals, just like they did before forking:
+the values registered with share() are set as globals in the workers
+before a task runs. They are transferred to already running workers
+through pickle files and only when they have changed, so the workers do
+not have to be forked again.
+
+Large numeric arrays inside the shared values, e.g. DataMatrix.values
+and the membership arrays, are not pickled, but stored as .npy files
+(in /dev/shm if available) that the workers attach to by name as
+read-only memory maps. This way, all workers share a single copy of
+the data instead of each holding their own.
+
+This file is part of cMonkey Python. Please see README and LICENSE for
+more information and licensing details.
+"""
+import sys
+import os
+import shutil
+import tempfile
+import logging
+import cPickle
+import multiprocessing as mp
+import numpy as np
+
+
+# directory for the shared state, a memory-backed file system is
+# preferred
+SHARED_MEMORY_DIR = '/dev/shm'
+# numeric arrays of at least this size are memory-mapped
+MIN_SHARED_ARRAY_BYTES = 4096
+
+
+# (module name, global name) -> generation of the value loaded in this
+# worker process
+WORKER_GENERATIONS = {}
+
+
+def set_module_global(module_name, name, value):
+    """sets a global variable in the specified module"""
+    module = sys.modules.get(module_name)
+    if module is None:
+        module = __import__(module_name, fromlist=[name])
+    setattr(module, name, value)
+
+
+def is_shareable_array(obj):
+    """determines whether obj is a numeric array that should be
+    memory-mapped rather than pickled"""
+    return (type(obj) == np.ndarray and not obj.dtype.hasobject and
+            obj.nbytes >= MIN_SHARED_ARRAY_BYTES)
+
+
+def dump_shared(value, path):
+    """pickles value into path, the shareable arrays are stored as
+    separate .npy files next to it. Returns the list of written files"""
+    paths = [path]
+    array_names = {}
+
+    def persistent_id(obj):
+        """stores shareable arrays, returning the name they are stored under"""
+        if not is_shareable_array(obj):
+            return None
+        if id(obj) not in array_names:
+            array_path = '%s.%d.npy' % (path, len(array_names))
+            np.save(array_path, obj)
+            paths.append(array_path)
+            array_names[id(obj)] = os.path.basename(array_path)
+        return array_names[id(obj)]
+
+    try:
+        with open(path, 'wb') as outfile:
+            pickler = cPickle.Pickler(outfile, cPickle.HIGHEST_PROTOCOL)
+            pickler.persistent_id = persistent_id
+            pickler.dump(value)
+    except:
+        for written in paths:
+            if os.path.exists(written):
+                os.remove(written)
+        raise
+    return paths
+
+
+def load_shared(path):
+    """loads a value written by dump_shared(), attaching to its arrays
+    as read-only memory maps"""
+    dirname = os.path.dirname(path)
+    with open(path, 'rb') as infile:
+        unpickler = cPickle.Unpickler(infile)
+        unpickler.persistent_load = lambda name: np.load(
+            os.path.join(dirname, name), mmap_mode='r')
+        return unpickler.load()
+
+
+def run_task(args):
+    """runs a task in a worker, makes sure that the shared state is up
+    to date first. This function is run within Pool.map()"""
+    manifest, func, arg = args
+    for module_name, name, generation, path in manifest:
+        key = (module_name, name)
+        if path is not None and WORKER_GENERATIONS.get(key) != generation:
+            set_module_global(module_name, name, load_shared(path))
+            WORKER_GENERATIONS[key] = generation
+    return func(arg)
+
+
+class SharedValue:
+    """a value shared with the workers. paths are the files the value
+    is stored in, the first one being the pickle file. paths is empty if
+    the value could not be pickled and has to be passed to the workers
+    by forking"""
+    def __init__(self, value, generation, paths):
+        self.value = value
+        self.generation = generation
+        self.paths = paths
+        self.path = paths[0] if len(paths) > 0 else None
+
+    def remove_files(self):
+        """removes the files of this value"""
+        for path in self.paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class WorkerPool:
+    """A pool of worker processes that lives for the duration of a run"""
+
+    def __init__(self, num_processes=None):
+        """creates the pool, the worker processes are started on demand"""
+        self.num_processes = num_processes
+        self.__pool = None
+        self.__statedir = None
+        self.__generation = 0
+        # (module name, global name) -> SharedValue
+        self.__shared = {}
+        # (module name, global name) -> SharedValue of the read-only values,
+        # sharing the same object again does not pickle it again
+        self.__readonly = {}
+        self.__needs_fork = False
+
+    def share(self, module_name, name, value, readonly=False):
+        """makes value available as the global variable name of the
+        specified module in the worker processes.
+        If readonly is True, the value is assumed not to change as long
+        as it is the same object and is only transferred once. The files
+        of the value that was shared before under the name are removed"""
+        key = (module_name, name)
+        old_shared = self.__shared.get(key)
+        if (readonly and old_shared is not None and
+            self.__readonly.get(key) is old_shared and
+            old_shared.value is value):
+            return
+
+        self.__generation += 1
+        paths = self.__write_value(module_name, name, value)
+        shared = SharedValue(value, self.__generation, paths)
+        if shared.path is None:
+            self.__needs_fork = True
+        self.__shared[key] = shared
+        if readonly:
+            self.__readonly[key] = shared
+        else:
+            self.__readonly.pop(key, None)
+        if old_shared is not None:
+            old_shared.remove_files()
+
+    def __write_value(self, module_name, name, value):
+        """stores value in the state directory and returns the list of
+        written files, which is empty if the value can not be pickled"""
+        if self.__statedir is None:
+            if os.path.isdir(SHARED_MEMORY_DIR):
+                self.__statedir = tempfile.mkdtemp(prefix='cmonkey-workers-',
+                                                   dir=SHARED_MEMORY_DIR)
+            else:
+                self.__statedir = tempfile.mkdtemp(prefix='cmonkey-workers-')
+        path = os.path.join(self.__statedir, '%s.%s.%d.pkl' %
+                            (module_name, name, self.__generation))
+        try:
+            return dump_shared(value, path)
+        except (cPickle.PicklingError, TypeError), e:
+            logging.info("can not pickle '%s.%s' (%s), workers will be restarted",
+                         module_name, name, str(e))
+            return []
+
+    def __ensure_pool(self):
+        """starts the worker processes if necessary. The shared values are
+        set as globals in this process before forking, so the new workers
+        inherit all of them. Their generations are recorded as well, so the
+        workers do not load them again for their first task"""
+        if self.__needs_fork and self.__pool is not None:
+            self.__terminate_workers()
+        if self.__pool is None:
+            for (module_name, name), shared in self.__shared.items():
+                set_module_global(module_name, name, shared.value)
+                WORKER_GENERATIONS[(module_name, name)] = shared.generation
+            self.__pool = mp.Pool(self.num_processes)
+        self.__needs_fork = False
+
+    def __terminate_workers(self):
+        """stops the current worker processes"""
+        self.__pool.close()
+        self.__pool.join()
+        self.__pool = None
+
+    def map(self, func, args):
+        """applies func to each element of args in the worker processes,
+        func must be a module level function"""
+        self.__ensure_pool()
+        manifest = [(module_name, name, shared.generation, shared.path)
+                    for (module_name, name), shared in self.__shared.items()]
+        return self.__pool.map(run_task, [(manifest, func, arg) for arg in args])
+
+    def close(self):
+        """shuts down the workers and removes the shared state files"""
+        if self.__pool is not None:
+            self.__terminate_workers()
+        if self.__statedir is not None:
+            shutil.rmtree(self.__statedir, ignore_errors=True)
+            self.__statedir = None
+        self.__shared = {}
+        self.__readonly = {}
+
+
+def pool_map(pool, func, args):
+    """applies func to args using pool. If pool is None, a temporary
+    multiprocessing pool is used that inherits the current globals"""
+    if pool is not None:
+        return pool.map(func, args)
+    tmp_pool = mp.Pool()
+    try:
+        return tmp_pool.map(func, args)
+    finally:
+        tmp_pool.close()
+        tmp_pool.join()
+
+
+__all__ = ['WorkerPool', 'pool_map']
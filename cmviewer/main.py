@@ -3,6 +3,7 @@
 import cherrypy
 from jinja2 import Environment, FileSystemLoader
 import os
+import sys
 import sqlite3
 from collections import namedtuple, defaultdict
 import json
@@ -12,6 +13,9 @@ import glob
 import math
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(os.path.dirname(current_dir), 'cmonkey'))
+import resultstore
+
 env = Environment(loader=FileSystemLoader(os.path.join(current_dir, 'templates')))
 outdir = os.path.join(os.path.dirname(current_dir), 'out')  # make it flexible
 outdb = os.path.join(outdir, 'cmonkey_run.db')
@@ -27,8 +31,6 @@ IterationStat = namedtuple('IterationStat', ['iter', 'label', 'score'])
 
 MotifInfo = namedtuple('MotifInfo', ['id', 'cluster', 'seqtype', 'num', 'evalue'])
 
-MotifPSSMRow = namedtuple('MotifPSSMRow', ['motif_id', 'row', 'a', 'c', 'g', 't'])
-
 MotifAnnotation = namedtuple('MotifAnnotation', ['motif_info_id', 'seqtype', 'motif_num',
                                                  'gene', 'pos', 'reverse', 'pvalue'])
 
@@ -127,15 +129,6 @@ def read_runlogs():
 def runinfo_factory(cursor, row):
     return RunInfo(*row)
 
-def motifinfo_factory(cursor, row):
-    return MotifInfo(*row)
-
-def motifpssmrow_factory(cursor, row):
-    return MotifPSSMRow(*row)
-
-def motifannot_factory(cursor, row):
-    return MotifAnnotation(*row)
-
 
 def clusterstat_factory(cursor, row):
     return ClusterStat(*row)
@@ -149,6 +142,11 @@ def dbconn():
     return sqlite3.connect(outdb)
 
 
+def open_results(conn):
+    """the cluster members and motifs of the run"""
+    return resultstore.open_results(conn, outdir)
+
+
 def make_int_histogram(counts):
     """input: list of counts
     output: xvalues (count), yvalues (# clusters)"""
@@ -186,11 +184,8 @@ class ClusterViewerApp:
     @cherrypy.expose
     def iteration(self, iteration):
         conn = dbconn()
-        cursor = conn.cursor()
-        cursor.execute('select distinct iteration from row_members')
-        iterations = [row[0] for row in cursor.fetchall()]
+        iterations = open_results(conn).iterations()
         js_iterations = json.dumps(iterations)
-        cursor.close()
 
         cursor = conn.cursor()
         cursor.execute('select median_residual, fuzzy_coeff from iteration_stats')
@@ -249,24 +244,15 @@ class ClusterViewerApp:
     @cherrypy.expose
     def clusters(self, iteration, *args, **kw):
         conn = dbconn()
-        conn.row_factory = motifinfo_factory
-        cursor = conn.cursor()
-        cursor.execute("select rowid, cluster, seqtype, motif_num, evalue from motif_infos where iteration = ?", [iteration])
+        results = open_results(conn)
         # grouped by cluster
         motif_infos = defaultdict(list)
-        for row in cursor.fetchall():
-            motif_infos[row.cluster].append(row)
-        cursor.close()
+        for row in results.motif_infos(int(iteration)):
+            motif_info = MotifInfo(*row)
+            motif_infos[motif_info.cluster].append(motif_info)
 
-        conn.row_factory = motifpssmrow_factory
-        cursor = conn.cursor()
-        cursor.execute("select motif_info_id, row, a, c, g, t from motif_pssm_rows where iteration = ?", [iteration])
         # grouped by motif info id
-        motif_pssm_rows = defaultdict(list)
-        for row in cursor.fetchall():
-            motif_pssm_rows[row.motif_id].append([row.a, row.c, row.g, row.t])
-        
-        cursor.close()
+        motif_pssm_rows = defaultdict(list, results.motif_pssms(int(iteration)))
 
         conn.row_factory = clusterstat_factory
         cursor = conn.cursor()
@@ -297,55 +283,33 @@ class ClusterViewerApp:
         species = cursor.fetchone()[0]
         cursor.close()
 
-        cursor = conn.cursor()
-        cursor.execute('select name from row_names rn join row_members rm on rn.order_num = rm.order_num where iteration = ? and cluster = ?', (iteration, cluster))
-        rows = [row[0] for row in cursor.fetchall()]
-        cursor.close()
-
-        cursor = conn.cursor()
-        cursor.execute('select name from column_names cn join column_members cm on cn.order_num = cm.order_num where iteration = ? and cluster = ?', (iteration, cluster))
-        columns = [row[0] for row in cursor.fetchall()]
-        cursor.close()
+        results = open_results(conn)
+        rows = results.rows_for_cluster(iteration, cluster)
+        columns = results.columns_for_cluster(iteration, cluster)
 
         js_ratios = json.dumps(self.ratios.hs_subratios_for(rows, columns))
 
         # extract motif information
-        conn.row_factory = motifinfo_factory
-        cursor = conn.cursor()
-        cursor.execute("select rowid, cluster, seqtype, motif_num, evalue from motif_infos where iteration = ? and cluster = ?", [iteration, cluster])
         # grouped by seqtype
         motif_infos = defaultdict(list)
-        for row in cursor.fetchall():
-            motif_infos[row.seqtype].append(row)
-        cursor.close()
+        for row in results.motif_infos(iteration, cluster):
+            motif_info = MotifInfo(*row)
+            motif_infos[motif_info.seqtype].append(motif_info)
         seqtypes = motif_infos.keys()
 
-        conn.row_factory = motifpssmrow_factory
-        cursor = conn.cursor()
-        motif_ids = map(lambda i: str(i.id),
-                        [mis for mismis in motif_infos.values() for mis in mismis])
-        cursor.execute("select motif_info_id, row, a, c, g, t from motif_pssm_rows where motif_info_id in (%s)" % ','.join(motif_ids))
         # grouped by motif info id
-        motif_pssm_rows = defaultdict(list)
-        for row in cursor.fetchall():
-            motif_pssm_rows[row.motif_id].append([row.a, row.c, row.g, row.t])
+        all_pssm_rows = results.motif_pssms(iteration)
+        motif_pssm_rows = {mis.id: all_pssm_rows.get(mis.id, [])
+                           for mismis in motif_infos.values() for mis in mismis}
         js_motif_pssms = {motif_id: json.dumps({'alphabet':['A','C','G','T'],
                                                 'values':motif_pssm_rows[motif_id]})
                           for motif_id in motif_pssm_rows}
-        cursor.close()
 
         # annotations
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute('select motif_info_id, count(row) from motif_pssm_rows where iteration = ? group by motif_info_id', [iteration])
-        motif_lengths = {row[0]: row[1] for row in cursor.fetchall()}
-        cursor.close()
-
-        conn.row_factory = motifannot_factory
-        cursor = conn.cursor()
-        cursor.execute('select a.motif_info_id, seqtype, motif_num, g.name, position, reverse, pvalue from motif_annotations a join motif_infos i on a.motif_info_id = i.rowid join row_names g on g.order_num = a.gene_num where i.iteration = ? and i.cluster = ?', [iteration, cluster])
-        annotations = [row for row in cursor.fetchall()]
-        cursor.close()
+        motif_lengths = {motif_id: len(pssm_rows)
+                         for motif_id, pssm_rows in all_pssm_rows.items()}
+        annotations = [MotifAnnotation(*row)
+                       for row in results.motif_annotations(iteration, cluster)]
 
         st_annots = defaultdict(list)  # group by seqtype
         for annot in annotations:
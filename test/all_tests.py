@@ -18,6 +18,15 @@ import meme_test as met
 import pssm_test as pt
 import combiner_test as ct
 import read_wee_test as rwt
+import density_test as dt
+import workerpool_test as wpt
+import jobscheduler_test as jst
+import pssmscan_test as pst
+import contig_store_test as cst
+import stringdb_test as sdt
+import resultdb_test as rdt
+import resultstore_test as rst
+import checkpoint_test as ckt
 import sys
 
 
@@ -52,17 +61,30 @@ if __name__ == '__main__':
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(opnwt.GetOperonPairsTest))
 
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(nwt.NetworkTest))
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(nwt.ComputeNetworkScoresTest))
 
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(omembtest.OrigMembershipTest))
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(mat.ComputeArrayScoresTest))
 
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(met.MemeTest))
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(met.MemeResultCacheTest))
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(pst.PssmScanTest))
 
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(pt.PssmTest))
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(ct.CombinerTest))
 
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(rwt.ReadWeeTest))
 
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(dt.DensityTest))
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(dt.DensityScoresTest))
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(wpt.WorkerPoolTest))
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(jst.JobSchedulerTest))
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(cst.ContigStoreTest))
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(sdt.StringDbTest))
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(rdt.ResultWriterTest))
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(rst.ColumnarResultsTest))
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(ckt.CheckpointTest))
+
     if len(sys.argv) > 1 and sys.argv[1] == 'xml':
       xmlrunner.XMLTestRunner(output='test-reports').run(unittest.TestSuite(SUITE))
     else:
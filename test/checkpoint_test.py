@@ -0,0 +1,129 @@
+"""checkpoint_test.py - unit tests for the checkpoint module
+
+This file is part of cMonkey Python. Please see README and LICENSE for
+more information and licensing details.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import checkpoint as ckpt
+import datamatrix as dm
+import membership as memb
+import motif
+import meme
+
+
+CONFIG_PARAMS = {
+    'memb.clusters_per_row': 2,
+    'memb.clusters_per_col': 2,
+    'num_clusters': 3
+}
+
+
+class CheckpointTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for the checkpoint module"""
+
+    def setUp(self):  # pylint; disable-msg=C0103
+        """test fixture"""
+        self.tmpdir = tempfile.mkdtemp(prefix='checkpoint')
+        self.path = os.path.join(self.tmpdir, 'cmonkey-checkpoint.0100')
+
+    def tearDown(self):  # pylint; disable-msg=C0103
+        """test cleanup"""
+        shutil.rmtree(self.tmpdir)
+
+    def test_save_load(self):
+        """the stored data is restored"""
+        checkpoint = ckpt.Checkpoint(100)
+        checkpoint.put_array('array', np.array([[1, 2], [3, 4]], dtype='int32'))
+        checkpoint.put_names('names', ['R1', 'R2'])
+        checkpoint.put_value('value', {'a': [1, 2.5], 'b': None})
+        checkpoint.put_matrix('matrix', dm.DataMatrix(
+                2, 2, ['R1', 'R2'], ['C1', 'C2'], values=[[1.0, np.nan],
+                                                          [3.0, 4.0]]))
+        checkpoint.save(self.path)
+        self.assertEquals(['cmonkey-checkpoint.0100'], os.listdir(self.tmpdir))
+
+        restored = ckpt.load(self.path)
+        self.assertEquals(100, restored.iteration)
+        self.assertEquals([[1, 2], [3, 4]], restored.get_array('array').tolist())
+        self.assertEquals(['R1', 'R2'], restored.get_names('names'))
+        self.assertEquals({'a': [1, 2.5], 'b': None}, restored.get_value('value'))
+        self.assertEquals(None, restored.get_value('missing'))
+        matrix = restored.get_matrix('matrix')
+        self.assertEquals(['R1', 'R2'], matrix.row_names)
+        self.assertEquals(['C1', 'C2'], matrix.column_names)
+        self.assertEquals(1.0, matrix.values[0][0])
+        self.assertTrue(np.isnan(matrix.values[0][1]))
+        self.assertEquals(None, restored.get_matrix('missing'))
+
+    def test_load_other_file(self):
+        """files that are not checkpoints are not loaded"""
+        with open(self.path, 'w') as outfile:
+            outfile.write('not a checkpoint')
+        self.assertRaises(Exception, ckpt.load, self.path)
+
+    def test_load_other_version(self):
+        """checkpoints of other versions are not loaded"""
+        ckpt.Checkpoint(1).save(self.path)
+        ckpt.CHECKPOINT_VERSION += 1
+        try:
+            self.assertRaises(Exception, ckpt.load, self.path)
+        finally:
+            ckpt.CHECKPOINT_VERSION -= 1
+
+    def test_json_values(self):
+        """only the values that JSON stores unchanged are kept"""
+        self.assertEquals({'num_clusters': 43, 'sequence_types': ['upstream']},
+                          ckpt.json_values({'num_clusters': 43,
+                                            'sequence_types': ['upstream'],
+                                            'distances': (-20, 150),
+                                            'schedule': lambda i: True}))
+
+    def test_membership(self):
+        """the memberships are restored with the cluster indexes"""
+        matrix = dm.DataMatrix(3, 2, ['R1', 'R2', 'R3'], ['C1', 'C2'])
+        membership = memb.OrigMembership(
+            matrix.row_names, matrix.column_names,
+            {'R1': [1, 2], 'R2': [2], 'R3': [3]}, {'C1': [1, 2], 'C2': [3]},
+            CONFIG_PARAMS)
+        membership.add_cluster_to_row('R1', 3, force=True)
+        checkpoint = ckpt.Checkpoint(1)
+        membership.store_checkpoint_data(checkpoint)
+        checkpoint.save(self.path)
+
+        restored = memb.OrigMembership.restore_from_checkpoint(
+            ckpt.load(self.path), matrix, CONFIG_PARAMS)
+        self.assertEquals(membership.row_membs.tolist(),
+                          restored.row_membs.tolist())
+        self.assertEquals(membership.col_membs.tolist(),
+                          restored.col_membs.tolist())
+        self.assertEquals({'R1', 'R3'}, restored.rows_for_cluster(3))
+        self.assertEquals({'C1'}, restored.columns_for_cluster(2))
+
+        other_matrix = dm.DataMatrix(3, 2, ['R1', 'R2', 'R4'], ['C1', 'C2'])
+        self.assertRaises(Exception, memb.OrigMembership.restore_from_checkpoint,
+                          ckpt.load(self.path), other_matrix, CONFIG_PARAMS)
+
+    def test_motif_info_json(self):
+        """motif infos are converted to JSON objects and back"""
+        motif_info = meme.MemeMotifInfo([[0.1, 0.2, 0.3, 0.4]], 1, 1, 2, 30.5,
+                                        0.01, [('VNG0001', '+', 3, 0.001, 'AA',
+                                                'C', 'TT')])
+        checkpoint = ckpt.Checkpoint(1)
+        checkpoint.put_value('motif', motif.motif_info_json(motif_info))
+        checkpoint.save(self.path)
+        restored = motif.make_motif_info(ckpt.load(self.path).get_value('motif'))
+        self.assertEquals(motif_info.pssm, restored.pssm)
+        self.assertEquals(motif_info.sites, restored.sites)
+        self.assertEquals(motif_info.consensus_string(),
+                          restored.consensus_string())
+        self.assertEquals(repr(motif_info), repr(restored))
+
+
+if __name__ == '__main__':
+    SUITE = []
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(CheckpointTest))
+    unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))
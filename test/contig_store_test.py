@@ -0,0 +1,103 @@
+"""contig_store_test.py - unit tests for the ContigStore class
+
+This file is part of cMonkey Python. Please see README and LICENSE for
+more information and licensing details.
+"""
+import unittest
+import os
+import shutil
+import tempfile
+import rsat
+import seqtools as st
+
+
+class ContigStoreTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for ContigStore"""
+
+    def setUp(self):  # pylint: disable-msg=C0103
+        """test fixture"""
+        self.tmpdir = tempfile.mkdtemp(prefix='contigs')
+        self.num_reads = 0
+
+    def tearDown(self):  # pylint: disable-msg=C0103
+        """test cleanup"""
+        shutil.rmtree(self.tmpdir)
+
+    def read_raw(self):
+        """returns a raw contig in lines"""
+        self.num_reads += 1
+        return 'acgtac\nGGTTAA\r\n  ccaa\n'
+
+    def test_get(self):
+        """the contig is normalized, stored and read only once"""
+        store = rsat.ContigStore(self.tmpdir)
+        contig = store.get('Halo', 'chr1', self.read_raw)
+        self.assertEquals(16, len(contig))
+        self.assertEquals('ACGTACGGTTAACCAA', contig[:])
+        self.assertTrue(contig is store.get('Halo', 'chr1', self.read_raw))
+        self.assertEquals(1, self.num_reads)
+
+        # a new store in the same directory uses the stored file
+        contig = rsat.ContigStore(self.tmpdir).get('Halo', 'chr1', self.read_raw)
+        self.assertEquals('ACGTACGGTTAACCAA', contig[:])
+        self.assertEquals(1, self.num_reads)
+
+    def test_get_incomplete(self):
+        """a contig file that does not match the index is stored again"""
+        rsat.ContigStore(self.tmpdir).get('Halo', 'chr1', self.read_raw)
+        with open(os.path.join(self.tmpdir, 'Halo', 'chr1.seq'), 'w') as outfile:
+            outfile.write('ACGT')
+        contig = rsat.ContigStore(self.tmpdir).get('Halo', 'chr1', self.read_raw)
+        self.assertEquals('ACGTACGGTTAACCAA', contig[:])
+        self.assertEquals(2, self.num_reads)
+
+    def test_get_other_source(self):
+        """a contig that was stored from another source is stored again"""
+        rsat.ContigStore(self.tmpdir).get('Halo', 'chr1', self.read_raw,
+                                          source='download')
+        contig = rsat.ContigStore(self.tmpdir).get(
+            'Halo', 'chr1', lambda: 'ttttcc\n', source='file')
+        self.assertEquals('TTTTCC', contig[:])
+        contig = rsat.ContigStore(self.tmpdir).get('Halo', 'chr1', self.read_raw,
+                                                   source='file')
+        self.assertEquals('TTTTCC', contig[:])
+        self.assertEquals(1, self.num_reads)
+
+    def test_rsat_files_changed(self):
+        """RsatFiles stores a contig again when its file changes"""
+        rsat_dir = os.path.join(self.tmpdir, 'rsat')
+        os.makedirs(rsat_dir)
+        contig_path = os.path.join(rsat_dir, 'Halo_chr1')
+        with open(contig_path, 'w') as outfile:
+            outfile.write('acgt\n')
+        cache_dir = os.path.join(self.tmpdir, 'cache')
+        rsat_files = rsat.RsatFiles(rsat_dir, 'Halo', 12345, cache_dir=cache_dir)
+        self.assertEquals('ACGT', rsat_files.get_contig_sequence('Halo', 'chr1')[:])
+
+        with open(contig_path, 'w') as outfile:
+            outfile.write('ggccaa\n')
+        rsat_files = rsat.RsatFiles(rsat_dir, 'Halo', 12345, cache_dir=cache_dir)
+        self.assertEquals('GGCCAA', rsat_files.get_contig_sequence('Halo', 'chr1')[:])
+
+    def test_extract(self):
+        """sequences are extracted from the memory map like from a string"""
+        contig = rsat.ContigStore(self.tmpdir).get('Halo', 'chr1', self.read_raw)
+        seq = 'ACGTACGGTTAACCAA'
+        for location in [st.Location('chr1', 8, 12, False),
+                         st.Location('chr1', 3, 5, True),
+                         st.Location('chr1', 14, 16, True)]:
+            self.assertEquals(st.extract_upstream(seq, location, (-2, 5)),
+                              st.extract_upstream(contig, location, (-2, 5)))
+            self.assertEquals(st.extract_downstream(seq, location, (2, 5)),
+                              st.extract_downstream(contig, location, (2, 5)))
+
+    def test_empty_contig(self):
+        """empty contigs can be stored"""
+        contig = rsat.ContigStore(self.tmpdir).get('Halo', 'chr2', lambda: '\n')
+        self.assertEquals('', contig)
+
+
+if __name__ == '__main__':
+    SUITE = []
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(ContigStoreTest))
+    unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))
@@ -257,6 +257,29 @@ class DataMatrixTest(unittest.TestCase):  # pylint: disable-msg=R0904
                                        [3000, -6000, 9000]])
         self.assertAlmostEqual(4049.38271604938, matrix.residual())
 
+    def test_residuals(self):
+        """the residuals of many clusters are the residuals of the
+        submatrices, NaN values are ignored"""
+        matrix = dm.DataMatrix(3, 4, ['R1', 'R2', 'R3'],
+                               ['C1', 'C2', 'C3', 'C4'],
+                               values=[[1000, -4000, 7000, 10],
+                                       [-2000, 5000, np.nan, 20],
+                                       [3000, -6000, 9000, 30]])
+        row_masks = [[True, True, True], [True, False, True],
+                     [False, False, False]]
+        column_masks = [[True, True, True, False], [False, True, True, True],
+                        [True, True, True, True]]
+        for max_row_variance in [None, 1000.0]:
+            residuals = matrix.residuals(row_masks, column_masks,
+                                         max_row_variance)
+            self.assertAlmostEqual(
+                matrix.submatrix_by_name(['R1', 'R2', 'R3'], ['C1', 'C2', 'C3'])
+                .residual(max_row_variance), residuals[0])
+            self.assertAlmostEqual(
+                matrix.submatrix_by_name(['R1', 'R3'], ['C2', 'C3', 'C4'])
+                .residual(max_row_variance), residuals[1])
+            self.assertTrue(np.isnan(residuals[2]))
+
     def test_residual_var_normalize(self):
         """tests the residual() method. Note that this method
         seems to make rounding errors in the 5th place"""
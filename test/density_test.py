@@ -0,0 +1,119 @@
+"""density_test.py - unit tests for the kernel density estimation
+
+This file is part of cMonkey Python. Please see README and LICENSE for
+more information and licensing details.
+"""
+import unittest
+import numpy as np
+import util
+import datamatrix as dm
+import membership as memb
+
+CONFIG_PARAMS = {'memb.min_cluster_rows_allowed': 3,
+                 'memb.max_cluster_rows_allowed': 70,
+                 'multiprocessing': False,
+                 'memb.clusters_per_row': 2,
+                 'memb.clusters_per_col': int(round(43 * 2.0 / 3.0)),
+                 'num_clusters': 43}
+
+
+def read_members(filename):
+    """reads a membership file from the R reference"""
+    result = {}
+    with open(filename) as infile:
+        for line in infile:
+            row = line.strip().split(' ')
+            result[row[0].replace("\"", "")] = [int(value) for value in row[1:]]
+    return result
+
+
+def read_matrix(filename):
+    """reads a matrix file"""
+    infile = util.read_dfile(filename, has_header=True, quote='\"')
+    return dm.DataMatrixFactory([]).create_from(infile).sorted_by_row_name()
+
+
+class DensityTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Tests for the NumPy density functions in util"""
+
+    KVALUES = [3.4268700450682301, 3.3655160468930152, -8.0654569044842539,
+               2.0762815314005487, 4.8537715329554203, 1.2374476248622075]
+    CLUSTER_VALUES = [-3.5923001345962162, 0.77069901513184735,
+                      -4.942909785931378, -3.1580950032999096]
+    # computed with R's density(bw=2.69474878768, adjust=2, n=256)
+    REF_RESULT = [0.08663036966690765, 0.08809242907902183, 0.49712338305039777,
+                  0.12248549621579163, 0.05708884005243133, 0.14857948193544993]
+
+    def test_density(self):
+        """single problem compared to the R result"""
+        result = util.density(self.KVALUES, self.CLUSTER_VALUES, 2.69474878768,
+                              -13.8848342423, 12.6744452247)
+        for i in range(len(self.REF_RESULT)):
+            self.assertAlmostEquals(self.REF_RESULT[i], result[i], places=12)
+
+    def test_density_batch_padded(self):
+        """rows in a batch are independent and NaN padding is ignored"""
+        kvalues = [self.KVALUES, self.KVALUES]
+        cluster_values = [self.CLUSTER_VALUES + [np.nan, np.nan],
+                          self.CLUSTER_VALUES[:2] + [np.nan] * 4]
+        result = util.density_batch(kvalues, cluster_values,
+                                    [2.69474878768, 1.0],
+                                    [-13.8848342423, -12.0],
+                                    [12.6744452247, 10.0])
+        single = util.density(self.KVALUES, self.CLUSTER_VALUES[:2], 1.0,
+                              -12.0, 10.0)
+        self.assertEquals((2, 6), result.shape)
+        for i in range(len(self.REF_RESULT)):
+            self.assertAlmostEquals(self.REF_RESULT[i], result[0][i], places=12)
+            self.assertAlmostEquals(single[i], result[1][i], places=12)
+
+    def test_density_nan_kvalues(self):
+        """NaN values to evaluate result in NaN, the rest is normalized"""
+        kvalues = list(self.KVALUES)
+        kvalues[1] = np.nan
+        result = util.density(kvalues, self.CLUSTER_VALUES, 2.69474878768,
+                              -13.8848342423, 12.6744452247)
+        self.assertTrue(np.isnan(result[1]))
+        self.assertAlmostEquals(1.0, np.nansum(result))
+
+
+class DensityScoresTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Parity of the density scores with the R reference of iteration 49"""
+
+    def setUp(self):  # pylint; disable-msg=C0103
+        """test fixture"""
+        row_members = read_members('testdata/row_memb-49.tsv')
+        col_members = read_members('testdata/col_memb-49.tsv')
+        self.membership = memb.OrigMembership(sorted(row_members.keys()),
+                                              sorted(col_members.keys()),
+                                              row_members, col_members,
+                                              CONFIG_PARAMS)
+
+    def __check_matrix(self, matrix, ref_matrix):
+        """compares the values of two matrices"""
+        self.assertEquals(ref_matrix.row_names, matrix.row_names)
+        self.assertTrue(np.allclose(ref_matrix.values, matrix.values,
+                                    rtol=0.0, atol=1e-11))
+
+    def test_row_density_scores(self):
+        """row density scores are the same as in R"""
+        row_scores = read_matrix('testdata/combined_scores.tsv')
+        ref_scores = read_matrix('testdata/density_rowscores.tsv')
+        self.__check_matrix(memb.get_row_density_scores(self.membership,
+                                                        row_scores),
+                            ref_scores)
+
+    def test_col_density_scores(self):
+        """column density scores are the same as in R"""
+        col_scores = read_matrix('testdata/combined_colscores.tsv')
+        ref_scores = read_matrix('testdata/density_colscores.tsv')
+        self.__check_matrix(memb.get_col_density_scores(self.membership,
+                                                        col_scores),
+                            ref_scores)
+
+
+if __name__ == '__main__':
+    SUITE = []
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(DensityTest))
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(DensityScoresTest))
+    unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))
@@ -283,8 +283,7 @@ def make_halo(ratio_matrix, search_distances, scan_distances):
 
     nw_factories = []
     if stringfile != None:
-        nw_factories.append(stringdb.get_network_factory2('hal', stringfile, 0.5,
-                                                          normalized=True))
+        nw_factories.append(stringdb.get_network_factory2('hal', stringfile, 0.5))
     else:
         logging.warn("no STRING file specified !")
 
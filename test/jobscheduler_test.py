@@ -0,0 +1,96 @@
+"""jobscheduler_test.py - unit tests for the jobscheduler module
+
+This file is part of cMonkey Python. Please see README and LICENSE for
+more information and licensing details.
+"""
+import unittest
+import subprocess
+import jobscheduler as js
+
+
+def echo_job(text):
+    """runs echo and yields its output without the newline"""
+    output = yield js.Command(['echo', text])
+    yield output.strip()
+
+
+def nested_job(text):
+    """yields the result of another job"""
+    result = yield echo_job(text)
+    yield result.upper()
+
+
+def failing_job():
+    """yields the exit code of a failing command"""
+    try:
+        yield js.Command(['sh', '-c', 'echo broken; exit 3'])
+    except subprocess.CalledProcessError, e:
+        yield (e.returncode, e.output.strip())
+
+
+def recording_job(name, started):
+    """records the order in which the jobs are started"""
+    started.append(name)
+    yield js.Command(['true'])
+    yield name
+
+
+class JobSchedulerTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for JobScheduler"""
+
+    def test_run(self):
+        """the results are returned in the order of the jobs"""
+        scheduler = js.JobScheduler(2)
+        self.assertEquals(['a', 'B', 'c'],
+                          scheduler.run([echo_job('a'), nested_job('b'),
+                                         echo_job('c')]))
+
+    def test_run_job(self):
+        """a single job can be run synchronously"""
+        self.assertEquals('HELLO', js.run_job(nested_job('hello')))
+
+    def test_failing_command(self):
+        """a non-zero exit code is raised in the job"""
+        self.assertEquals((3, 'broken'), js.run_job(failing_job()))
+
+    def test_unchecked_command(self):
+        """commands with check=False report their exit code"""
+        def job():
+            command = js.Command(['sh', '-c', 'exit 2'], check=False)
+            yield command
+            yield command.returncode
+        self.assertEquals(2, js.run_job(job()))
+
+    def test_uncaught_error(self):
+        """errors that a job does not handle are raised by run()"""
+        def job():
+            yield js.Command(['false'])
+        self.assertRaises(subprocess.CalledProcessError,
+                          js.JobScheduler(2).run, [job(), echo_job('a')])
+
+    def test_timeout(self):
+        """commands that take too long are retried and then raise JobTimeout"""
+        def job():
+            try:
+                yield js.Command(['sleep', '10'])
+            except js.JobTimeout:
+                yield 'timeout'
+
+        scheduler = js.JobScheduler(1, timeout=0.2, max_retries=1)
+        self.assertEquals(['timeout'], scheduler.run([job()]))
+
+    def test_largest_first(self):
+        """the jobs with the largest size are started first"""
+        started = []
+        scheduler = js.JobScheduler(1)
+        results = scheduler.run([recording_job(name, started)
+                                 for name in ['small', 'large', 'medium']],
+                                sizes=[1, 10, 5])
+        self.assertEquals(['small', 'large', 'medium'], results)
+        self.assertEquals(['large', 'medium', 'small'], started)
+
+
+if __name__ == '__main__':
+    SUITE = []
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(JobSchedulerTest))
+    unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))
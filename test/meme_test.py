@@ -4,7 +4,11 @@ This file is part of cMonkey Python. Please see README and LICENSE for
 more information and licensing details.
 """
 import meme
+import motif
 import unittest
+import os
+import shutil
+import tempfile
 
 
 class MemeTest(unittest.TestCase):  # pylint: disable-msg=R0904
@@ -115,3 +119,187 @@ class MemeTest(unittest.TestCase):  # pylint: disable-msg=R0904
         self.assertAlmostEquals(0.322, pev[0][1])
         self.assertAlmostEquals(130.0, pev[0][2])
         self.assertTrue('NP_280363.1' in annotations)
+
+
+class CountingMemeSuite(meme.MemeSuite):
+    """a MEME suite that does not run the tools, but counts the calls"""
+
+    def __init__(self, background_file, result_cache, scanner='mast',
+                 motif_infos=[]):
+        meme.MemeSuite.__init__(self, background_file=background_file,
+                                result_cache=result_cache, scanner=scanner)
+        self.num_meme_calls = 0
+        self.database_files = []
+        self.motif_infos = motif_infos
+
+    def meme_job(self, infile_path, bgfile_path, num_motifs,
+                 previous_motif_infos=None, pspfile_path=None):
+        self.num_meme_calls += 1
+        yield (self.motif_infos, 'meme output')
+
+    def mast_job(self, meme_outfile_path, database_file_path, bgfile_path):
+        self.database_files.append(database_file_path)
+        yield 'mast output'
+
+    def read_mast_output(self, mast_output, genes):
+        return ([('F1', 1.0, 0.01)], {'F1': [(0.01, 3, 1)]})
+
+
+class FailingMemeSuite(meme.MemeSuite):
+    """a MEME suite whose MEME run fails, it records its input files"""
+
+    def __init__(self):
+        meme.MemeSuite.__init__(self)
+        self.input_files = []
+
+    def meme_job(self, infile_path, bgfile_path, num_motifs,
+                 previous_motif_infos=None, pspfile_path=None):
+        self.input_files = [infile_path, bgfile_path]
+        raise Exception('MEME failed')
+        yield None
+
+
+class CountingOrganism:
+    """an organism that counts the sequence retrievals"""
+
+    def __init__(self):
+        self.code = 'hal'
+        self.num_calls = 0
+        self.seqs = {'F1': ('loc1', 'ACGTACGTTT'), 'F2': ('loc2', 'TTTTAAAAGC')}
+
+    def scan_sequences(self, genes, seqtype):
+        self.num_calls += 1
+        return dict(self.seqs)
+
+
+class MemeResultCacheTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for MemeResultCache"""
+
+    def setUp(self):  # pylint; disable-msg=C0103
+        """test fixture"""
+        self.tmpdir = tempfile.mkdtemp(prefix='memecache')
+        self.cache = meme.MemeResultCache(os.path.join(self.tmpdir, 'cache'),
+                                          1024 * 1024, '4.3.0')
+
+    def tearDown(self):  # pylint; disable-msg=C0103
+        """test cleanup"""
+        shutil.rmtree(self.tmpdir)
+
+    def test_get_put(self):
+        """stored results are returned by their key, unknown keys are misses"""
+        key = self.cache.make_key('ACGT', 2)
+        self.assertIsNone(self.cache.get(key))
+        self.cache.put(key, meme.MemeRunResult([1], {}, []))
+        self.assertEquals(meme.MemeRunResult([1], {}, []), self.cache.get(key))
+        self.assertNotEquals(key, self.cache.make_key('ACGT', 3))
+        self.assertNotEquals(key, meme.MemeResultCache(
+            self.cache.cache_dir, 1024, '4.9.0').make_key('ACGT', 2))
+
+    def test_evict_least_recently_used(self):
+        """the least recently used results are removed first"""
+        self.cache.put('old', meme.MemeRunResult([], {}, []))
+        self.cache.put('new', meme.MemeRunResult([], {}, []))
+        os.utime(os.path.join(self.cache.cache_dir, 'old.pkl'), (1000, 1000))
+        os.utime(os.path.join(self.cache.cache_dir, 'new.pkl'), (2000, 2000))
+        self.cache.get('old')
+        self.cache.max_bytes = os.path.getsize(
+            os.path.join(self.cache.cache_dir, 'old.pkl'))
+        self.cache.evict()
+        self.assertIsNotNone(self.cache.get('old'))
+        self.assertIsNone(self.cache.get('new'))
+
+    def __make_params(self, meme_suite):
+        """creates the parameters for a MEME run"""
+        used_seqs = {'F1': ('loc1', 'ACGTACGT'), 'F2': ('loc2', 'TTTTAAAA')}
+        return motif.ComputeScoreParams(1, 1, ['F1', 'F2'],
+                                        {'F1': 'ACGTACGT', 'F2': 'TTTTAAAA'},
+                                        used_seqs, meme_suite, 3, 70, 2, None,
+                                        False, self.tmpdir, 2000, False)
+
+    def __make_background_file(self):
+        """writes a background file"""
+        bgfile = os.path.join(self.tmpdir, 'bgfile')
+        with open(bgfile, 'w') as outfile:
+            outfile.write('A 0.25\nC 0.25\nG 0.25\nT 0.25\n')
+        return bgfile
+
+    def test_meme_suite_uses_cache(self):
+        """MEME is only run once for the same input"""
+        meme_suite = CountingMemeSuite(self.__make_background_file(), self.cache)
+        params = self.__make_params(meme_suite)
+        result = meme_suite(params)
+        self.assertEquals(result, meme_suite(params))
+        self.assertEquals(1, meme_suite.num_meme_calls)
+        meme_suite(params._replace(num_motifs=1))
+        self.assertEquals(2, meme_suite.num_meme_calls)
+
+    def test_used_seqs_digest(self):
+        """the digest is computed once for each sequence dictionary"""
+        meme_suite = CountingMemeSuite(self.__make_background_file(), self.cache)
+        used_seqs = {'F1': ('loc1', 'ACGTACGT'), 'F2': ('loc2', 'TTTTAAAA')}
+        digest = meme_suite.used_seqs_digest(used_seqs)
+        used_seqs['F3'] = ('loc3', 'GGGGCCCC')
+        self.assertEquals(digest, meme_suite.used_seqs_digest(used_seqs))
+        self.assertNotEquals(digest, meme_suite.used_seqs_digest(dict(used_seqs)))
+
+    def test_meme_suite_shares_database(self):
+        """the MAST database is written once and removed by cleanup()"""
+        meme_suite = CountingMemeSuite(self.__make_background_file(), None)
+        params = self.__make_params(meme_suite)
+        meme_suite(params)
+        meme_suite(params._replace(cluster=2))
+        self.assertEquals(2, len(meme_suite.database_files))
+        dbfile = meme_suite.database_files[0]
+        self.assertEquals(dbfile, meme_suite.database_files[1])
+        self.assertTrue(os.path.exists(dbfile))
+        meme_suite.cleanup()
+        self.assertFalse(os.path.exists(dbfile))
+
+    def test_meme_suite_removes_files_on_error(self):
+        """the sequence and background files are removed when MEME fails"""
+        meme_suite = FailingMemeSuite()
+        self.assertRaises(Exception, meme_suite,
+                          self.__make_params(meme_suite))
+        self.assertEquals(2, len(meme_suite.input_files))
+        for path in meme_suite.input_files:
+            self.assertFalse(os.path.exists(path))
+
+    def test_global_background_cached(self):
+        """the global background is computed once and reused for the same
+        organism, sequence type and sequences"""
+        organism = CountingOrganism()
+        bgfile = meme.global_background_file(organism, ['F1', 'F2'], 'upstream',
+                                             cache_dir=self.tmpdir)
+        with open(bgfile) as infile:
+            self.assertTrue(infile.read().startswith(
+                    '# 3rd order Markov background model'))
+        with open(bgfile, 'w') as outfile:
+            outfile.write('cached')
+        self.assertEquals(bgfile, meme.global_background_file(
+                organism, ['F2', 'F1'], 'upstream', cache_dir=self.tmpdir))
+        with open(bgfile) as infile:
+            self.assertEquals('cached', infile.read())
+        self.assertNotEquals(bgfile, meme.global_background_file(
+                organism, ['F1', 'F2'], 'downstream', cache_dir=self.tmpdir))
+
+    def test_global_background_sequences_changed(self):
+        """a background computed on other sequences, e.g. without the
+        operon shift, is not reused"""
+        organism = CountingOrganism()
+        bgfile = meme.global_background_file(organism, ['F1', 'F2'], 'upstream',
+                                             cache_dir=self.tmpdir)
+        organism.seqs['F2'] = ('loc3', 'GGGGCCCCAT')
+        self.assertNotEquals(bgfile, meme.global_background_file(
+                organism, ['F1', 'F2'], 'upstream', cache_dir=self.tmpdir))
+
+    def test_meme_suite_pssm_scanner(self):
+        """the pssm scanner searches the motifs without MAST"""
+        with open('testdata/meme.out') as inputfile:
+            motif_infos = meme.read_meme_output(inputfile.read(), 2)
+        meme_suite = CountingMemeSuite(self.__make_background_file(), None,
+                                       scanner='pssm', motif_infos=motif_infos)
+        result = meme_suite(self.__make_params(meme_suite))
+        self.assertEquals([], meme_suite.database_files)
+        self.assertEquals(['F1', 'F2'],
+                          sorted(name for name, _, _ in result.pe_values))
+        self.assertEquals(motif_infos, result.motif_infos)
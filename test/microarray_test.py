@@ -73,6 +73,44 @@ class ComputeArrayScoresTest(unittest.TestCase):
         print "(comparing computed with reference results...)"
         self.__compare_with_refresult(refresult, result)
 
+    def test_compute_row_scores_vectorized(self):
+        membership = self.__read_members()
+        ratios = self.__read_ratios()
+        refresult = self.__read_rowscores_refresult()
+        result = ma.compute_row_scores(membership, ratios, 43, False,
+                                       vectorized=True)
+        single = ma.compute_row_scores(membership, ratios, 43, False)
+        self.assertTrue(numpy.array_equal(numpy.isnan(single.values),
+                                          numpy.isnan(result.values)))
+        self.assertTrue(numpy.allclose(single.values, result.values,
+                                       rtol=0.0, atol=0.0, equal_nan=True))
+        result.fix_extreme_values()
+        self.__compare_with_refresult(refresult, result)
+
+    def test_compute_row_scores_vectorized_near_duplicates(self):
+        """rows that are identical or very close to the cluster's column
+        means get exactly the scores of the submatrix based computation"""
+        ratios = dm.DataMatrix(4, 3, ['R1', 'R2', 'R3', 'R4'],
+                               ['C1', 'C2', 'C3'],
+                               values=[[1.5, -0.25, 2.0],
+                                       [1.5, -0.25, 2.0 + 2e-9],
+                                       [1.5, -0.25, 2.0 + 1e-9],
+                                       [1.5, numpy.nan, 2.0]])
+        membership = memb.OrigMembership(
+            ratios.row_names, ratios.column_names,
+            {'R1': [1], 'R2': [1], 'R3': [2], 'R4': [2]},
+            {'C1': [1, 2], 'C2': [1, 2], 'C3': [1, 2]},
+            {'memb.num_clusters': 2, 'memb.clusters_per_row': 1,
+             'memb.clusters_per_col': 2})
+        result = ma.compute_row_scores(membership, ratios, 2, False,
+                                       vectorized=True)
+        compute_for_submatrix = getattr(ma, '__compute_row_scores_for_submatrix')
+        for cluster, rows in [(1, ['R1', 'R2']), (2, ['R3', 'R4'])]:
+            expected = compute_for_submatrix(
+                ratios, ratios.submatrix_by_name(row_names=rows))
+            self.assertEquals(expected.tolist(),
+                              result.values[:, cluster - 1].tolist())
+
     def test_compute_column_scores(self):
         membership = self.__read_members()
         ratios = self.__read_ratios()
@@ -80,6 +118,41 @@ class ComputeArrayScoresTest(unittest.TestCase):
         result = scoring.compute_column_scores(membership, ratios, 43)
         self.__compare_with_refresult(refresult, result)
 
+    def test_compute_row_scores_cached(self):
+        """after a membership change, the cached row scores are the same
+        as the ones computed from scratch"""
+        membership = self.__read_members()
+        ratios = self.__read_ratios()
+        cache = scoring.ClusterScoreCache(scoring.row_column_versions)
+        ma.compute_row_scores(membership, ratios, 43, False, cache=cache)
+        row = membership.row_names[0]
+        old_cluster = membership.row_membs[0][0]
+        new_cluster = 1 if old_cluster != 1 else 2
+        membership.replace_row_cluster(row, 0, new_cluster)
+        self.assertEquals(sorted([old_cluster, new_cluster]),
+                          sorted(cache.dirty_clusters(membership,
+                                                      range(1, 44))))
+        result = ma.compute_row_scores(membership, ratios, 43, False,
+                                       cache=cache)
+        single = ma.compute_row_scores(membership, ratios, 43, False)
+        self.assertTrue(numpy.allclose(single.values, result.values,
+                                       rtol=0.0, atol=0.0, equal_nan=True))
+
+    def test_compute_column_scores_cached(self):
+        """cached column scores are the same as the ones computed from
+        scratch"""
+        membership = self.__read_members()
+        ratios = self.__read_ratios()
+        cache = scoring.ClusterScoreCache(scoring.row_versions)
+        scoring.compute_column_scores(membership, ratios, 43, cache=cache)
+        row = membership.row_names[0]
+        membership.replace_row_cluster(row, 0, 1 if membership.row_membs[0][0] != 1 else 2)
+        result = scoring.compute_column_scores(membership, ratios, 43,
+                                               cache=cache)
+        single = scoring.compute_column_scores(membership, ratios, 43)
+        self.assertTrue(numpy.allclose(single.values, result.values,
+                                       rtol=0.0, atol=0.0, equal_nan=True))
+
     def __compare_with_refresult(self, refresult, result):
         self.assertEquals(refresult.num_rows, result.num_rows)
         self.assertEquals(refresult.num_columns, result.num_columns)
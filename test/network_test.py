@@ -4,9 +4,27 @@ This file is part of cMonkey Python. Please see README and LICENSE for
 more information and licensing details.
 """
 import unittest
+import numpy as np
 import network as nw
 
 
+class MockOrganism:
+    """mock organism with a thesaurus"""
+
+    def __init__(self, synonyms):
+        self.synonyms = synonyms
+
+    def thesaurus(self):
+        return self.synonyms
+
+
+class MockRatios:
+    """mock ratio matrix"""
+
+    def __init__(self, row_names):
+        self.row_names = row_names
+
+
 class NetworkTest(unittest.TestCase):  # pylint: disable-msg=R0904
     """Test class for Network"""
 
@@ -32,6 +50,12 @@ class NetworkTest(unittest.TestCase):  # pylint: disable-msg=R0904
         self.assertEquals(714, network.total_score())
         self.assertEquals(234, network.weight)
 
+    def test_first_unique_edges(self):
+        """the first occurrence of each undirected edge is kept"""
+        self.assertEquals([0, 1, 3], nw.first_unique_edges(
+                np.array([0, 2, 1, 0], dtype='int32'),
+                np.array([1, 1, 0, 2], dtype='int32'), 3).tolist())
+
     def test_create_overlapping_edges(self):
         """tests creating a network using the standard factory method
         no duplicate edge will be generated"""
@@ -69,4 +93,57 @@ class NetworkTest(unittest.TestCase):  # pylint: disable-msg=R0904
         res_edges = network.edges_with_node('n3')
         self.assertEquals(1, len(res_edges))
         self.assertTrue(edge2 in res_edges)
-        
+
+    def test_create_filtered(self):
+        """only edges with a node in the thesaurus and the ratios are kept,
+        self edges are left out"""
+        edges = [('n1', 'n2', 1.0), ('n3', 'n4', 2.0), ('n2', 'n2', 3.0),
+                 ('s1', 'n5', 4.0), ('n5', 'n1', 5.0)]
+        organism = MockOrganism({'n1': 'N1', 'n2': 'N2', 'n3': 'N3',
+                                 's1': 'N5', 'n5': 'N5'})
+        network = nw.Network.create('network', edges, 1.0, organism,
+                                    MockRatios(['n2', 'n5']), check_size=False)
+        self.assertEquals([('n1', 'n2', 1.0), ('s1', 'n5', 4.0),
+                           ('n5', 'n1', 5.0)], network.edges)
+
+    def test_validate(self):
+        """the nodes are renamed to their primary names"""
+        edges = [('s1', 'n2', 1.0), ('n3', 's1', 2.0)]
+        network = nw.Network('network', edges, 1.0, 0)
+        network.validate({'s1': 'n1', 'n1': 'n1'}, ['n1', 'n2'])
+        self.assertEquals([('n1', 'n2', 1.0), ('n3', 'n1', 2.0)], network.edges)
+        self.assertEquals(2, len(network.edges_with_node('n1')))
+        self.assertRaises(Exception, network.validate, {},
+                          ['g1', 'g2', 'g3', 'n2'])
+
+    def test_adjacency_matrix(self):
+        """the adjacency matrix is symmetric and restricted to the genes"""
+        edges = [('n1', 'n2', 1.0), ('n3', 'n2', 2.0), ('n4', 'n1', 3.0)]
+        network = nw.Network('network', edges, 1.0, 0)
+        adjacency = network.adjacency_matrix(['n2', 'n1', 'n3'])
+        self.assertEquals([[0.0, 1.0, 2.0], [1.0, 0.0, 0.0], [2.0, 0.0, 0.0]],
+                          adjacency.toarray().tolist())
+        self.assertTrue(adjacency is network.adjacency_matrix(['n2', 'n1', 'n3']))
+        network.normalize_scores_to(24.0)
+        self.assertEquals(2.0, network.adjacency_matrix(['n2', 'n1', 'n3'])[0, 1])
+
+
+class ComputeNetworkScoresTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for compute_network_scores()"""
+
+    def test_compute_network_scores(self):
+        """-log(1 + edge weight sum / cluster size) for each gene and cluster"""
+        genes = ['g1', 'g2', 'g3', 'g4']
+        edges = [('g1', 'g2', 2.0), ('g1', 'g3', 4.0), ('g4', 'g2', 1.0)]
+        network = nw.Network('network', edges, 1.0, 0)
+        membership_matrix = np.array([[True, False, False],
+                                      [True, True, False],
+                                      [False, True, False],
+                                      [False, False, False]])
+        scores = nw.compute_network_scores(network.adjacency_matrix(genes),
+                                           membership_matrix)
+        expected = -np.log(np.array([[1.0 + 1.0, 1.0 + 3.0, 1.0],
+                                     [1.0 + 1.0, 1.0, 1.0],
+                                     [1.0 + 2.0, 1.0, 1.0],
+                                     [1.0 + 0.5, 1.0 + 0.5, 1.0]]))
+        self.assertTrue(np.allclose(expected, scores))
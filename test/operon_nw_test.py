@@ -84,6 +84,15 @@ class ReadOperonNetworkTest(unittest.TestCase):  # pylint: disable-msg=R0904
         self.assertEquals([['VNG0001', 'VNG0003'],
                            ['VNG0007', 'VNG0008', 'VNG0009']], operons)
 
+    def test_build_operons_linked(self):
+        """a pair that links two operons adds its second gene to the first
+        operon of its first gene, the operons are not merged"""
+        names1 = ['VNG0001', 'VNG0005', 'VNG0002']
+        names2 = ['VNG0002', 'VNG0006', 'VNG0005']
+        operons = mo.build_operons(names1, names2)
+        self.assertEquals([['VNG0001', 'VNG0002', 'VNG0005'],
+                           ['VNG0005', 'VNG0006']], operons)
+
     def test_make_operon_edges_forward(self):
         """test when all genes of the operon are on the forward strand"""
         operon = ['gene1', 'gene2', 'gene3']
@@ -5,6 +5,9 @@ This file is part of cMonkey Python. Please see README and LICENSE for
 more information and licensing details.
 """
 import unittest
+import os
+import shutil
+import tempfile
 import util
 import network as nw
 import organism as org
@@ -61,6 +64,8 @@ class MockRsatDatabase:
 
     def __init__(self, html):
         self.html = html
+        self.num_feature_reads = 0
+        self.num_contig_reads = 0
 
     def get_directory(self):
         """returns the directory listing's html text"""
@@ -75,6 +80,7 @@ class MockRsatDatabase:
 
     def get_features(self, _):
         """returns a fake feature.tab file"""
+        self.num_feature_reads += 1
         return ('-- comment\n' +
                 'NP_206803.1\tCDS\tnusB\tNC_000915.1\t123\t456\tD\n' +
                 'NP_206804.1\tCDS\tnusC\tNC_000915.1\t234\t789\tR\n')
@@ -87,6 +93,7 @@ class MockRsatDatabase:
 
     def get_contig_sequence(self, organism, contig):
         """return a contig sequence"""
+        self.num_contig_reads += 1
         return "ACGTTTAAAAGAGAGAGAGACACAGTATATATTTTTTTAAAA"
 
 
@@ -191,6 +198,76 @@ class MicrobeTest(unittest.TestCase):  # pylint: disable-msg=R0904
                            'ACGTTTAAAAGAGAGAGAGACACAGTATATATTTTTTTAAAA'),
                           scan_seqs['NP_206803.1'])
 
+    def test_features_cached(self):
+        """the feature file is parsed once and the index is stored in the
+        cache directory"""
+        cache_dir = tempfile.mkdtemp(prefix='organism')
+        try:
+            def make_organism(rsatdb):
+                return org.Microbe('hal', 'Halobacterium SP',
+                                   org.RsatSpeciesInfo(rsatdb,
+                                                       'Halobacterium_SP',
+                                                       12345),
+                                   12345, MockMicrobesOnline(), [],
+                                   SEARCH_DISTANCES, SCAN_DISTANCES,
+                                   cache_dir=cache_dir)
+            rsatdb = MockRsatDatabase('')
+            organism = make_organism(rsatdb)
+            features = organism.features_for_genes(['VNG12345G', 'unknown'])
+            organism.features_for_genes(['NP_206804.1'])
+            self.assertEquals(1, rsatdb.num_feature_reads)
+            self.assertEquals(st.Location('NC_000915.1', 123, 456, False),
+                              features['VNG12345G'].location)
+            self.assertTrue(os.path.exists(os.path.join(
+                        cache_dir, 'Halobacterium_SP_features.pkl')))
+            cached = make_organism(MockRsatDatabase('')).features_for_genes(
+                ['VNG12345G'])
+            self.assertEquals(features['VNG12345G'], cached['VNG12345G'])
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_operon_map_cached(self):
+        """the operon map is stored in the cache directory and read from
+        there by the next organism"""
+        cache_dir = tempfile.mkdtemp(prefix='organism')
+        try:
+            def make_organism():
+                return org.Microbe('hal', 'Halobacterium SP',
+                                   org.RsatSpeciesInfo(MockRsatDatabase(''),
+                                                       'Halobacterium_SP',
+                                                       12345),
+                                   12345, MockMicrobesOnline(), [],
+                                   SEARCH_DISTANCES, SCAN_DISTANCES,
+                                   cache_dir=cache_dir)
+            operon_map = make_organism().operon_map()
+            cache_path = os.path.join(cache_dir, 'Halobacterium_SP_operons.pkl')
+            self.assertTrue(os.path.exists(cache_path))
+            mtime = os.path.getmtime(cache_path)
+            self.assertEquals(operon_map, make_organism().operon_map())
+            self.assertEquals(mtime, os.path.getmtime(cache_path))
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_precompute_sequences(self):
+        """the precomputed sequences are the same as the computed ones and
+        looking them up does not extract them again"""
+        rsatdb = MockRsatDatabase('')
+        organism = org.Microbe('hal', 'Halobacterium SP',
+                               org.RsatSpeciesInfo(rsatdb, 'Halobacterium_SP',
+                                                   12345),
+                               12345, MockMicrobesOnline(), [],
+                               SEARCH_DISTANCES, SCAN_DISTANCES)
+        genes = ['VNG12345G', 'NP_206804.1', 'unknown']
+        search_seqs = organism.sequences_for_genes_search(genes, seqtype='upstream')
+        scan_seqs = organism.sequences_for_genes_scan(genes, seqtype='upstream')
+        organism.precompute_sequences(genes, ['upstream'])
+        num_contig_reads = rsatdb.num_contig_reads
+        self.assertEquals(search_seqs, organism.search_sequences(genes, 'upstream'))
+        self.assertEquals(scan_seqs, organism.scan_sequences(genes, 'upstream'))
+        self.assertEquals({'NP_206803.1': search_seqs['NP_206803.1']},
+                          organism.search_sequences(['VNG12345G'], 'upstream'))
+        self.assertEquals(num_contig_reads, rsatdb.num_contig_reads)
+
     def test_get_networks(self):
         """tests the networks() method"""
         organism = self.organism
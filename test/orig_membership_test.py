@@ -183,6 +183,46 @@ class OrigMembershipTest(unittest.TestCase):
         self.assertEquals({1, 3}, m.clusters_for_row('R1'))
         self.assertEquals({'R1'}, m.rows_for_cluster(3))
 
+    def test_replace_row_cluster_duplicate(self):
+        """replacing one of two identical slots keeps the row in the cluster"""
+        m = memb.OrigMembership(['R1', 'R2'], ['C1', 'C2'],
+                                {'R1': [1, 1], 'R2': [1]}, {'C1': [3], 'C2': []},
+                                CONFIG_PARAMS)
+        m.replace_row_cluster('R1', 0, 2)
+        self.assertEquals({'R1', 'R2'}, m.rows_for_cluster(1))
+        self.assertEquals({'R1'}, m.rows_for_cluster(2))
+        m.replace_row_cluster('R1', 1, 2)
+        self.assertEquals({'R2'}, m.rows_for_cluster(1))
+        self.assertEquals(1, m.num_row_members(2))
+
+    def test_indexes_for_cluster(self):
+        """the index arrays are sorted and follow membership changes"""
+        m = memb.OrigMembership(['R1', 'R2', 'R3'], ['C1', 'C2'],
+                                {'R1': [], 'R2': [], 'R3': [4]}, {'C1': [3], 'C2': [3]},
+                                CONFIG_PARAMS)
+        m.add_cluster_to_row('R2', 4)
+        self.assertEquals([1, 2], m.row_indexes_for_cluster(4).tolist())
+        self.assertEquals([], m.row_indexes_for_cluster(7).tolist())
+        self.assertEquals([0, 1], m.column_indexes_for_cluster(3).tolist())
+        m.replace_column_cluster('C1', 0, 5)
+        self.assertEquals([1], m.column_indexes_for_cluster(3).tolist())
+        self.assertEquals({'C1'}, m.columns_for_cluster(5))
+
+    def test_versions(self):
+        """the versions only change for the clusters that were modified"""
+        m = memb.OrigMembership(['R1', 'R2'], ['C1', 'C2'],
+                                {'R1': [1, 1], 'R2': [2]}, {'C1': [3], 'C2': []},
+                                CONFIG_PARAMS)
+        row_versions = [m.row_version(cluster) for cluster in range(1, 4)]
+        col_version = m.column_version(3)
+        m.replace_row_cluster('R1', 0, 2)
+        self.assertEquals(row_versions[2], m.row_version(3))
+        self.assertNotEquals(row_versions[1], m.row_version(2))
+        # R1 is still in cluster 1 through its second slot
+        self.assertEquals(row_versions[0], m.row_version(1))
+        m.add_cluster_to_column('C2', 3)
+        self.assertNotEquals(col_version, m.column_version(3))
+
     def test_free_slots_for_row(self):
         """Happy path for add_cluster_to_row()"""
         m = memb.OrigMembership(['R1', 'R2'], ['C1', 'C2'],
@@ -0,0 +1,115 @@
+"""pssmscan_test.py - unit tests for the pssmscan module
+
+This file is part of cMonkey Python. Please see README and LICENSE for
+more information and licensing details.
+"""
+import math
+import itertools
+import unittest
+import numpy as np
+import meme
+import pssmscan
+
+
+COMPLEMENT = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A'}
+
+
+def revcomp(seq):
+    """the reverse complement of a sequence"""
+    return ''.join(COMPLEMENT[letter] for letter in reversed(seq))
+
+
+class PssmScanTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for pssmscan"""
+
+    def setUp(self):  # pylint; disable-msg=C0103
+        """test fixture"""
+        with open('testdata/meme.out') as inputfile:
+            self.motif_infos = meme.read_meme_output(inputfile.read(), 2)
+        self.bg_freqs = pssmscan.read_background_frequencies('testdata/meme1.bg')
+        # the sites of the first motif in their MEME context
+        self.sites = self.motif_infos[0].sites
+        self.seqs = [(site[0], site[4] + site[5] + site[6])
+                     for site in self.sites]
+
+    def test_read_background_frequencies(self):
+        """the 0-order frequencies are read in ACGT order"""
+        self.assertAlmostEquals(1.0, self.bg_freqs.sum())
+        self.assertAlmostEquals(self.bg_freqs[0], self.bg_freqs[3])
+        self.assertAlmostEquals(self.bg_freqs[1], self.bg_freqs[2])
+        self.assertTrue(self.bg_freqs[0] < self.bg_freqs[1])
+
+    def test_score_pvalues(self):
+        """the p-values are the tail probabilities of all words"""
+        scores = np.array([[0, 3, 1, 2], [2, 0, 0, 1], [1, 1, 3, 0]])
+        bg_freqs = np.array([0.1, 0.2, 0.3, 0.4])
+        pvalues = pssmscan.score_pvalues(scores, bg_freqs)
+        expected = np.zeros(len(pvalues))
+        for word in itertools.product(range(4), repeat=3):
+            score = sum(scores[col][letter] for col, letter in enumerate(word))
+            expected[:score + 1] += np.prod(bg_freqs[list(word)])
+        self.assertTrue(np.allclose(expected, pvalues))
+
+    def test_combined_pvalues(self):
+        """the combined p-value of a single motif is its p-value"""
+        pvalues = np.array([[0.01, 0.2], [0.5, 1.0]])
+        result = pssmscan.combined_pvalues(pvalues)
+        for i in range(2):
+            product = pvalues[i].prod()
+            self.assertAlmostEquals(product * (1.0 - math.log(product)),
+                                    result[i])
+        self.assertTrue(np.allclose([0.01, 0.5],
+                                    pssmscan.combined_pvalues(pvalues[:, :1])))
+
+    def test_scan_meme_sites(self):
+        """the best hits are the MEME sites, ordered like their MEME p-values"""
+        database = pssmscan.SequenceDatabase(self.seqs)
+        pevalues, annotations = pssmscan.scan(
+            self.motif_infos[:1], database, self.bg_freqs,
+            [name for name, _ in self.seqs])
+        self.assertEquals([site[0] for site in self.sites],
+                          [name for name, _, _ in pevalues])
+        for name, pvalue, evalue in pevalues:
+            self.assertAlmostEquals(1.0, evalue / (pvalue * len(self.seqs)))
+        for site in self.sites:
+            hits = annotations[site[0]]
+            self.assertEquals(1, len(hits))
+            self.assertEquals(len(site[4]) + 3, hits[0][1])
+            self.assertEquals(1, hits[0][2])
+
+    def test_scan_reverse_complement(self):
+        """a sequence and its reverse complement have the same p-value and
+        the hits on the reverse strand have negative motif numbers"""
+        database = pssmscan.SequenceDatabase(
+            [(name, revcomp(seq)) for name, seq in self.seqs])
+        pevalues, annotations = pssmscan.scan(
+            self.motif_infos[:1], database, self.bg_freqs, ['NP_395673.1'])
+        forward, _ = pssmscan.scan(
+            self.motif_infos[:1], pssmscan.SequenceDatabase(self.seqs),
+            self.bg_freqs, [])
+        self.assertEquals(forward, pevalues)
+        self.assertEquals(-1, annotations['NP_395673.1'][0][2])
+        self.assertEquals([], annotations['NP_395728.1'])
+
+    def test_scan_without_sequences(self):
+        """an empty database has no results"""
+        self.assertEquals(([], {}), pssmscan.scan(
+            self.motif_infos, pssmscan.SequenceDatabase([]), self.bg_freqs, []))
+
+    def test_scan_short_sequences(self):
+        """sequences that are shorter than the motifs get a p-value of 1"""
+        database = pssmscan.SequenceDatabase(self.seqs + [('short', 'ACGT'),
+                                                          ('empty', '')])
+        pevalues, annotations = pssmscan.scan(self.motif_infos, database,
+                                              self.bg_freqs, ['short'])
+        pvalues = dict((name, pvalue) for name, pvalue, _ in pevalues)
+        self.assertEquals(1.0, pvalues['short'])
+        self.assertEquals(1.0, pvalues['empty'])
+        self.assertEquals([], annotations['short'])
+        self.assertTrue(pvalues['NP_395673.1'] < 1e-6)
+
+
+if __name__ == '__main__':
+    SUITE = []
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(PssmScanTest))
+    unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))
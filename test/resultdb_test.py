@@ -0,0 +1,108 @@
+"""resultdb_test.py - unit tests for the resultdb module
+
+This file is part of cMonkey Python. Please see README and LICENSE for
+more information and licensing details.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import resultdb
+
+
+class ResultWriterTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for ResultWriter"""
+
+    def setUp(self):  # pylint; disable-msg=C0103
+        """test fixture"""
+        self.tmpdir = tempfile.mkdtemp(prefix='resultdb')
+        self.writer = resultdb.ResultWriter(os.path.join(self.tmpdir, 'out.db'))
+        conn = self.writer.connection()
+        conn.execute('create table motif_infos (iteration int, motif_num int)')
+        conn.execute('create table motif_pssm_rows (motif_info_id int, row int)')
+        conn.execute('create table run_infos (last_iteration int)')
+
+    def tearDown(self):  # pylint; disable-msg=C0103
+        """test cleanup"""
+        self.writer.close()
+        shutil.rmtree(self.tmpdir)
+
+    def __query(self, sql):
+        """the rows of a query on the database"""
+        cursor = self.writer.connection().execute(sql)
+        result = cursor.fetchall()
+        cursor.close()
+        return result
+
+    def test_wal_mode(self):
+        """the database uses write-ahead logging"""
+        self.assertEquals([('wal',)], self.__query('pragma journal_mode'))
+
+    def test_flush(self):
+        """the buffered rows are written on flush"""
+        self.writer.insert_many('motif_pssm_rows', ['motif_info_id', 'row'],
+                                [(1, 0), (1, 1)])
+        self.writer.insert('motif_pssm_rows', ['motif_info_id', 'row'], (2, 0))
+        self.writer.insert('run_infos', ['last_iteration'], (0,))
+        self.writer.add('update run_infos set last_iteration = ?', (3,))
+        self.assertEquals([], self.__query('select * from motif_pssm_rows'))
+        self.writer.flush()
+        self.assertEquals([(1, 0), (1, 1), (2, 0)],
+                          self.__query('select * from motif_pssm_rows'))
+        self.assertEquals([(3,)], self.__query('select * from run_infos'))
+        self.writer.flush()
+        self.assertEquals(3, len(self.__query('select * from motif_pssm_rows')))
+
+    def test_next_id(self):
+        """buffered rows can refer to the ids of other buffered rows"""
+        self.writer.connection().execute(
+            'insert into motif_infos (iteration, motif_num) values (1, 1)')
+        for motif_num in [1, 2]:
+            motif_info_id = self.writer.next_id('motif_infos')
+            self.writer.insert('motif_infos', ['rowid', 'iteration', 'motif_num'],
+                               (motif_info_id, 2, motif_num))
+            self.writer.insert('motif_pssm_rows', ['motif_info_id', 'row'],
+                               (motif_info_id, 0))
+        self.writer.flush()
+        self.assertEquals([(2, 1), (3, 2)], self.__query(
+                '''select p.motif_info_id, i.motif_num from motif_pssm_rows p
+                   join motif_infos i on p.motif_info_id = i.rowid'''))
+
+    def test_flush_async(self):
+        """the tasks run in the writer thread in the order they were
+        submitted"""
+        results = []
+        self.writer.insert('run_infos', ['last_iteration'], (1,))
+        self.writer.flush_async()
+        self.writer.submit(lambda: results.append(
+                self.__query('select * from run_infos')))
+        self.writer.add('update run_infos set last_iteration = ?', (2,))
+        self.writer.flush_async()
+        self.writer.submit(lambda: results.append(
+                self.__query('select * from run_infos')))
+        self.writer.wait()
+        self.assertEquals([[(1,)], [(2,)]], results)
+
+    def test_submit_error(self):
+        """the error of a task is raised in the calling thread"""
+        def fail():
+            raise Exception('write failed')
+        self.writer.submit(fail)
+        self.assertRaises(Exception, self.writer.wait)
+        self.writer.insert('run_infos', ['last_iteration'], (1,))
+        self.writer.flush()
+        self.assertEquals([(1,)], self.__query('select * from run_infos'))
+
+    def test_number_or_default(self):
+        """masked values are replaced"""
+        self.assertEquals(0.5, resultdb.number_or_default(np.float64(0.5), 1.0))
+        self.assertEquals(2, resultdb.number_or_default(2, 1.0))
+        self.assertEquals(1.0, resultdb.number_or_default(np.ma.masked, 1.0))
+        self.assertEquals(1.0, resultdb.number_or_default(np.nan, 1.0))
+
+
+if __name__ == '__main__':
+    SUITE = []
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(ResultWriterTest))
+    unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))
@@ -0,0 +1,102 @@
+"""resultstore_test.py - unit tests for the resultstore module
+
+This file is part of cMonkey Python. Please see README and LICENSE for
+more information and licensing details.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import resultstore
+
+
+MOTIFS = {'upstream': {
+        2: {'motif-info': [{'motif_num': 1, 'evalue': 0.01,
+                            'pssm': [[0.1, 0.2, 0.3, 0.4], [0.4, 0.3, 0.2, 0.1]],
+                            'annotations': [{'gene': 'VNG0002', 'position': 4,
+                                             'reverse': True, 'pvalue': 0.001}],
+                            'sites': [('VNG0002', '-', 3, 0.001, 'AA', 'CG', 'TT')]},
+                           {'motif_num': 2, 'evalue': 0.5,
+                            'pssm': [[0.25, 0.25, 0.25, 0.25]],
+                            'annotations': [], 'sites': []}],
+            'pvalues': {'VNG0002': 0.5}}}}
+
+
+class ColumnarResultsTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for the columnar result store"""
+
+    def setUp(self):  # pylint; disable-msg=C0103
+        """test fixture"""
+        self.outdir = tempfile.mkdtemp(prefix='resultstore')
+        self.store_dir = os.path.join(self.outdir, resultstore.STORE_DIR)
+        writer = resultstore.ColumnarResultWriter(
+            self.store_dir, ['VNG0001', 'VNG0002', 'VNG0003'], ['cond1', 'cond2'])
+        writer.write_iteration(1, [[0, 2], [1], []], [[0, 1], [1], []],
+                               [0.25, 1.0, 1.0])
+        writer.write_iteration(2, [[0], [1, 2], [2]], [[0], [0, 1], [1]],
+                               [0.5, 0.75, 1.0], MOTIFS,
+                               {'VNG0001': 0, 'VNG0002': 1, 'VNG0003': 2})
+        self.results = resultstore.open_results(None, self.outdir)
+
+    def tearDown(self):  # pylint; disable-msg=C0103
+        """test cleanup"""
+        shutil.rmtree(self.outdir)
+
+    def test_members(self):
+        """the members and residuals of the clusters"""
+        self.assertEquals([1, 2], self.results.iterations())
+        self.assertEquals(['VNG0001', 'VNG0003'],
+                          self.results.rows_for_cluster(1, 1))
+        self.assertEquals(['cond2'], self.results.columns_for_cluster(1, 2))
+        self.assertEquals([], self.results.rows_for_cluster(1, 3))
+        self.assertEquals(['VNG0002', 'VNG0003'],
+                          self.results.rows_for_cluster(2, 2))
+        self.assertEquals(0.75, self.results.cluster_residual(2, 2))
+        self.assertEquals([], self.results.rows_for_cluster(3, 1))
+        self.assertEquals(None, self.results.cluster_residual(3, 1))
+
+    def test_motifs(self):
+        """the motifs of an iteration"""
+        self.assertEquals([], self.results.motif_infos(1))
+        self.assertEquals([(0, 2, 'upstream', 1, 0.01),
+                           (1, 2, 'upstream', 2, 0.5)],
+                          self.results.motif_infos(2, 2))
+        self.assertEquals([], self.results.motif_infos(2, 1))
+        self.assertEquals({0: [[0.1, 0.2, 0.3, 0.4], [0.4, 0.3, 0.2, 0.1]],
+                           1: [[0.25, 0.25, 0.25, 0.25]]},
+                          self.results.motif_pssms(2))
+        self.assertEquals([(0, 'upstream', 1, 'VNG0002', 4, True, 0.001)],
+                          self.results.motif_annotations(2, 2))
+        self.assertEquals([], self.results.motif_annotations(2, 1))
+
+    def test_existing_store(self):
+        """a new writer keeps the iterations of the store"""
+        writer = resultstore.ColumnarResultWriter(self.store_dir, [], [])
+        writer.write_iteration(3, [[1], [], []], [[0], [], []], [1.0, 1.0, 1.0])
+        results = resultstore.open_results(None, self.outdir)
+        self.assertEquals([1, 2, 3], results.iterations())
+        self.assertEquals(['VNG0002'], results.rows_for_cluster(3, 1))
+
+    def test_remove_after(self):
+        """the iterations after the specified one are removed"""
+        writer = resultstore.ColumnarResultWriter(self.store_dir, [], [])
+        orphan = os.path.join(self.store_dir, 'iteration-0003.npz')
+        with open(orphan, 'w') as outfile:
+            outfile.write('incomplete')
+        writer.remove_after(1)
+        results = resultstore.open_results(None, self.outdir)
+        self.assertEquals([1], results.iterations())
+        self.assertEquals(['VNG0001', 'VNG0003'], results.rows_for_cluster(1, 1))
+        self.assertEquals(['iteration-0001.npz', resultstore.MANIFEST_FILE],
+                          sorted(os.listdir(self.store_dir)))
+
+    def test_open_sqlite_results(self):
+        """without a store, the results are read from the database"""
+        self.assertTrue(isinstance(resultstore.open_results(None, self.store_dir),
+                                   resultstore.SQLiteResults))
+
+
+if __name__ == '__main__':
+    SUITE = []
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(ColumnarResultsTest))
+    unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))
@@ -6,6 +6,7 @@ more information and licensing details.
 import unittest
 import os
 import re
+import numpy
 import seqtools as st
 
 
@@ -70,6 +71,16 @@ class SeqtoolsTest(unittest.TestCase):  # pylint: disable-msg=R0904
         self.assertEquals(2, counts['AT'])
         self.assertEquals(2, counts['CA'])
 
+    def test_subseq_counts_mixed(self):
+        """test subseq_counts() with other letters and short sequences"""
+        seqs = ["ACXGTNNAC", "AC", "", "TTXACGTAC"]
+        expected = {}
+        for seq in seqs:
+            for index in range(len(seq) - 2):
+                expected[seq[index:index + 3]] = expected.get(seq[index:index + 3], 0) + 1
+        self.assertEquals(expected, st.subseq_counts(seqs, 3))
+        self.assertEquals({}, st.subseq_counts(["AC"], 3))
+
     def test_subseq_frequencies_1(self):
         """test subseq_frequencies() with length 1"""
         freqs = st.subseq_frequencies(["ACCGTATA", "CACAT"], 1)
@@ -112,6 +123,15 @@ class SeqtoolsTest(unittest.TestCase):  # pylint: disable-msg=R0904
         newseq = st.replace_degenerate_residues(seqs)[0]
         self.assertTrue(re.match('ACGT[GA][TC] [GT][AC][GC][AT][GATC]', newseq) != None)
 
+    def test_replace_degenerate_residues_seeded(self):
+        """the same random state gives the same replacements"""
+        seqs = ['NNNNNNNNNNRYKM', 'SWNNNNNNNNNNNN']
+        newseqs1 = st.replace_degenerate_residues(seqs, numpy.random.RandomState(42))
+        newseqs2 = st.replace_degenerate_residues(seqs, numpy.random.RandomState(42))
+        self.assertEquals(newseqs1, newseqs2)
+        self.assertEquals([14, 14], [len(seq) for seq in newseqs1])
+        self.assertTrue(re.match('[ACGT]+$', newseqs1[0] + newseqs1[1]) != None)
+
 
 class FastaTest(unittest.TestCase):  # pylint: disable-msg=R0904
     """Test class for FASTA related functions"""
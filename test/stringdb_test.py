@@ -0,0 +1,77 @@
+"""stringdb_test.py - unit tests for the stringdb module
+
+This file is part of cMonkey Python. Please see README and LICENSE for
+more information and licensing details.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import util
+import stringdb
+
+
+STRING_FILE = 'testdata/string_links_64091.tab'
+
+
+class StringDbTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for the STRING edge tables"""
+
+    def setUp(self):  # pylint; disable-msg=C0103
+        """test fixture"""
+        self.cache_dir = tempfile.mkdtemp(prefix='stringdb')
+
+    def tearDown(self):  # pylint; disable-msg=C0103
+        """test cleanup"""
+        shutil.rmtree(self.cache_dir)
+
+    def __edges(self, node_names, edges):
+        """the edge table as a list of tuples"""
+        return [(node_names[node1], node_names[node2], score)
+                for node1, node2, score in edges.tolist()]
+
+    def test_read_edge_table(self):
+        """the edge table contains the first occurrence of each edge"""
+        added = set()
+        expected = []
+        for line in util.read_dfile(STRING_FILE).lines:
+            if line[0] != line[1] and (line[0], line[1]) not in added:
+                expected.append((line[0], line[1], float(line[2])))
+            added.add((line[0], line[1]))
+            added.add((line[1], line[0]))
+        node_names, edges = stringdb.read_edge_table('hal', STRING_FILE)
+        self.assertEquals(expected, self.__edges(node_names, edges))
+
+    def test_read_edge_table_patched(self):
+        """names that are equal after patching are the same node"""
+        path = os.path.join(self.cache_dir, 'links.tab')
+        with open(path, 'w') as outfile:
+            outfile.write('CA_0001\tCA0002\t900.0\n')
+            outfile.write('CA0002\tCA0001\t800.0\n')
+            outfile.write('CA0001\tCA_0001\t700.0\n')
+            outfile.write('CA0001\tCA0003\t600.0\n')
+        node_names, edges = stringdb.read_edge_table('cac', path)
+        self.assertEquals([('CA0001', 'CA0002', 900.0),
+                           ('CA0001', 'CA0003', 600.0)],
+                          self.__edges(node_names, edges))
+
+    def test_read_cached_edge_table(self):
+        """the cached table is the same as the parsed one and mapped into
+        memory"""
+        node_names, edges = stringdb.read_edge_table('hal', STRING_FILE)
+        stringdb.read_cached_edge_table('hal', STRING_FILE,
+                                        cache_dir=self.cache_dir)
+        cached_names, cached_edges = stringdb.read_cached_edge_table(
+            'hal', STRING_FILE, cache_dir=self.cache_dir)
+        self.assertEquals(node_names, cached_names)
+        self.assertTrue(isinstance(cached_edges, np.memmap))
+        self.assertTrue(np.array_equal(edges, cached_edges))
+        self.assertEquals(1, len(os.listdir(os.path.join(self.cache_dir,
+                                                         'string-edges'))))
+
+
+if __name__ == '__main__':
+    SUITE = []
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(StringDbTest))
+    unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))
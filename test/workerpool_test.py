@@ -0,0 +1,121 @@
+"""workerpool_test.py - unit tests for the workerpool module
+
+This file is part of cMonkey Python. Please see README and LICENSE for
+more information and licensing details.
+"""
+import os
+import unittest
+import numpy as np
+import workerpool
+
+# globals that are shared with the workers
+SHARED_OFFSET = None
+SHARED_FUNC = None
+
+
+def add_offset(value):
+    """task function, depends on the shared offset"""
+    return value + SHARED_OFFSET
+
+
+def apply_func(value):
+    """task function, depends on the shared function"""
+    return SHARED_FUNC(value)
+
+
+def describe_array(name):
+    """returns whether the shared array is memory-mapped, whether it is
+    writeable and its sum"""
+    array = globals()[name]
+    return (isinstance(array, np.memmap), array.flags.writeable,
+            float(array.sum()))
+
+
+def worker_pid(_):
+    """returns the process id of the worker"""
+    return os.getpid()
+
+
+class WorkerPoolTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for WorkerPool"""
+
+    def setUp(self):  # pylint; disable-msg=C0103
+        """test fixture"""
+        self.pool = workerpool.WorkerPool(2)
+
+    def tearDown(self):  # pylint; disable-msg=C0103
+        """test cleanup"""
+        self.pool.close()
+
+    def test_share_refresh(self):
+        """shared values are refreshed in the running workers"""
+        self.pool.share(__name__, 'SHARED_OFFSET', 1)
+        self.assertEquals([1, 2, 3], self.pool.map(add_offset, [0, 1, 2]))
+        pids = set(self.pool.map(worker_pid, range(20)))
+
+        self.pool.share(__name__, 'SHARED_OFFSET', 10)
+        self.assertEquals([10, 11, 12], self.pool.map(add_offset, [0, 1, 2]))
+        # a task does not necessarily run in every worker, but restarted
+        # workers would add new process ids
+        pids.update(self.pool.map(worker_pid, range(20)))
+        self.assertTrue(len(pids) <= 2)
+
+    def test_share_unpicklable(self):
+        """values that can not be pickled are passed by restarting the workers"""
+        self.pool.share(__name__, 'SHARED_FUNC', lambda x: x * 2, readonly=True)
+        self.assertEquals([0, 2, 4], self.pool.map(apply_func, [0, 1, 2]))
+        self.pool.share(__name__, 'SHARED_FUNC', lambda x: x * 3, readonly=True)
+        self.assertEquals([0, 3, 6], self.pool.map(apply_func, [0, 1, 2]))
+
+    def test_share_inherited(self):
+        """the values shared before the workers are started are inherited
+        and not loaded again"""
+        self.pool.share(__name__, 'SHARED_OFFSET', np.arange(10000.0),
+                        readonly=True)
+        self.assertEquals([(False, True, 49995000.0)],
+                          self.pool.map(describe_array, ['SHARED_OFFSET']))
+
+    def test_share_arrays(self):
+        """large arrays are attached to as read-only memory maps, small
+        ones are pickled"""
+        # start the workers, so the values are transferred through files
+        self.pool.map(worker_pid, range(2))
+        self.pool.share(__name__, 'SHARED_OFFSET', np.arange(10000.0),
+                        readonly=True)
+        self.pool.share(__name__, 'SHARED_FUNC', np.ones(3))
+        self.assertEquals([(True, False, 49995000.0)],
+                          self.pool.map(describe_array, ['SHARED_OFFSET']))
+        self.assertEquals([(False, True, 3.0)],
+                          self.pool.map(describe_array, ['SHARED_FUNC']))
+
+    def test_share_readonly_replaced(self):
+        """a read-only value is written once while it is shared, the files
+        of a replaced value are removed"""
+        def state_files():
+            """the files in the state directory of the pool"""
+            return sorted(os.listdir(self.pool._WorkerPool__statedir))
+
+        array = np.arange(10000.0)
+        self.pool.share(__name__, 'SHARED_OFFSET', array, readonly=True)
+        files = state_files()
+        self.pool.share(__name__, 'SHARED_OFFSET', array, readonly=True)
+        self.assertEquals(files, state_files())
+
+        self.pool.share(__name__, 'SHARED_OFFSET', np.ones(10000), readonly=True)
+        self.assertEquals(len(files), len(state_files()))
+        self.assertFalse(set(files) & set(state_files()))
+        self.assertEquals([10000.0], [description[2] for description in
+                                      self.pool.map(describe_array,
+                                                    ['SHARED_OFFSET'])])
+
+    def test_pool_map_without_pool(self):
+        """pool_map() falls back to a temporary pool"""
+        global SHARED_OFFSET
+        SHARED_OFFSET = 5
+        self.assertEquals([5, 6], workerpool.pool_map(None, add_offset, [0, 1]))
+
+
+if __name__ == '__main__':
+    SUITE = []
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(WorkerPoolTest))
+    unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))
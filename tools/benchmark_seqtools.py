@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# vi: sw=4 ts=4 et:
+"""benchmark_seqtools.py
+Compares the run times of the sequence kernels in seqtools with the
+pure Python implementations they replaced: reverse complement, k-mer
+counting, degenerate residue replacement and the Markov background.
+
+The genome is read from a FASTA file, e.g. a bacterial genome from RSAT.
+Without a file, a random genome of the size of E. coli is used.
+
+    python tools/benchmark_seqtools.py [genome.fasta]
+
+This file is part of cMonkey Python. Please see README and LICENSE for
+more information and licensing details.
+"""
+import os
+import re
+import sys
+import time
+import random
+import argparse
+import numpy as np
+
+# the cmonkey modules, tools/util.py would hide the cmonkey util module
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'cmonkey'))
+import seqtools as st
+
+REV_DICT = {'A': 'T', 'G': 'C', 'C': 'G', 'T': 'A'}
+
+
+def old_revcomp(sequence):
+    """the reverse complement with a function call per letter"""
+    def revchar(nucleotide):
+        nucleotide = nucleotide.upper()
+        if nucleotide in REV_DICT:
+            return REV_DICT[nucleotide]
+        else:
+            return nucleotide
+    return "".join([revchar(c) for c in sequence[::-1]])
+
+
+def old_subseq_counts(seqs, subseq_len):
+    """the k-mer counts with a dictionary"""
+    counts = {}
+    for seq in seqs:
+        for index in xrange(0, len(seq) - subseq_len + 1):
+            subseq = seq[index:index + subseq_len]
+            if not subseq in counts:
+                counts[subseq] = 0
+            counts[subseq] += 1
+    return counts
+
+
+def old_replace_degenerate_residues(seqs):
+    """the degenerate residue replacement with a regular expression"""
+    replacements = {'R': ['G', 'A'], 'Y': ['T', 'C'], 'K': ['G', 'T'],
+                    'M': ['A', 'C'], 'S': ['G', 'C'], 'W': ['A', 'T'],
+                    'N': ['G', 'A', 'T', 'C'],
+                    ' ': [' ']}
+    pat = re.compile('[ACGTX]*([^ACGTX])[ACGTX]*')
+    result = []
+    for seq in seqs:
+        seq = seq.strip()
+        for match in pat.finditer(seq):
+            replace_chars = replacements[seq[match.start(1)]]
+            replace_char = replace_chars[random.randint(
+                0, len(replace_chars) - 1)]
+            seq = seq[:match.start(1)] + replace_char + seq[match.end(1):]
+        result.append(seq)
+    return result
+
+
+def old_markov_background(seqs, order):
+    """the Markov background with the old kernels"""
+    result = []
+    seqs = old_replace_degenerate_residues(seqs)
+    for subseq_len in xrange(1, order + 2):
+        counts = old_subseq_counts(seqs, subseq_len)
+        total = float(sum(counts.values()))
+        result.append({subseq: count / total
+                       for subseq, count in counts.items()})
+    return result
+
+
+def read_genome(path):
+    """reads the contigs of a FASTA file"""
+    with open(path) as infile:
+        return [seq.upper()
+                for _, seq in st.read_sequences_from_fasta_string(infile.read())]
+
+
+def random_genome(length, num_degenerate):
+    """a random genome with some degenerate residues"""
+    letters = np.frombuffer('ACGT', dtype='uint8')
+    data = letters[np.random.randint(0, 4, length)]
+    data[np.random.randint(0, length, num_degenerate)] = ord('N')
+    return [data.tostring()]
+
+
+def upstream_seqs(genome, length=250, step=1000):
+    """cuts the genome into upstream sized pieces, about one per gene"""
+    return [contig[start:start + length] for contig in genome
+            for start in xrange(0, len(contig) - length, step)]
+
+
+def timed(label, old_func, new_func):
+    """runs both implementations and prints their times"""
+    start = time.time()
+    old_func()
+    old_time = time.time() - start
+    start = time.time()
+    new_func()
+    new_time = time.time() - start
+    print "%-28s old: %8.3f s  new: %8.3f s  speedup: %6.1fx" % (
+        label, old_time, new_time, old_time / max(new_time, 1e-9))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='seqtools benchmark')
+    parser.add_argument('genome', nargs='?', help='genome FASTA file')
+    parser.add_argument('--order', type=int, default=3,
+                        help='order of the Markov background')
+    args = parser.parse_args()
+
+    if args.genome:
+        genome = read_genome(args.genome)
+    else:
+        genome = random_genome(4641652, 1000)
+    seqs = upstream_seqs(genome)
+    print "genome: %d bp in %d contigs, %d upstream sequences" % (
+        sum(len(contig) for contig in genome), len(genome), len(seqs))
+
+    timed('revcomp (genome)',
+          lambda: [old_revcomp(contig) for contig in genome],
+          lambda: [st.revcomp(contig) for contig in genome])
+    timed('revcomp (upstream)',
+          lambda: [old_revcomp(seq) for seq in seqs],
+          lambda: [st.revcomp(seq) for seq in seqs])
+    for subseq_len in [1, args.order + 1]:
+        timed('%d-mer counts (genome)' % subseq_len,
+              lambda: old_subseq_counts(genome, subseq_len),
+              lambda: st.subseq_counts(genome, subseq_len))
+    timed('degenerate residues (genome)',
+          lambda: old_replace_degenerate_residues(genome),
+          lambda: st.replace_degenerate_residues(genome))
+    timed('markov background (upstream)',
+          lambda: old_markov_background(seqs, args.order),
+          lambda: st.markov_background(seqs, args.order))